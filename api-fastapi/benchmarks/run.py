@@ -0,0 +1,244 @@
+"""
+Benchmarks of the transformations API on synthetic production data.
+
+Run from the api-fastapi directory, e.g.:
+
+    python benchmarks/run.py --rows 500000 --tags 40 --output results.json
+    python benchmarks/run.py --output new.json --compare results.json
+
+The asgi mode posts requests through the FastAPI app in-process and needs
+the same settings (.env files) as the server.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic import TARGET_VARIABLE, alertman_frame, dataset, production_frame
+from analysis.pipeline import (
+    calculate_point_correlation,
+    calculate_variable_stats,
+    filter_uptime,
+    get_product_batches,
+    get_reco_tags,
+    run_batch_details,
+    run_process_data,
+)
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process, worker processes are not included."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 ** 2
+
+def summarize(name: str, durations: List[float], rows: int) -> Dict[str, Any]:
+    """Latency percentiles and throughput of a benchmark case."""
+    latencies = np.array(durations) * 1000
+    total = sum(durations)
+    return {
+        'name': name,
+        'iterations': len(durations),
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'min': float(latencies.min()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max()),
+        },
+        'throughput_rps': len(durations) / total if total else None,
+        'rows_per_s': rows * len(durations) / total if total else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def measure(fn: Callable[[], Any], setup: Callable[[], Any], iterations: int, warmup: int) -> List[float]:
+    """Time fn(setup()) calls, setup is not timed."""
+    durations = []
+    for i in range(warmup + iterations):
+        args = setup()
+        start = time.perf_counter()
+        fn(args)
+        if i >= warmup:
+            durations.append(time.perf_counter() - start)
+    return durations
+
+def inprocess_cases(df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                    batch_id: Any) -> Dict[str, Dict[str, Any]]:
+    """Benchmark cases calling the pipeline functions directly."""
+    reco_tags = get_reco_tags(df_alertman)
+    product_batches = get_product_batches(df_alertman)
+    batch_data = df_production[df_production['BATCH'] == batch_id].copy()
+    batch_data['DateTime'] = pd.to_datetime(batch_data['DateTime'])
+    uptime_data = filter_uptime(batch_data, TARGET_VARIABLE, reco_tags)
+
+    return {
+        'process_data': {
+            'rows': len(df_production),
+            'setup': df_production.copy,
+            'fn': lambda df: run_process_data(df, TARGET_VARIABLE, reco_tags, product_batches),
+        },
+        'batch_details': {
+            'rows': len(df_production),
+            'setup': df_production.copy,
+            'fn': lambda df: run_batch_details(df, batch_id, TARGET_VARIABLE, reco_tags),
+        },
+        'variable_stats': {
+            'rows': len(uptime_data),
+            'setup': lambda: uptime_data,
+            'fn': lambda df: calculate_variable_stats(df, batch_id, TARGET_VARIABLE),
+        },
+        'point_correlation': {
+            'rows': len(batch_data),
+            'setup': lambda: batch_data,
+            'fn': lambda df: calculate_point_correlation(df, reco_tags[0], TARGET_VARIABLE),
+        },
+    }
+
+async def measure_asgi(path: str, body: bytes, iterations: int, warmup: int, concurrency: int) -> List[float]:
+    """Time POST requests through the FastAPI app, with the result cache cleared before each one."""
+    import httpx
+    from fastapi import FastAPI
+    from api import transformations
+
+    app = FastAPI()
+    app.include_router(transformations.router, prefix='/api')
+
+    async def post(client: httpx.AsyncClient) -> float:
+        transformations.result_cache.clear()
+        start = time.perf_counter()
+        response = await client.post(path, content=body, headers={'content-type': 'application/json'})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark/api', timeout=None) as client:
+        for _ in range(warmup):
+            await post(client)
+
+        durations = []
+        while len(durations) < iterations:
+            count = min(concurrency, iterations - len(durations))
+            durations.extend(await asyncio.gather(*(post(client) for _ in range(count))))
+
+    transformations.executor.shutdown()
+    return durations
+
+def asgi_bodies(df_production: pd.DataFrame, df_alertman: pd.DataFrame, batch_id: Any,
+                layout: str) -> Dict[str, bytes]:
+    """Request bodies of the asgi cases, encoded once up front."""
+    common = {
+        'production_data': dataset(df_production, layout),
+        'alertman_data': dataset(df_alertman),
+        'target_variable': TARGET_VARIABLE,
+    }
+    return {
+        'process-data': json.dumps(common).encode(),
+        'batch-details': json.dumps({**common, 'batch_id': batch_id}).encode(),
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """
+    Print the p50 latency of each case against a previous run.
+
+    Returns:
+        Whether any case got slower than threshold times its baseline
+    """
+    previous = {result['name']: result for result in baseline['results']}
+    regressed = False
+
+    print(f"\n{'case':32} {'baseline p50':>14} {'p50':>10} {'ratio':>8}")
+    for result in results['results']:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        ratio = result['latency_ms']['p50'] / before['latency_ms']['p50']
+        flag = ' REGRESSION' if ratio > threshold else ''
+        regressed |= ratio > threshold
+        print(f"{result['name']:32} {before['latency_ms']['p50']:>12.1f}ms {result['latency_ms']['p50']:>8.1f}ms {ratio:>8.2f}{flag}")
+
+    return regressed
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='production rows')
+    parser.add_argument('--batches', type=int, default=200, help='number of batches')
+    parser.add_argument('--tags', type=int, default=20, help='number of process tags')
+    parser.add_argument('--reco-tags', type=int, default=None, help='tags with recommendations, defaults to all')
+    parser.add_argument('--recommendations', type=int, default=20, help='number of recommendation batches')
+    parser.add_argument('--nan-ratio', type=float, default=0.02, help='share of missing tag values')
+    parser.add_argument('--uptime-ratio', type=float, default=0.85, help='share of Uptime rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['inprocess', 'asgi', 'all'], default='inprocess')
+    parser.add_argument('--cases', nargs='*', default=None, help='case names to run, defaults to all')
+    parser.add_argument('--layout', choices=['items', 'columns'], default='items', help='dataset layout of asgi bodies')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent asgi requests')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.1, help='p50 ratio above which a case counts as regressed')
+    args = parser.parse_args(argv)
+
+    df_production = production_frame(args.rows, args.batches, args.tags, args.nan_ratio, args.uptime_ratio, args.seed)
+    df_alertman = alertman_frame(df_production, args.recommendations, args.reco_tags, seed=args.seed)
+    batch_id = df_production['BATCH'].iloc[len(df_production) // 2]
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': [],
+    }
+
+    def report(result: Dict[str, Any]):
+        latency = result['latency_ms']
+        print(f"{result['name']:32} p50 {latency['p50']:9.1f}ms  p90 {latency['p90']:9.1f}ms  "
+              f"p99 {latency['p99']:9.1f}ms  {result['throughput_rps']:8.2f} req/s  rss {result['peak_rss_mb']:8.0f}MB")
+        results['results'].append(result)
+
+    if args.mode in ('inprocess', 'all'):
+        for name, case in inprocess_cases(df_production, df_alertman, batch_id).items():
+            if args.cases and name not in args.cases:
+                continue
+            durations = measure(case['fn'], case['setup'], args.iterations, args.warmup)
+            report(summarize(f'inprocess.{name}', durations, case['rows']))
+
+    if args.mode in ('asgi', 'all'):
+        for name, body in asgi_bodies(df_production, df_alertman, batch_id, args.layout).items():
+            if args.cases and name not in args.cases:
+                continue
+            durations = asyncio.run(measure_asgi(f'/transformations/{name}', body, args.iterations,
+                                                 args.warmup, args.concurrency))
+            result = summarize(f'asgi.{name}', durations, len(df_production))
+            result['body_bytes'] = len(body)
+            report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+TARGET_VARIABLE = 'target'
+
+def tag_names(tags: int) -> List[str]:
+    """Names of the synthetic process tags."""
+    return [f'TAG_{i:03d}' for i in range(tags)]
+
+def production_frame(rows: int = 100_000, batches: int = 200, tags: int = 20, nan_ratio: float = 0.02,
+                     uptime_ratio: float = 0.85, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate minute-level production data shaped like the production_data datasource.
+
+    Batches follow each other in time with random lengths. Each tag has a
+    per-batch setpoint plus noise and a slow drift, and the target depends
+    on the first few tags, so correlations and deviations are meaningful.
+    Timestamps are ISO strings, as in JSON request bodies.
+
+    Args:
+        rows: Number of rows
+        batches: Number of batches
+        tags: Number of process tags
+        nan_ratio: Share of missing tag values
+        uptime_ratio: Share of Uptime rows, the rest is Downtime or Idle
+        seed: Random seed
+
+    Returns:
+        DataFrame of production records
+    """
+    rng = np.random.default_rng(seed)
+    batches = max(1, min(batches, rows))
+
+    # Random batch lengths summing up to rows, at least one row each
+    lengths = rng.multinomial(rows - batches, rng.dirichlet(np.full(batches, 5.0))) + 1
+    batch_index = np.repeat(np.arange(batches), lengths)
+    batch_ids = np.array([f'B{100000 + i}' for i in range(batches)])
+
+    times = pd.date_range('2024-01-01', periods=rows, freq='min')
+    time_strings = times.strftime('%Y-%m-%dT%H:%M:%S').to_numpy()
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    names = tag_names(tags)
+    scales = rng.uniform(1, 1000, tags)
+    setpoints = scales * (1 + rng.normal(0, 0.05, (batches, tags)))
+    drift = np.linspace(0, 1, rows)[:, None] * rng.normal(0, 0.01, tags) * scales
+    values = setpoints[batch_index] + drift + rng.normal(0, 0.02, (rows, tags)) * scales
+
+    weights = rng.normal(0, 1, min(tags, 5))
+    target = 100 + (values[:, :len(weights)] / scales[:len(weights)]) @ weights + rng.normal(0, 0.5, rows)
+
+    values[rng.random((rows, tags)) < nan_ratio] = np.nan
+
+    run_state = np.where(
+        rng.random(rows) < uptime_ratio, 'Uptime',
+        np.where(rng.random(rows) < 0.5, 'Downtime', 'Idle')
+    )
+
+    df = pd.DataFrame(values, columns=names)
+    df.insert(0, 'DateTime', time_strings)
+    df.insert(1, 'minute_level', time_strings)
+    df.insert(2, 'BATCH', batch_ids[batch_index])
+    df.insert(3, 'BATCHSTART', time_strings[starts][batch_index])
+    df.insert(4, 'run_state', run_state)
+    df.insert(5, 'part_number', np.where(batch_index % 3 == 0, 'PF1-A100', 'PF1-B200'))
+    df[TARGET_VARIABLE] = target
+    return df
+
+def alertman_frame(df_production: pd.DataFrame, recommendations: int = 20, tags: Optional[int] = None,
+                   decision_ratio: float = 0.8, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate alertman records with recommendations for some batches of production data.
+
+    Args:
+        df_production: Production data, see production_frame
+        recommendations: Number of recommendation batches
+        tags: Number of tags recommendations are made on, defaults to all tags
+        decision_ratio: Share of recommendation records with a decision
+        seed: Random seed
+
+    Returns:
+        DataFrame of alertman records
+    """
+    rng = np.random.default_rng(seed)
+    names = [col for col in df_production.columns if col.startswith('TAG_')]
+    if tags is not None:
+        names = names[:tags]
+
+    batches = df_production['BATCH'].unique()
+    recommended = batches[np.linspace(0, len(batches) - 1, min(recommendations, len(batches))).astype(int)]
+
+    records = [
+        {
+            'state__extra__batch_id': batch,
+            'tag': tag,
+            'decision': 'accepted' if rng.random() < decision_ratio else '',
+            'part_family': 'PF1',
+        }
+        for batch in recommended
+        for tag in names
+    ]
+    return pd.DataFrame.from_records(records)
+
+def dataset(df: pd.DataFrame, layout: str = 'items') -> Dict[str, Any]:
+    """
+    Convert a DataFrame to a request dataset, with null for missing values.
+
+    Args:
+        df: DataFrame to convert
+        layout: 'items' for {"items": [records]} or 'columns' for {"columns": {name: [values]}}
+
+    Returns:
+        Dataset as sent in request bodies
+    """
+    values = df.astype(object).where(df.notna(), None)
+    if layout == 'columns':
+        return {'columns': {col: values[col].tolist() for col in values.columns}}
+    return {'items': values.to_dict('records')}
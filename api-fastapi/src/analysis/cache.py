@@ -0,0 +1,156 @@
+import sys
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from typing import Any, FrozenSet, Hashable, Iterable, Optional
+from cachetools import LRUCache, TTLCache
+
+# Items of long lists measured to estimate their size
+SIZE_SAMPLE_ITEMS = 64
+
+def dataset_fingerprint(df: pd.DataFrame, columns: Optional[Iterable[Any]] = None) -> Optional[str]:
+    """
+    Compute a content fingerprint of a dataset.
+
+    Column order does not matter, row order does (it decides the batch order).
+
+    Args:
+        df: DataFrame to fingerprint
+        columns: Optional columns to restrict the fingerprint to, so that
+            changes in columns a computation does not read keep the same key
+
+    Returns:
+        Hex digest of the dataset, or None if it holds unhashable values
+    """
+    if columns is None:
+        columns = df.columns
+    columns = sorted(set(columns).intersection(df.columns), key=str)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([str(col) for col in columns]).encode())
+    digest.update(str(len(df)).encode())
+
+    if columns:
+        try:
+            row_hashes = pd.util.hash_pandas_object(df[columns], index=False)
+        except TypeError:
+            return None
+        digest.update(row_hashes.to_numpy().tobytes())
+
+    return digest.hexdigest()
+
+def freeze(value: Any) -> Hashable:
+    """Turn request parameters (lists, sets, dicts) into a hashable cache key part."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((freeze(item) for item in value), key=repr))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def cache_key(*parts: Any) -> Optional[Hashable]:
+    """Build a cache key, or None if any part (e.g. a fingerprint) is missing."""
+    if any(part is None for part in parts):
+        return None
+    return freeze(parts)
+
+def result_size(value: Any) -> int:
+    """
+    Estimate the memory held by a transformation result, in bytes.
+
+    Long lists, such as row records, are estimated from a sample of their items.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_size(key) + result_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        size = sys.getsizeof(value)
+        if len(value) > SIZE_SAMPLE_ITEMS:
+            sample = [value[i] for i in np.linspace(0, len(value) - 1, SIZE_SAMPLE_ITEMS).astype(int)]
+            return size + sum(result_size(item) for item in sample) * len(value) // SIZE_SAMPLE_ITEMS
+        return size + sum(result_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class ResultCache:
+    """
+    LRU cache of transformation results bounded by entry count and, if
+    max_bytes is set, by the estimated memory of the entries (see
+    result_size), with optional TTL and hit/miss counters.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Bounded by bytes, the entry count is enforced on set
+        capacity, getsizeof = (max_bytes, result_size) if max_bytes else (maxsize, None)
+        self.cache = (
+            TTLCache(maxsize=capacity, ttl=ttl, getsizeof=getsizeof) if ttl
+            else LRUCache(maxsize=capacity, getsizeof=getsizeof)
+        )
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def keys(self) -> FrozenSet[Hashable]:
+        """Get the keys of the cached results, for jobs to skip computing them (see analysis.jobs)."""
+        if self.maxsize <= 0:
+            return frozenset()
+
+        with self.lock:
+            return frozenset(self.cache.keys())
+
+    def miss(self):
+        """Count a result computed outside of get, see keys."""
+        with self.lock:
+            self.misses += 1
+
+    def get(self, key: Optional[Hashable]) -> Any:
+        if key is None or self.maxsize <= 0:
+            return None
+
+        with self.lock:
+            value = self.cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: Optional[Hashable], value: Any):
+        if key is None or self.maxsize <= 0:
+            return
+
+        with self.lock:
+            try:
+                self.cache[key] = value
+            except ValueError:
+                # Larger than the whole cache
+                return
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem()
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.cache),
+                'maxsize': self.maxsize,
+                'bytes': self.cache.currsize if self.max_bytes else None,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0,
+            }
@@ -0,0 +1,153 @@
+import re
+import json
+import asyncio
+import httpx
+from typing import Any, Dict, Optional
+from functools import lru_cache
+from fastapi import Request, HTTPException
+
+from config import settings
+from analysis.pipeline import TransformationError
+
+QUERY_PARAMETERS = ('site', 'line', 'partFamily', 'timeRange')
+
+# Parameters are substituted into SQL, so only plain identifiers are accepted
+IDENTIFIER_PATTERN = re.compile(r'^[\w\-.]+$')
+
+FORWARDED_HEADERS = ('authorization', 'x-tenant-id')
+
+@lru_cache(maxsize=1)
+def load_datasources() -> Dict[str, Dict[str, str]]:
+    """Load the datasource query templates shared with the dashboard."""
+    with open(settings.datasources_file, 'r') as f:
+        return json.load(f)
+
+def format_query(query_template: str, **kwargs) -> str:
+    """Format query template with proper string replacements"""
+    formatted_query = query_template
+    if 'site' in kwargs:
+        site_name = kwargs['site'].replace("CCM-", "").lower()
+        formatted_query = formatted_query.replace("${site.replace(\"CCM-\", \"\").toLowerCase()}", site_name)
+    if 'line' in kwargs:
+        formatted_query = formatted_query.replace("${line.toLowerCase()}", kwargs['line'].lower())
+    if 'partFamily' in kwargs:
+        formatted_query = formatted_query.replace("${partFamily}", kwargs['partFamily'])
+    if 'timeRange' in kwargs:
+        formatted_query = formatted_query.replace("${timeRange}", str(kwargs['timeRange']))
+    return formatted_query
+
+def query_parameters(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Extract and validate the datasource query parameters of a request.
+
+    Args:
+        data: Request fields
+
+    Returns:
+        Dictionary of query parameters, or None if the request has none
+    """
+    if not any(data.get(name) for name in QUERY_PARAMETERS):
+        return None
+
+    missing = [name for name in QUERY_PARAMETERS if data.get(name) in (None, '')]
+    if missing:
+        raise TransformationError(400, {
+            "message": "Missing query parameters",
+            "fields": missing
+        })
+
+    params = {name: str(data[name]) for name in QUERY_PARAMETERS}
+    invalid = [name for name, value in params.items() if not IDENTIFIER_PATTERN.match(value)]
+    if invalid or not params['timeRange'].isdigit():
+        raise TransformationError(400, {
+            "message": "Invalid query parameters",
+            "fields": invalid or ['timeRange']
+        })
+
+    return params
+
+async def fetch_dataset(name: str, params: Dict[str, Any], headers: Dict[str, str]) -> bytes:
+    """
+    Run a datasource query through TF Nexus.
+
+    The result is not parsed here, so that multi-MB datasets are decoded
+    off the event loop, see decode_dataset.
+
+    Args:
+        name: Datasource name in the datasources file
+        params: Query parameters substituted into the template
+        headers: Headers forwarded to TF Nexus (authorization, tenant)
+
+    Returns:
+        Raw JSON query result as returned by TF Nexus ({"items": [records]})
+    """
+    query = format_query(load_datasources()[name]['query'], **params)
+
+    async with httpx.AsyncClient(base_url=f"{settings.url_tfnexus}/api") as client:
+        try:
+            response = await client.post(
+                f"/v1/datasources/{settings.tfnexus_datasource_id}/query",
+                json={"query": query},
+                headers=headers,
+                timeout=60
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=502,
+                detail={
+                    "message": f"Error fetching {name} from data source",
+                    "error": str(e)
+                }
+            )
+
+    return response.content
+
+def decode_dataset(name: str, content: bytes) -> Dict[str, Any]:
+    """
+    Decode a query result fetched by fetch_dataset.
+
+    Args:
+        name: Datasource name
+        content: Raw JSON query result
+
+    Returns:
+        Query result ({"items": [records]})
+    """
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise TransformationError(502, {
+            "message": f"Error fetching {name} from data source",
+            "error": str(e)
+        })
+
+    if isinstance(result, dict) and result.get('error'):
+        raise TransformationError(502, {
+            "message": f"Error fetching {name} from data source",
+            "error": result['error']
+        })
+
+    return result
+
+async def resolve_datasets(request: Request, params: Dict[str, Any],
+                           production: bool = True, alertman: bool = True) -> Dict[str, bytes]:
+    """
+    Fetch the production and alertman datasets for site/line/partFamily/timeRange.
+
+    Both queries run concurrently with the caller's authorization and tenant headers.
+
+    Args:
+        request: Incoming request whose headers are forwarded
+        params: Validated query parameters, see query_parameters
+        production: Whether to fetch production_data
+        alertman: Whether to fetch alertman_data
+
+    Returns:
+        Dictionary of datasource names and their raw query results, see decode_dataset
+    """
+    headers = {key: value for key, value in request.headers.items() if key.lower() in FORWARDED_HEADERS}
+    names = [name for name, wanted in (('production_data', production), ('alertman_data', alertman)) if wanted]
+
+    results = await asyncio.gather(*(fetch_dataset(name, params, headers) for name in names))
+    return dict(zip(names, results))
@@ -0,0 +1,103 @@
+import numpy as np
+from typing import Any, List
+
+DOWNSAMPLING_METHODS = ('lttb', 'minmax')
+
+# Fewest points each method can reduce a series to
+MIN_POINTS = {'lttb': 3, 'minmax': 2}
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Select points of a series with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept; from each of the n - 2 buckets in
+    between, the point forming the largest triangle with the previously
+    selected point and the mean of the next bucket is kept.
+
+    Args:
+        x: Sorted float x values
+        y: Float y values, without NaN
+        n: Number of points to select (at least 3)
+
+    Returns:
+        Sorted indices of the selected points
+    """
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+
+    # Keep the areas in a reasonable range for large x values (epoch ms)
+    x = x - x[0]
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    edges = np.append(edges, size)
+
+    selected = np.empty(n, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[a] - mean_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (mean_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Select the minimum and maximum point of each of n // 2 equal-count buckets.
+
+    Args:
+        x: Sorted float x values
+        y: Float y values, without NaN
+        n: Maximum number of points to select (at least 2)
+
+    Returns:
+        Sorted indices of the selected points
+    """
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+
+    buckets = n // 2
+    edges = np.linspace(0, size, buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+
+    # Within each bucket the values are sorted, so its minimum comes first and its maximum last
+    order = np.lexsort((y, bucket))
+    return np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1]]))
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, n: int, method: str = 'lttb') -> np.ndarray:
+    """
+    Select at most n points of a series sorted by x, see lttb_indices and minmax_indices.
+    """
+    if method == 'minmax':
+        return minmax_indices(x, y, n)
+    return lttb_indices(x, y, n)
+
+def downsample_points(points: List[List[Any]], max_points: int, method: str = 'lttb') -> List[List[Any]]:
+    """
+    Downsample a [x, y, ...] point series sorted by x, such as a correlation series.
+
+    Args:
+        points: Points as lists starting with their x and y values (y may be None)
+        max_points: Maximum number of points to keep
+        method: 'lttb' or 'minmax'
+
+    Returns:
+        Kept points in order
+    """
+    if len(points) <= max_points:
+        return points
+
+    x = np.array([point[0] for point in points], dtype=float)
+    y = np.array([np.nan if point[1] is None else point[1] for point in points], dtype=float)
+
+    # Points without a y value are left out
+    positions = np.flatnonzero(~np.isnan(y))
+    return [points[i] for i in positions[downsample_indices(x[positions], y[positions], max_points, method)]]
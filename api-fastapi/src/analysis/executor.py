@@ -0,0 +1,130 @@
+import time
+import random
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from fastapi import HTTPException
+
+from analysis.timing import current_timer, timed_call
+
+class PipelineExecutor:
+    """
+    Runs CPU-bound transformation jobs off the event loop.
+
+    Jobs run in a pool of worker processes, or of threads where the work
+    mostly happens in numpy and releases the GIL. At most max_pending jobs
+    are queued or running at once; further ones are rejected with 429. A
+    job that takes longer than timeout seconds is answered with 504, and
+    keeps its worker until it finishes, so it still counts as pending.
+
+    Stage timings of the jobs (see analysis.timing) are added to the timer
+    of the calling request. A share profile_rate of the jobs runs under
+    cProfile, and the profiles of those taking at least profile_threshold
+    seconds are saved to profile_dir.
+    """
+
+    def __init__(self, kind: str = 'process', workers: int = 2, max_pending: int = 8,
+                 timeout: Optional[float] = None, profile_rate: float = 0,
+                 profile_threshold: float = 1, profile_dir: str = 'profiles'):
+        if kind not in ('process', 'thread'):
+            raise ValueError(f"Unknown executor kind '{kind}', expected 'process' or 'thread'")
+
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.profile_rate = profile_rate
+        self.profile_threshold = profile_threshold
+        self.profile_dir = profile_dir
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.pool: Optional[Executor] = None
+
+    def create_pool(self) -> Executor:
+        if self.kind == 'process':
+            # Forking a process that runs the event loop and its threads is unsafe
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transformations')
+
+    def release(self, _: Future):
+        with self.lock:
+            self.pending -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run fn(*args) in the pool and wait for its result.
+
+        Args:
+            fn: Module-level function (it is pickled for worker processes)
+            args: Arguments of the function
+
+        Returns:
+            Result of the function; its exceptions are raised as is
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=429,
+                    detail={
+                        "message": "Too many transformation jobs in progress, retry later",
+                        "max_pending": self.max_pending
+                    },
+                    headers={"Retry-After": "1"}
+                )
+
+            if self.pool is None:
+                self.pool = self.create_pool()
+            pool = self.pool
+
+            profile_threshold = self.profile_threshold if random.random() < self.profile_rate else None
+            future = pool.submit(timed_call, fn, args, time.time(), profile_threshold, self.profile_dir)
+            self.pending += 1
+
+        future.add_done_callback(self.release)
+
+        try:
+            result, stages = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail={
+                    "message": f"Transformation job timed out after {self.timeout} seconds"
+                }
+            )
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory), start over with a new pool
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            pool.shutdown(wait=False)
+            raise HTTPException(
+                status_code=500,
+                detail={
+                    "message": "Transformation worker stopped unexpectedly",
+                    "error": str(e)
+                }
+            )
+
+        timer = current_timer.get()
+        if timer is not None:
+            timer.merge(stages)
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'kind': self.kind,
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'timeout': self.timeout,
+            }
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
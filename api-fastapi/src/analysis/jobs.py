@@ -0,0 +1,471 @@
+import pandas as pd
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+from fastapi import Request, HTTPException
+
+from analysis.cache import ResultCache, cache_key, dataset_fingerprint
+from analysis.datasources import query_parameters, resolve_datasets
+from analysis.downsampling import DOWNSAMPLING_METHODS, MIN_POINTS
+from analysis.executor import PipelineExecutor
+from analysis.payload import decode_payload, fetched_frames, read_body
+from analysis.summaries import BatchSummaryStore, summary_scope
+from analysis.timing import stage
+from analysis.pipeline import (
+    DEFAULT_OUTLIER_QUANTILES,
+    OUTLIER_METHODS,
+    TransformationError,
+    get_product_batches,
+    get_reco_tags,
+    run_batch_details,
+    run_correlation_matrix,
+    run_multi_batch_details,
+    run_process_data,
+    summarize_production,
+)
+
+class JobOutcome:
+    """
+    Outcome of a transformation request job, see run_request_job.
+
+    Either the result and its cache key, the key of a result already in
+    the cache (cached), or the query parameters of the datasets to fetch
+    before running the job again (fetch).
+    """
+
+    def __init__(self, result: Any = None, key: Optional[Hashable] = None, cached: bool = False,
+                 fetch: Optional[Tuple[Dict[str, Any], bool, bool]] = None):
+        self.result = result
+        self.key = key
+        self.cached = cached
+        self.fetch = fetch
+
+def is_batch_id_list(value: Any) -> bool:
+    """Check that a request field is a non-empty list of batch IDs."""
+    return isinstance(value, list) and bool(value) and all(
+        isinstance(item, (str, int, float)) and not isinstance(item, bool) for item in value
+    )
+
+def outlier_options(value: Any) -> Optional[Dict[str, Any]]:
+    """
+    Validate the outlier filter options of a request.
+
+    Args:
+        value: Request field {"method", "quantiles", "per_batch"}, all optional
+
+    Returns:
+        Options for analysis.pipeline.filter_production, or None if not given
+    """
+    if value is None:
+        return None
+
+    method = value.get("method", "exact") if isinstance(value, dict) else None
+    quantiles = value.get("quantiles", list(DEFAULT_OUTLIER_QUANTILES)) if isinstance(value, dict) else None
+    per_batch = value.get("per_batch", False) if isinstance(value, dict) else None
+
+    valid_quantiles = (
+        isinstance(quantiles, list) and len(quantiles) == 2
+        and all(isinstance(q, (int, float)) and not isinstance(q, bool) for q in quantiles)
+        and 0 <= quantiles[0] < quantiles[1] <= 1
+    )
+    if method not in OUTLIER_METHODS or not valid_quantiles or not isinstance(per_batch, bool):
+        raise TransformationError(400, {
+            "message": "outliers must be an object with an optional method, quantiles [low, high] "
+                       "between 0 and 1, and per_batch flag",
+            "field": "outliers",
+            "supported": list(OUTLIER_METHODS)
+        })
+
+    return {"method": method, "quantiles": (float(quantiles[0]), float(quantiles[1])), "per_batch": per_batch}
+
+def correlation_window(value: Any) -> Optional[Any]:
+    """
+    Validate the rolling correlation window of a request.
+
+    Args:
+        value: Request field, a number of rows or a duration such as "30min"
+
+    Returns:
+        Window for analysis.pipeline.calculate_rolling_correlations, or None if not given
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 2:
+        return value
+    if isinstance(value, str):
+        try:
+            if pd.Timedelta(value) > pd.Timedelta(0):
+                return value
+        except ValueError:
+            pass
+
+    raise TransformationError(400, {
+        "message": "correlation_window must be a number of rows of at least 2 or a positive duration such as \"30min\"",
+        "field": "correlation_window"
+    })
+
+def fingerprint_key(cached_keys: FrozenSet[Hashable], df: pd.DataFrame, columns: List[str],
+                    *parts: Any) -> Tuple[Optional[Hashable], bool]:
+    """
+    Build the cache key of a result from the fingerprint of its data and the request parameters.
+
+    Args:
+        cached_keys: Keys of the results in the cache when the job was submitted
+        df: DataFrame to fingerprint, see dataset_fingerprint
+        columns: Columns of the DataFrame the result depends on
+        parts: Name of the transformation and its parameters
+
+    Returns:
+        Tuple of the key, None if the data cannot be fingerprinted, and
+        whether the result is already cached
+    """
+    with stage('fingerprint'):
+        fingerprint = dataset_fingerprint(df, columns)
+    key = cache_key(parts[0], fingerprint, *parts[1:])
+    return key, key is not None and key in cached_keys
+
+def run_request_job(job: Callable[..., JobOutcome], body: bytes, arrow: bool, fetched: Optional[Dict[str, bytes]],
+                    cached_keys: FrozenSet[Hashable], *args: Any) -> JobOutcome:
+    """
+    Run a transformation request from its raw body.
+
+    Decoding, frame construction, validation, fingerprinting and the
+    computation run in a single executor job, so that only the result
+    comes back from worker processes, not the DataFrames.
+
+    Args:
+        job: Module-level function job(data, df_production, df_alertman, cached_keys, *args)
+            validating the request fields and computing the result
+        body: Raw request body
+        arrow: Whether the body is an Arrow IPC stream, see analysis.payload.read_arrow_payload
+        fetched: Raw datasets fetched for the query parameters of the body,
+            None if they have not been fetched yet
+        cached_keys: Keys of the results in the cache, whose computation is skipped
+        args: Further arguments of the job
+
+    Returns:
+        Outcome of the job, or the datasets to fetch if the body gives query
+        parameters instead of some of them
+    """
+    data, df_production, df_alertman = decode_payload(body, arrow)
+
+    # The datasets that were not sent are fetched from their query parameters
+    fetch_production = df_production is None
+    fetch_alertman = df_alertman is None
+    params = query_parameters(data) if fetch_production or fetch_alertman else None
+    if params:
+        if fetched is None:
+            return JobOutcome(fetch=(params, fetch_production, fetch_alertman))
+        _, fetched_production, fetched_alertman = fetched_frames(fetched)
+        if fetch_production:
+            df_production = fetched_production
+        if fetch_alertman:
+            df_alertman = fetched_alertman
+
+    if df_production is None:
+        df_production = pd.DataFrame()
+    if df_alertman is None:
+        df_alertman = pd.DataFrame()
+    return job(data, df_production, df_alertman, cached_keys, *args)
+
+async def run_request(request: Request, executor: PipelineExecutor, result_cache: Optional[ResultCache],
+                      job: Callable[..., JobOutcome], *args: Any) -> JobOutcome:
+    """
+    Run a transformation request in the executor, see run_request_job.
+
+    Instead of the datasets themselves, the body may give the site, line,
+    partFamily and timeRange query parameters; the datasets it does not
+    contain are then fetched server-side (see analysis.datasources) and the
+    job runs again with them. The body is decoded once more then, which
+    costs little since such bodies mostly hold the parameters only.
+
+    Args:
+        request: Incoming request, see analysis.payload.read_body
+        executor: Executor of the transformation jobs
+        result_cache: Cache of the results, None for jobs whose results are not cached
+        job: See run_request_job
+        args: Further arguments of the job
+
+    Returns:
+        Outcome of the job, with the cached result if it was in the cache
+    """
+    body, arrow = await read_body(request)
+    cached_keys = result_cache.keys() if result_cache is not None else frozenset()
+    fetched = None
+
+    try:
+        outcome = await executor.run(run_request_job, job, body, arrow, fetched, cached_keys, *args)
+
+        if outcome.fetch is not None:
+            params, production, alertman = outcome.fetch
+            with stage('fetch'):
+                fetched = await resolve_datasets(request, params, production=production, alertman=alertman)
+            outcome = await executor.run(run_request_job, job, body, arrow, fetched, cached_keys, *args)
+
+        if outcome.cached:
+            outcome.result = result_cache.get(outcome.key)
+            if outcome.result is not None:
+                return outcome
+            # Evicted since the job was submitted, get counted the miss
+            outcome = await executor.run(run_request_job, job, body, arrow, fetched, frozenset(), *args)
+        elif result_cache is not None and outcome.key is not None:
+            result_cache.miss()
+    except TransformationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    if result_cache is not None:
+        result_cache.set(outcome.key, outcome.result)
+    return outcome
+
+def process_data_job(data: Dict[str, Any], df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                     cached_keys: FrozenSet[Hashable], store: Optional[BatchSummaryStore]) -> JobOutcome:
+    """
+    Calculate the deviations of a process-data request, see analysis.pipeline.run_process_data.
+
+    Args:
+        store: Optional store of per-batch statistics, used for site/line/partFamily datasets
+
+    Returns:
+        Outcome with the processed data, or an error
+    """
+    target_variable = data.get("target_variable")
+    outliers = outlier_options(data.get("outliers"))
+
+    if df_production.empty:
+        return JobOutcome({"error": "No production data available"})
+
+    if not target_variable:
+        return JobOutcome({"error": "Target variable not specified"})
+
+    # Get recommendation tags and batches from alertman data
+    reco_tags = get_reco_tags(df_alertman)
+    product_batches = get_product_batches(df_alertman)
+
+    # Closed batches of a site/line/partFamily dataset can be read from the store
+    params = query_parameters(data) if store is not None else None
+    scope = summary_scope(params, target_variable) if params else None
+
+    key, cached = fingerprint_key(
+        cached_keys, df_production, ['BATCH', 'BATCHSTART', 'minute_level', 'run_state', target_variable] + reco_tags,
+        "process-data", target_variable, set(reco_tags), set(product_batches), scope or "", outliers or ""
+    )
+    if cached:
+        return JobOutcome(key=key, cached=True)
+
+    result = run_process_data(df_production, target_variable, reco_tags, product_batches,
+                              store if scope else None, scope, outliers)
+
+    # Errors are not cached
+    return JobOutcome(result, key if "error" not in result else None)
+
+def create_session_job(data: Dict[str, Any], df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                       cached_keys: FrozenSet[Hashable]) -> JobOutcome:
+    """
+    Aggregate the initial data of a process-data session, see analysis.pipeline.summarize_production.
+
+    Returns:
+        Outcome with the per-batch summary, the outlier bounds, the aggregated
+        columns, the time column, the target variable, the recommendation
+        tags and batches, or an error
+    """
+    target_variable = data.get("target_variable")
+
+    if df_production.empty:
+        return JobOutcome({"error": "No production data available"})
+
+    if not target_variable:
+        return JobOutcome({"error": "Target variable not specified"})
+
+    reco_tags = get_reco_tags(df_alertman)
+    product_batches = get_product_batches(df_alertman)
+
+    try:
+        summary, bounds, columns, time_column = summarize_production(df_production, target_variable, reco_tags)
+    except ValueError as e:
+        return JobOutcome({"error": str(e)})
+
+    return JobOutcome({
+        "summary": summary,
+        "bounds": bounds,
+        "columns": columns,
+        "time_column": time_column,
+        "target_variable": target_variable,
+        "reco_tags": reco_tags,
+        "product_batches": product_batches
+    })
+
+def append_session_job(data: Dict[str, Any], df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                       cached_keys: FrozenSet[Hashable], target_variable: str, reco_tags: List[str],
+                       bounds: Any, columns: List[str], time_column: Optional[str]) -> JobOutcome:
+    """
+    Aggregate the new rows of a process-data session with its outlier bounds and columns.
+
+    Returns:
+        Outcome with the per-batch summary of the rows (None without rows)
+        and the recommendation batches of the alertman data, or an error
+    """
+    chunk = None
+    if not df_production.empty:
+        try:
+            chunk, _, _, _ = summarize_production(df_production, target_variable, reco_tags, bounds, columns, time_column)
+        except ValueError as e:
+            return JobOutcome({"error": str(e)})
+
+    return JobOutcome({
+        "summary": chunk,
+        "product_batches": get_product_batches(df_alertman)
+    })
+
+def batch_details_job(data: Dict[str, Any], df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                      cached_keys: FrozenSet[Hashable], ndjson: bool) -> JobOutcome:
+    """
+    Calculate the statistics of a batch-details request, see
+    analysis.pipeline.run_batch_details and run_multi_batch_details.
+
+    Args:
+        ndjson: Whether the response is streamed as newline-delimited JSON,
+            which only applies to single batches
+
+    Returns:
+        Outcome with the statistics
+    """
+    # Extract and validate required fields
+    batch_id = data.get("batch_id")
+    batch_ids = data.get("batch_ids")
+    target_variable = data.get("target_variable")
+    max_points = data.get("max_points")
+    downsampling = data.get("downsampling", "lttb")
+    window = correlation_window(data.get("correlation_window"))
+
+    if downsampling not in DOWNSAMPLING_METHODS:
+        raise TransformationError(400, {
+            "message": f"Unknown downsampling method '{downsampling}'",
+            "field": "downsampling",
+            "supported": list(DOWNSAMPLING_METHODS)
+        })
+
+    if max_points is not None and (
+        not isinstance(max_points, int) or isinstance(max_points, bool) or max_points < MIN_POINTS[downsampling]
+    ):
+        raise TransformationError(400, {
+            "message": f"max_points must be an integer of at least {MIN_POINTS[downsampling]}",
+            "field": "max_points"
+        })
+
+    if batch_ids is not None and batch_ids != "all" and not is_batch_id_list(batch_ids):
+        raise TransformationError(400, {
+            "message": "batch_ids must be a non-empty list of batch IDs or \"all\"",
+            "field": "batch_ids"
+        })
+
+    if not batch_id and batch_ids is None:
+        raise TransformationError(400, {
+            "message": "Batch ID not specified",
+            "field": "batch_id"
+        })
+
+    if not target_variable:
+        raise TransformationError(400, {
+            "message": "Target variable not specified",
+            "field": "target_variable"
+        })
+
+    if df_production.empty:
+        raise TransformationError(400, {
+            "message": "No data found in production data",
+            "error": "Empty DataFrame"
+        })
+
+    # Get recommendation tags from alertman data
+    reco_tags = get_reco_tags(df_alertman)
+
+    if not reco_tags:
+        raise TransformationError(400, {
+            "message": "No recommendation tags found in alertman data",
+            "required_columns": ["decision", "tag"]
+        })
+
+    # The rows of a single batch are downsampled for each charted series
+    series = len(dict.fromkeys(reco_tags + [target_variable]))
+    if max_points is not None and batch_ids is None and max_points < series * MIN_POINTS[downsampling]:
+        raise TransformationError(400, {
+            "message": f"max_points must be at least {series * MIN_POINTS[downsampling]} to chart "
+                       f"{series} series with {downsampling} downsampling",
+            "field": "max_points",
+            "minimum": series * MIN_POINTS[downsampling]
+        })
+
+    columns = ['DateTime', 'BATCH', 'run_state', target_variable] + reco_tags
+    if batch_ids is not None:
+        key, cached = fingerprint_key(cached_keys, df_production, columns, "batch-details", "batches", batch_ids,
+                                      target_variable, set(reco_tags), max_points or 0, downsampling, window or "")
+        if cached:
+            return JobOutcome(key=key, cached=True)
+        result = run_multi_batch_details(df_production, None if batch_ids == "all" else batch_ids, target_variable,
+                                         reco_tags, max_points, downsampling, window)
+    else:
+        key, cached = fingerprint_key(cached_keys, df_production, columns, "batch-details", batch_id, target_variable,
+                                      set(reco_tags), ndjson, max_points or 0, downsampling, window or "")
+        if cached:
+            return JobOutcome(key=key, cached=True)
+        result = run_batch_details(df_production, batch_id, target_variable, reco_tags, ndjson, max_points,
+                                   downsampling, window)
+
+    return JobOutcome(result, key)
+
+def correlation_matrix_job(data: Dict[str, Any], df_production: pd.DataFrame, df_alertman: pd.DataFrame,
+                           cached_keys: FrozenSet[Hashable]) -> JobOutcome:
+    """
+    Calculate the correlation matrix of a correlation-matrix request, see
+    analysis.pipeline.run_correlation_matrix.
+
+    Returns:
+        Outcome with the variables and their correlation matrix
+    """
+    target_variable = data.get("target_variable")
+    method = data.get("method", "pearson")
+    batch_ids = data.get("batch_ids")
+    start = data.get("start")
+    end = data.get("end")
+
+    if data.get("batch_id") and batch_ids is None:
+        batch_ids = [data["batch_id"]]
+    elif batch_ids == "all":
+        batch_ids = None
+
+    if method not in ("pearson", "spearman"):
+        raise TransformationError(400, {
+            "message": f"Unknown correlation method '{method}'",
+            "field": "method",
+            "supported": ["pearson", "spearman"]
+        })
+
+    if batch_ids is not None and not is_batch_id_list(batch_ids):
+        raise TransformationError(400, {
+            "message": "batch_ids must be a non-empty list of batch IDs",
+            "field": "batch_ids"
+        })
+
+    if df_production.empty:
+        raise TransformationError(400, {
+            "message": "No data found in production data",
+            "error": "Empty DataFrame"
+        })
+
+    reco_tags = get_reco_tags(df_alertman)
+
+    if not reco_tags:
+        raise TransformationError(400, {
+            "message": "No recommendation tags found in alertman data",
+            "required_columns": ["decision", "tag"]
+        })
+
+    variables = reco_tags + [target_variable] if target_variable else reco_tags
+
+    # Unset filters must not leave a part of the key missing, see cache_key
+    key, cached = fingerprint_key(cached_keys, df_production, ['DateTime', 'BATCH', 'run_state'] + variables,
+                                  "correlation-matrix", variables, batch_ids or "all", (start, end), method)
+    if cached:
+        return JobOutcome(key=key, cached=True)
+
+    result = run_correlation_matrix(df_production, variables, batch_ids, start, end, method)
+    return JobOutcome(result, key)
@@ -0,0 +1,282 @@
+import json
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Request, HTTPException
+
+from analysis.datasources import decode_dataset
+from analysis.pipeline import TransformationError
+from analysis.timing import stage
+
+JSON_CONTENT_TYPES = ('application/json', '')
+ARROW_CONTENT_TYPES = ('application/vnd.apache.arrow.stream',)
+
+# Schema metadata key carrying the JSON fields of an Arrow request
+ARROW_REQUEST_METADATA = b'request'
+
+# Request fields holding datasets
+DATASET_FIELDS = ('production_data', 'alertman_data')
+
+# Timestamp columns of production data, parsed once on ingestion
+TIME_COLUMNS = ('DateTime', 'minute_level', 'BATCHSTART')
+
+# String columns with at most this share of distinct values become categoricals
+CATEGORICAL_MAX_RATIO = 0.5
+
+# Largest rounding error of a float32 column, as a share of the range of its values
+FLOAT32_TOLERANCE = 1e-5
+
+def fits_float32(values: np.ndarray, narrow: np.ndarray) -> bool:
+    """
+    Check whether float64 values keep their precision as float32.
+
+    The rounding error is measured against the range of the values rather
+    than their magnitude, since the pipeline works with deviations from
+    means: sensor readings pass, while ids or epoch timestamps, whose
+    range is small next to their magnitude, stay float64.
+
+    Args:
+        values: float64 values
+        narrow: The values converted to float32
+
+    Returns:
+        Whether no value moves by more than FLOAT32_TOLERANCE of the range
+    """
+    finite = np.isfinite(values)
+    if not np.array_equal(np.isfinite(narrow), finite) or not finite.any():
+        return np.array_equal(narrow.astype(np.float64), values, equal_nan=True)
+
+    values = values[finite]
+    error = np.abs(narrow[finite].astype(np.float64) - values).max()
+    return error <= FLOAT32_TOLERANCE * (values.max() - values.min())
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce the memory of a production DataFrame in place.
+
+    - Timestamp columns are parsed to datetime64 (ISO 8601 strings only,
+      other formats are left to the pipeline)
+    - Repeated strings (BATCH, run_state, part_number...) become categoricals
+    - float64 columns become float32 when the rounding error stays within
+      FLOAT32_TOLERANCE of their range, see fits_float32; the statistics
+      are still computed in float64
+
+    Args:
+        df: DataFrame to convert
+
+    Returns:
+        The converted DataFrame
+    """
+    for col in df.columns:
+        values = df[col]
+        strings = values.dtype == object or pd.api.types.is_string_dtype(values.dtype)
+
+        if strings and col in TIME_COLUMNS:
+            try:
+                parsed = pd.to_datetime(values, format='ISO8601')
+            except (ValueError, TypeError):
+                parsed = None
+            if parsed is not None and pd.api.types.is_datetime64_any_dtype(parsed):
+                df[col] = parsed
+                continue
+
+        if strings:
+            try:
+                distinct = values.nunique()
+            except TypeError:
+                # Unhashable values such as nested records
+                continue
+            if distinct <= len(values) * CATEGORICAL_MAX_RATIO:
+                df[col] = values.astype('category')
+
+        elif values.dtype == np.float64:
+            with np.errstate(over='ignore'):
+                narrow = values.to_numpy().astype(np.float32)
+            if fits_float32(values.to_numpy(), narrow):
+                df[col] = narrow
+
+    return df
+
+def dataset_frame(dataset: Any) -> pd.DataFrame:
+    """
+    Build a DataFrame from a row- or column-oriented dataset.
+
+    Args:
+        dataset: Either {"items": [records]} or {"columns": {name: [values]}}
+
+    Returns:
+        DataFrame of the dataset, empty if no dataset is given
+    """
+    if dataset is None or (isinstance(dataset, (dict, list)) and not dataset):
+        return pd.DataFrame()
+
+    if not isinstance(dataset, dict):
+        raise ValueError("dataset must be an object")
+
+    if "columns" in dataset:
+        columns = dataset["columns"]
+        if not isinstance(columns, dict):
+            raise ValueError("'columns' must map column names to arrays of values")
+        # Each column becomes one array, no per-row dicts are materialized
+        return pd.DataFrame(columns)
+
+    if "items" in dataset:
+        return pd.DataFrame.from_dict(dataset["items"])
+
+    raise ValueError("dataset must contain 'items' or 'columns'")
+
+def read_arrow_payload(body: bytes) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    """
+    Read an Arrow IPC stream request body.
+
+    The stream holds the production data; the remaining request fields
+    (alertman_data, target_variable, batch_id...) are passed as JSON in the
+    'request' key of the schema metadata.
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        Tuple of the request fields and the production DataFrame
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise TransformationError(415, {
+            "message": "Arrow request bodies are not supported on this server",
+            "error": "pyarrow is not installed"
+        })
+
+    try:
+        with stage('parse'):
+            table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+            metadata = table.schema.metadata or {}
+            data = json.loads(metadata.get(ARROW_REQUEST_METADATA, b'{}'))
+    except (pa.ArrowInvalid, json.JSONDecodeError) as e:
+        raise TransformationError(400, {
+            "message": "Invalid Arrow IPC stream in request body",
+            "error": str(e)
+        })
+
+    # Hand the Arrow buffers over to pandas without keeping a second copy
+    with stage('frame'):
+        df_production = compact_frame(table.to_pandas(split_blocks=True, self_destruct=True))
+    return data, df_production
+
+def production_frame(dataset: Any) -> pd.DataFrame:
+    """Build a compacted production DataFrame, see dataset_frame and compact_frame."""
+    return compact_frame(dataset_frame(dataset))
+
+def dataset_frames(data: Dict[str, Any], df_production: Optional[pd.DataFrame] = None
+                   ) -> Tuple[Dict[str, Any], Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """
+    Convert the datasets of request fields to DataFrames.
+
+    Args:
+        data: Request fields
+        df_production: Production DataFrame already read from the body, if any
+
+    Returns:
+        Tuple of the other request fields and of the production and alertman
+        DataFrames, None for the datasets that are not given
+    """
+    try:
+        with stage('frame'):
+            if df_production is None and data.get("production_data"):
+                df_production = production_frame(data["production_data"])
+            df_alertman = dataset_frame(data["alertman_data"]) if data.get("alertman_data") else None
+    except (ValueError, TypeError) as e:
+        raise TransformationError(400, {
+            "message": "Invalid dataset format",
+            "error": str(e),
+            "expected": {
+                "production_data": {
+                    "items": "[array of records]",
+                    "columns": "{column name: [array of values]}"
+                }
+            }
+        })
+
+    fields = {key: value for key, value in data.items() if key not in DATASET_FIELDS}
+    return fields, df_production, df_alertman
+
+def fetched_frames(fetched: Dict[str, bytes]) -> Tuple[Dict[str, Any], Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """
+    Decode the raw datasets fetched from their query parameters and convert them to DataFrames.
+
+    Args:
+        fetched: Dictionary of datasource names and raw query results, see resolve_datasets
+
+    Returns:
+        See dataset_frames
+    """
+    with stage('parse'):
+        datasets = {name: decode_dataset(name, content) for name, content in fetched.items()}
+    return dataset_frames(datasets)
+
+def decode_payload(body: bytes, arrow: bool = False
+                   ) -> Tuple[Dict[str, Any], Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """
+    Decode a JSON or Arrow request body and convert its datasets to DataFrames.
+
+    Runs in the transformation job of the request, see analysis.jobs.
+
+    Args:
+        body: Raw request body
+        arrow: Whether the body is an Arrow IPC stream, see read_arrow_payload
+
+    Returns:
+        See dataset_frames
+    """
+    if arrow:
+        data, df_production = read_arrow_payload(body)
+    else:
+        try:
+            with stage('parse'):
+                data = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise TransformationError(400, {
+                "message": "Invalid JSON in request body",
+                "error": str(e)
+            })
+        df_production = None
+
+    if not isinstance(data, dict):
+        raise TransformationError(400, {
+            "message": "Request body must be an object"
+        })
+
+    return dataset_frames(data, df_production)
+
+async def read_body(request: Request) -> Tuple[bytes, bool]:
+    """
+    Receive a transformation request body, checking its Content-Type.
+
+    Supported bodies:
+    - application/json with production_data/alertman_data given either as
+      {"items": [records]} or as {"columns": {name: [values]}}
+    - application/vnd.apache.arrow.stream, see read_arrow_payload
+
+    The body is decoded in the executor along with the rest of the job,
+    see decode_payload and analysis.jobs.
+
+    Args:
+        request: Incoming request
+
+    Returns:
+        Tuple of the raw body and whether it is an Arrow IPC stream
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    if content_type not in ARROW_CONTENT_TYPES and content_type not in JSON_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail={
+                "message": f"Unsupported content type '{content_type}'",
+                "supported": list(JSON_CONTENT_TYPES[:1] + ARROW_CONTENT_TYPES)
+            }
+        )
+
+    with stage('receive'):
+        body = await request.body()
+    return body, content_type in ARROW_CONTENT_TYPES
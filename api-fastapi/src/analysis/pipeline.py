@@ -0,0 +1,1199 @@
+import statistics
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+from analysis.downsampling import MIN_POINTS, downsample_indices, downsample_points
+from analysis.serialization import frame_records, iter_ndjson, serializable_frame
+from analysis.sketches import TDigest
+from analysis.summaries import BatchSummaryStore
+from analysis.timing import stage
+
+class TransformationError(Exception):
+    """Error of a transformation job, with the HTTP status and detail to respond with."""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def calculate_std(values: List[float]) -> float:
+    """
+    Calculate standard deviation of a list of values.
+    
+    Args:
+        values: List of numeric values
+        
+    Returns:
+        Standard deviation
+    """
+    if not values:
+        return 0
+    
+    try:
+        return statistics.stdev(values)
+    except statistics.StatisticsError:
+        # Handle case with only one value
+        return 0
+
+def calculate_column_correlations(values: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Calculate the Pearson correlation of each column of a matrix with a target.
+
+    Like pandas' Series.corr, each column only uses the rows where both it
+    and the target are not NaN. Columns without spread give NaN.
+
+    Args:
+        values: Float matrix with one column per variable
+        target: Float vector of the target, one value per row
+
+    Returns:
+        Vector of the correlation of each column with the target
+    """
+    mask = ~np.isnan(values) & ~np.isnan(target)[:, None]
+    count = mask.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Center both sides on the means of the rows each column uses
+        x = np.where(mask, values, 0)
+        y = np.where(mask, target[:, None], 0)
+        x = np.where(mask, x - x.sum(axis=0) / count, 0)
+        y = np.where(mask, y - y.sum(axis=0) / count, 0)
+
+        correlations = (x * y).sum(axis=0) / np.sqrt((x * x).sum(axis=0) * (y * y).sum(axis=0))
+
+    correlations[count < 2] = np.nan
+    return np.clip(correlations, -1, 1)
+
+def calculate_correlations(df: pd.DataFrame, target_variable: str) -> Dict[str, float]:
+    """
+    Calculate correlations between target variable and all other numeric variables.
+    
+    Args:
+        df: DataFrame containing variables
+        target_variable: Name of the target variable
+        
+    Returns:
+        Dictionary of variable names and their correlation with target
+    """
+    if df.empty or target_variable not in df.columns:
+        return {}
+
+    numeric_cols = [col for col in df.select_dtypes(include='number').columns if col != target_variable]
+    if not numeric_cols:
+        return {}
+
+    correlations = calculate_column_correlations(
+        df[numeric_cols].to_numpy(dtype=float),
+        pd.to_numeric(df[target_variable], errors='coerce').to_numpy(dtype=float)
+    )
+    return {col: float(correlation) for col, correlation in zip(numeric_cols, correlations) if not np.isnan(correlation)}
+
+def calculate_correlation_matrix(values: np.ndarray, method: str = 'pearson', min_periods: int = 2) -> np.ndarray:
+    """
+    Calculate the correlation matrix of the columns of a matrix.
+
+    Each pair of columns uses the rows where both are not NaN. The sums
+    for all pairs come from a few matrix products instead of a loop over
+    pairs. For Spearman, when all columns have the same gaps, each column
+    is ranked once instead of re-ranking for every pair like pandas does;
+    otherwise each pair must be ranked over its shared rows, which is left
+    to pandas.
+
+    Args:
+        values: Float matrix with one column per variable
+        method: 'pearson' or 'spearman'
+        min_periods: Minimum number of shared rows for a correlation
+
+    Returns:
+        Square matrix of correlations, NaN where a pair has too few rows or no spread
+    """
+    if method not in ('pearson', 'spearman'):
+        raise ValueError(f"Unknown correlation method '{method}'")
+
+    mask = ~np.isnan(values)
+    if method == 'spearman' and not (mask == mask[:, :1]).all():
+        correlations = pd.DataFrame(values).corr(method='spearman', min_periods=min_periods).to_numpy(dtype=float, copy=True)
+        correlations[~np.isfinite(correlations)] = np.nan
+    else:
+        if method == 'spearman':
+            values = pd.DataFrame(values).rank(method='average').to_numpy(dtype=float)
+        valid = mask.astype(float)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Shifting by the column means does not change the result but keeps the sums small
+            shift = np.where(mask, values, 0).sum(axis=0) / np.maximum(mask.sum(axis=0), 1)
+            x = np.where(mask, values - shift, 0)
+
+            count = valid.T @ valid
+            sums = x.T @ valid  # sums[i, j]: sum of column i over the rows shared with column j
+            squares = (x * x).T @ valid
+            products = x.T @ x
+
+            covariance = products - sums * sums.T / count
+            variance = squares - sums ** 2 / count
+            correlations = covariance / np.sqrt(variance * variance.T)
+
+        correlations[(count < min_periods) | ~np.isfinite(correlations)] = np.nan
+
+    # Rounding can leave the diagonal slightly off 1
+    diagonal = np.diag(correlations)
+    np.fill_diagonal(correlations, np.where(np.isnan(diagonal), np.nan, 1))
+    return np.clip(correlations, -1, 1)
+
+def calculate_variable_stats(df, batch_id=None, target_variable=None):
+    """
+    Calculate advanced statistics for variables, focusing on recommendation tags.
+
+    All columns are computed together with matrix operations: mean, std,
+    min/max, the least-squares trend over time and the correlation with
+    the target. NaN values are left out per column.
+    """
+    if df.empty:
+        return {}
+
+    # Filter for uptime data only
+    df = df[df['run_state'] == 'Uptime']
+    
+    if batch_id:
+        df = df[df['BATCH'] == batch_id]
+
+    # Convert columns that should be numeric but aren't
+    exclude_cols = ['DateTime', 'BATCH']
+    columns = [col for col in df.columns if col not in exclude_cols]
+    numeric = {
+        col: df[col] if pd.api.types.is_numeric_dtype(df[col]) else pd.to_numeric(df[col], errors='coerce')
+        for col in columns
+    }
+    if not numeric:
+        return {}
+
+    values = pd.DataFrame(numeric).to_numpy(dtype=float)
+    mask = ~np.isnan(values)
+    count = mask.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculate basic statistics
+        mean = np.where(mask, values, 0).sum(axis=0) / count
+        deviations = np.where(mask, values - mean, 0)
+        std = np.sqrt((deviations ** 2).sum(axis=0) / (count - 1))
+        min_val = np.where(mask, values, np.inf).min(axis=0)
+        max_val = np.where(mask, values, -np.inf).max(axis=0)
+
+        # Calculate trend (least-squares slope over time in seconds)
+        slope = np.zeros(len(columns))
+        if 'DateTime' in df.columns and len(df) > 1:
+            times = pd.to_datetime(df['DateTime'])
+            seconds = (times - times.min()).dt.total_seconds().to_numpy(dtype=float)
+            trend_mask = mask & ~np.isnan(seconds)[:, None]
+            trend_count = trend_mask.sum(axis=0)
+            centered_seconds = np.where(trend_mask, seconds[:, None], 0)
+            centered_seconds = np.where(trend_mask, centered_seconds - centered_seconds.sum(axis=0) / trend_count, 0)
+            trend_values = np.where(trend_mask, values, 0)
+            trend_values = np.where(trend_mask, trend_values - trend_values.sum(axis=0) / trend_count, 0)
+            slope = (centered_seconds * trend_values).sum(axis=0) / (centered_seconds ** 2).sum(axis=0)
+
+        # Handle infinite or NaN values
+        mean = np.where(np.isfinite(mean), mean, 0)
+        std = np.where(np.isfinite(std), std, 0)
+        min_val = np.where(np.isfinite(min_val), min_val, 0)
+        max_val = np.where(np.isfinite(max_val), max_val, 0)
+
+        # Normalize slope to represent relative change per hour
+        trend = np.where(mean != 0, slope * 3600 / mean, 0)
+        # Calculate volatility (coefficient of variation)
+        volatility = np.where(mean != 0, std / mean * 100, 0)
+
+    trend = np.where(np.isfinite(trend), trend, 0)
+    volatility = np.where(np.isfinite(volatility), volatility, 0)
+
+    correlation = np.zeros(len(columns))
+    if target_variable and target_variable in numeric:
+        correlation = calculate_column_correlations(values, values[:, columns.index(target_variable)])
+        correlation[columns.index(target_variable)] = 0
+        correlation = np.where(np.isfinite(correlation), correlation, 0)
+
+    stats = {}
+    for i, col in enumerate(columns):
+        # Need at least 2 points for statistics
+        if count[i] < 2:
+            continue
+
+        # Store statistics with safe values
+        stats[col] = {
+            'mean': float(mean[i]),
+            'std': float(std[i]),
+            'trend': float(trend[i]),
+            'volatility': float(volatility[i]),
+            'min': float(min_val[i]),
+            'max': float(max_val[i]),
+            'range': float(max_val[i] - min_val[i]),
+            'correlation': float(correlation[i])
+        }
+
+    return stats
+
+def to_epoch_milliseconds(values: pd.Series) -> np.ndarray:
+    """
+    Convert a column of timestamps to epoch milliseconds.
+
+    Args:
+        values: Series of datetimes or datetime strings (naive values are taken as UTC)
+
+    Returns:
+        Array of integer milliseconds since epoch
+    """
+    timestamps = pd.to_datetime(values)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return ((timestamps - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)).to_numpy()
+
+def calculate_point_correlations(data, variables, target_variable):
+    """Calculate point-by-point correlations of several variables with a target in one pass.
+
+    Args:
+        data: DataFrame containing the variables
+        variables: Names of the variables to correlate with the target
+        target_variable: Name of the target variable
+
+    Returns:
+        Dictionary of variable names and their [timestamp, correlation, run_state] triplets
+    """
+    variables = [variable for variable in variables if variable in data.columns]
+    if data.empty or not variables or not all(col in data.columns for col in [target_variable, 'DateTime', 'run_state']):
+        return {}
+
+    # Convert to numeric, treating NaN and infinite values as 0
+    values = data[variables + [target_variable]].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    values = np.where(np.isfinite(values), values, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculate z-scores for all columns at once
+        means = values.mean(axis=0)
+        stds = values.std(axis=0, ddof=1)
+        stds[stds == 0] = 1  # Use 1 if std is 0
+        z_scores = (values - means) / stds
+
+        # Correlation as product of z-scores with the target, clipped to [-1, 1]
+        correlations = np.clip(z_scores[:, :-1] * z_scores[:, -1:], -1, 1)
+    correlations = np.nan_to_num(correlations, nan=0.0)
+
+    # Sort by timestamp
+    timestamps = to_epoch_milliseconds(data['DateTime'])
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order].tolist()
+    run_states = data['run_state'].to_numpy()[order].tolist()
+
+    return {
+        variable: [list(point) for point in zip(timestamps, correlations[order, i].tolist(), run_states)]
+        for i, variable in enumerate(variables)
+    }
+
+def window_starts(timestamps: np.ndarray, window: Union[int, str]) -> np.ndarray:
+    """
+    Get the first row of the window ending at each row.
+
+    Args:
+        timestamps: Sorted epoch milliseconds of the rows
+        window: Number of rows, or a duration such as "30min" for the rows
+            within that time before (and including) each row
+
+    Returns:
+        Array of window start positions
+    """
+    if isinstance(window, str):
+        duration = pd.Timedelta(window) // pd.Timedelta(milliseconds=1)
+        return np.searchsorted(timestamps, timestamps - duration, side='right')
+    return np.maximum(np.arange(1, len(timestamps) + 1) - window, 0)
+
+def calculate_rolling_correlations(data, variables, target_variable, window):
+    """Calculate rolling Pearson correlations of several variables with a target in one pass.
+
+    Window sums are differences of cumulative sums, so the cost is linear in
+    the number of rows whatever the window size. Each variable only uses the
+    rows where both it and the target have a value.
+
+    Args:
+        data: DataFrame containing the variables
+        variables: Names of the variables to correlate with the target
+        target_variable: Name of the target variable
+        window: Number of rows, or a duration such as "30min", see window_starts
+
+    Returns:
+        Dictionary of variable names and their [timestamp, correlation, run_state]
+        triplets, with a null correlation where the window has no spread
+    """
+    variables = [variable for variable in variables if variable in data.columns]
+    if data.empty or not variables or not all(col in data.columns for col in [target_variable, 'DateTime', 'run_state']):
+        return {}
+
+    # Sort by timestamp
+    timestamps = to_epoch_milliseconds(data['DateTime'])
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    run_states = data['run_state'].to_numpy()[order].tolist()
+
+    values = data[variables + [target_variable]].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)[order]
+    values = np.where(np.isfinite(values), values, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Center the columns to limit cancellation in the differences of sums
+        values = values - np.nanmean(values, axis=0)
+        x = values[:, :-1]
+        y = values[:, -1:]
+        valid = ~np.isnan(x) & ~np.isnan(y)
+        x = np.where(valid, x, 0)
+        y = np.where(valid, y, 0)
+
+        starts = window_starts(timestamps, window)
+        ends = np.arange(1, len(timestamps) + 1)
+
+        def window_sums(a):
+            cumulative = np.concatenate([np.zeros((1, a.shape[1])), np.cumsum(a, axis=0)])
+            return cumulative[ends] - cumulative[starts]
+
+        n = window_sums(valid.astype(float))
+        sum_x = window_sums(x)
+        sum_y = window_sums(y)
+        sum_xx = window_sums(x * x)
+        sum_yy = window_sums(y * y)
+
+        covariance = n * window_sums(x * y) - sum_x * sum_y
+        variance_x = n * sum_xx - sum_x ** 2
+        variance_y = n * sum_yy - sum_y ** 2
+        correlations = np.clip(covariance / np.sqrt(variance_x * variance_y), -1, 1)
+
+        # Constant windows leave only rounding noise as variance
+        defined = (n >= 2) & (variance_x > 1e-9 * n * sum_xx) & (variance_y > 1e-9 * n * sum_yy)
+    correlations = np.where(defined & np.isfinite(correlations), correlations, np.nan)
+
+    timestamps = timestamps.tolist()
+    return {
+        variable: [
+            [timestamp, None if np.isnan(correlation) else correlation, run_state]
+            for timestamp, correlation, run_state in zip(timestamps, correlations[:, i].tolist(), run_states)
+        ]
+        for i, variable in enumerate(variables)
+    }
+
+def calculate_point_correlation(data, variable1, variable2):
+    """Calculate simple point-by-point correlations between two variables.
+    
+    Args:
+        data: DataFrame containing the variables
+        variable1: Name of first variable
+        variable2: Name of second variable
+        
+    Returns:
+        List of [timestamp, correlation, run_state] triplets
+    """
+    try:
+        return calculate_point_correlations(data, [variable1], variable2).get(variable1, [])
+    except Exception as e:
+        print(f"Error calculating correlation: {str(e)}")
+        return []
+
+def batch_index(df: pd.DataFrame) -> pd.DataFrame:
+    """Turn the categorical BATCH index of an aggregate into a plain one, so it merges with others."""
+    if isinstance(df.index, pd.CategoricalIndex):
+        df.index = pd.Index(df.index.tolist(), name=df.index.name)
+    return df
+
+def summarize_batches(df: pd.DataFrame, columns: List[str], time_column: Optional[str] = None) -> pd.DataFrame:
+    """
+    Aggregate per-batch statistics for several columns in one grouped pass.
+
+    Args:
+        df: DataFrame containing a BATCH column
+        columns: Names of the columns to aggregate (coerced to numeric)
+        time_column: Optional column whose minimum is kept as the batch start
+
+    Returns:
+        DataFrame indexed by BATCH in order of first appearance, with
+        (stat, column) columns for the 'count', 'mean' and 'std' stats and,
+        if time_column is given, a ('first', time_column) column
+    """
+    # Aggregate in double precision, whatever the precision of the columns
+    values = df[columns].apply(pd.to_numeric, errors='coerce').astype(float)
+    grouped = values.groupby(df['BATCH'], sort=False, observed=True)
+
+    summary = pd.concat({
+        'count': grouped.count(),
+        'mean': grouped.mean(),
+        'std': grouped.std(),
+    }, axis=1)
+
+    if time_column:
+        summary[('first', time_column)] = df[time_column].groupby(df['BATCH'], sort=False, observed=True).min()
+
+    return batch_index(summary)
+
+def calculate_batch_deviations(summary: pd.DataFrame, target_variable: str, reco_tags: List[str],
+                               product_batches: List[Any], time_column: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Compare every batch against the latest preceding recommendation batch.
+
+    Args:
+        summary: Per-batch statistics as returned by summarize_batches
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags to compare
+        product_batches: Batches that received a recommendation
+        time_column: Column holding the batch start in the summary
+
+    Returns:
+        List of batch records with their deviation information
+    """
+    product_batches = set(product_batches)
+    tags = [tag for tag in reco_tags if tag in summary['mean'].columns]
+
+    batches = summary.index.tolist()
+    target_means = summary[('mean', target_variable)].tolist()
+    first_timestamps = summary[('first', time_column)].tolist() if time_column else [None] * len(batches)
+
+    means = summary['mean'][tags].to_numpy(dtype=float)
+    # Sample std of batches with a single value is NaN, which counts as 0;
+    # the deviation is normalized by at least 1 either way
+    ref_stds = np.maximum(summary['std'][tags].fillna(0).to_numpy(dtype=float), 1)
+
+    reference = None
+    processed_data = []
+
+    for position, batch in enumerate(batches):
+        result = {
+            "BATCH": batch,
+            "BATCHSTART": first_timestamps[position],
+            target_variable: target_means[position]
+        }
+
+        if batch in product_batches:
+            # This is a recommendation batch
+            reference = position
+            result["deviation_info"] = {
+                "total_deviation": 0,
+                "deviation_percent": 0,
+                "deviations": []
+            }
+        elif reference is None:
+            # No reference batch yet
+            result["deviation_info"] = {
+                "total_deviation": -1,
+                "deviation_percent": 0,
+                "deviations": []
+            }
+        else:
+            ref_means = means[reference]
+            differences = np.abs(means[position] - ref_means)
+
+            # Normalized and percentage deviation for all tags at once
+            deviations = (differences / ref_stds[reference]).tolist()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                deviation_percents = np.where(ref_means != 0, differences / np.abs(ref_means) * 100, 0).tolist()
+
+            # Calculate total deviation percentage as the sum
+            total_deviation_percent = sum(deviation_percents) if deviation_percents else 0
+
+            all_deviations = [
+                {
+                    "variable": variable,
+                    "deviation": deviation,
+                    "percent": percent,
+                    "contribution": (percent / total_deviation_percent) * 100 if total_deviation_percent > 0 else 0
+                }
+                for variable, deviation, percent in zip(tags, deviations, deviation_percents)
+            ]
+
+            # Sort by percentage deviation (descending) and take top 5
+            all_deviations.sort(key=lambda x: x["percent"], reverse=True)
+
+            result["deviation_info"] = {
+                "total_deviation": total_deviation_percent,
+                "deviation_percent": total_deviation_percent,
+                "deviations": all_deviations[:5]
+            }
+
+        processed_data.append(result)
+
+    return processed_data
+
+def get_reco_tags(df_alertman: pd.DataFrame) -> List[str]:
+    """
+    Get the recommendation tags, i.e. tags with a decision, from alertman data.
+
+    Args:
+        df_alertman: DataFrame of alertman records
+
+    Returns:
+        List of unique recommendation tags
+    """
+    if df_alertman.empty or 'decision' not in df_alertman.columns or 'tag' not in df_alertman.columns:
+        return []
+    return df_alertman[df_alertman['decision'].notna() & (df_alertman['decision'] != '')]['tag'].unique().tolist()
+
+def get_product_batches(df_alertman: pd.DataFrame) -> List[Any]:
+    """
+    Get the batches that received a recommendation from alertman data.
+
+    Args:
+        df_alertman: DataFrame of alertman records
+
+    Returns:
+        List of unique batch IDs
+    """
+    if df_alertman.empty or 'state__extra__batch_id' not in df_alertman.columns:
+        return []
+    return df_alertman['state__extra__batch_id'].dropna().unique().tolist()
+
+def exact_quantiles(values: pd.Series, quantiles: Tuple[float, float]) -> Tuple[float, float]:
+    """Get the low and high quantiles of values exactly."""
+    return values.quantile(quantiles[0]), values.quantile(quantiles[1])
+
+def tdigest_quantiles(values: pd.Series, quantiles: Tuple[float, float]) -> Tuple[float, float]:
+    """Estimate the low and high quantiles of values with a t-digest built chunk by chunk."""
+    digest = TDigest.from_values(values.to_numpy(dtype=float))
+    return digest.quantile(quantiles[0]), digest.quantile(quantiles[1])
+
+# Estimators of the outlier bounds of the target
+OUTLIER_METHODS = {
+    'exact': exact_quantiles,
+    'tdigest': tdigest_quantiles,
+}
+
+DEFAULT_OUTLIER_QUANTILES = (0.03, 0.97)
+
+def filter_production(df_production: pd.DataFrame, target_variable: str,
+                      bounds: Optional[Tuple[float, float]] = None,
+                      allow_empty: bool = False,
+                      quantiles: Tuple[float, float] = DEFAULT_OUTLIER_QUANTILES,
+                      method: str = 'exact',
+                      per_batch: bool = False) -> Tuple[pd.DataFrame, Any]:
+    """
+    Keep the uptime rows whose target value lies within the outlier bounds.
+
+    Args:
+        df_production: DataFrame of production records
+        target_variable: Name of the target variable
+        bounds: Optional (low, high) target bounds, defaults to the given quantiles
+        allow_empty: Whether to return an empty frame instead of failing
+            when no row has a valid target value
+        quantiles: Quantiles of the target used as bounds
+        method: Estimator of the quantiles, see OUTLIER_METHODS
+        per_batch: Whether to compute the bounds of each batch separately
+            instead of over all rows (bounds must not be given)
+
+    Returns:
+        Tuple of the filtered DataFrame and the bounds that were applied;
+        with per_batch, a DataFrame of the 'low' and 'high' bounds of each batch
+    """
+    # remove downtime data
+    df_production = df_production[df_production['run_state'] == 'Uptime']
+
+    # Check if target variable exists in the data
+    if target_variable not in df_production.columns:
+        raise ValueError(f"Target variable '{target_variable}' not found in production data")
+
+    # Remove rows with missing or non-numeric target values
+    target = pd.to_numeric(df_production[target_variable], errors='coerce')
+    df_production = df_production[target.notna()]
+    target = target[target.notna()]
+
+    if df_production.empty and not allow_empty:
+        raise ValueError(f"No valid values found for target variable: {target_variable}")
+
+    if 'BATCH' not in df_production.columns:
+        raise ValueError("BATCH column not found in filtered data")
+
+    # Remove outliers using quantiles (3% and 97% by default)
+    estimate = OUTLIER_METHODS[method]
+    if per_batch:
+        rows = target.groupby(df_production['BATCH'], sort=False, observed=True).indices
+        bounds = pd.DataFrame.from_dict(
+            {batch: estimate(target.iloc[positions], quantiles) for batch, positions in rows.items()},
+            orient='index', columns=['low', 'high']
+        )
+        batches = df_production['BATCH'].to_numpy()
+        low_quantile = bounds['low'].reindex(batches).to_numpy()
+        high_quantile = bounds['high'].reindex(batches).to_numpy()
+    else:
+        if bounds is None:
+            bounds = estimate(target, quantiles)
+        low_quantile, high_quantile = bounds
+
+    df_filtered = df_production[((target >= low_quantile) & (target <= high_quantile)).to_numpy()]
+
+    return df_filtered, bounds
+
+def get_time_column(df: pd.DataFrame) -> Optional[str]:
+    """Get the column holding the timestamps used as batch start."""
+    if 'minute_level' in df.columns:
+        return 'minute_level'
+    if 'BATCHSTART' in df.columns:
+        return 'BATCHSTART'
+    return None
+
+
+def summarize_production(df_production: pd.DataFrame, target_variable: str, reco_tags: List[str],
+                         bounds: Optional[Tuple[float, float]] = None, columns: Optional[List[str]] = None,
+                         time_column: Optional[str] = None,
+                         outliers: Optional[Dict[str, Any]] = None) -> Tuple[pd.DataFrame, Any, List[str], Optional[str]]:
+    """
+    Filter production data and aggregate it per batch.
+
+    Args:
+        df_production: DataFrame of production records
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        bounds: Optional outlier bounds of the target; when given, data
+            without valid target values yields an empty summary
+        columns: Optional columns to aggregate, defaults to the target and reco tags
+        time_column: Column holding the batch start, used along with columns
+        outliers: Optional quantiles, method and per_batch options of filter_production
+
+    Returns:
+        Tuple of the per-batch summary, the outlier bounds, the aggregated
+        columns and the time column
+    """
+    with stage('filter'):
+        df_filtered, bounds = filter_production(df_production, target_variable, bounds, allow_empty=bounds is not None,
+                                                **(outliers or {}))
+
+    if columns is None:
+        time_column = get_time_column(df_filtered)
+        columns = [col for col in dict.fromkeys([target_variable] + reco_tags) if col in df_filtered.columns]
+    else:
+        # Columns missing from the data count as missing values
+        missing = [col for col in columns + [time_column] if col and col not in df_filtered.columns]
+        df_filtered = df_filtered.assign(**{col: np.nan for col in missing})
+
+    with stage('aggregate'):
+        summary = summarize_batches(df_filtered, columns, time_column)
+
+    return summary, bounds, columns, time_column
+
+def closed_batches(df_production: pd.DataFrame) -> List[Any]:
+    """
+    Get the batches whose rows all lie within the time window of production data.
+
+    A batch is closed when it started after the first row of the data, so
+    the window did not cut its start, and ended before another batch
+    started, so it is not still running. Without a row timestamp column,
+    no batch is known to be closed.
+
+    Args:
+        df_production: DataFrame of production records, of all run states
+
+    Returns:
+        List of the closed batches
+    """
+    time_column = next((col for col in ('minute_level', 'DateTime') if col in df_production.columns), None)
+    if time_column is None or df_production.empty:
+        return []
+
+    timestamps = pd.to_datetime(df_production[time_column], errors='coerce')
+    grouped = timestamps.groupby(df_production['BATCH'], sort=False, observed=True)
+    starts, ends = grouped.min(), grouped.max()
+
+    closed = (starts > timestamps.min()) & (ends < starts.max())
+    return closed[closed].index.tolist()
+
+def trim_ranges(df_production: pd.DataFrame, target_variable: str, bounds: Tuple[float, float],
+                batches: List[Any]) -> pd.DataFrame:
+    """
+    Get the outlier bounds that keep the same rows of each batch as the given ones.
+
+    Bounds (low, high) with low_from < low <= low_to and high_from <= high
+    < high_to keep the same rows of a batch as bounds, since no target value
+    of the batch lies between them, so its statistics stay valid.
+
+    Args:
+        df_production: DataFrame of production records
+        target_variable: Name of the target variable
+        bounds: (low, high) target bounds, see filter_production
+        batches: Batches to get the ranges of
+
+    Returns:
+        DataFrame indexed by batch with low_from, low_to, high_from and
+        high_to columns, infinite where no value limits the range
+    """
+    df_production = df_production[(df_production['run_state'] == 'Uptime') & df_production['BATCH'].isin(batches)]
+    target = pd.to_numeric(df_production[target_variable], errors='coerce')
+    low, high = bounds
+
+    def grouped(values: pd.Series):
+        return values.groupby(df_production['BATCH'], sort=False, observed=True)
+
+    ranges = batch_index(pd.DataFrame({
+        'low_from': grouped(target.where(target < low)).max(),
+        'low_to': grouped(target.where(target >= low)).min(),
+        'high_from': grouped(target.where(target <= high)).max(),
+        'high_to': grouped(target.where(target > high)).min(),
+    })).reindex(batches)
+
+    return ranges.fillna({'low_from': -np.inf, 'low_to': np.inf, 'high_from': -np.inf, 'high_to': np.inf})
+
+def summarize_stored_production(df_production: pd.DataFrame, target_variable: str, reco_tags: List[str],
+                                store: BatchSummaryStore, scope: str) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Aggregate production data per batch, reading closed batches from a summary store.
+
+    The outlier bounds of the target are computed over all the data, as by
+    summarize_production; batches found in the store with statistics that
+    these bounds keep valid (see trim_ranges) are not aggregated again.
+    Only closed batches (see closed_batches) are read from and added to
+    the store, the others may be cut by the time window of the data.
+
+    Args:
+        df_production: DataFrame of production records
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        store: Store of per-batch statistics
+        scope: Store scope of the data, see analysis.summaries.summary_scope
+
+    Returns:
+        Tuple of the per-batch summary (see summarize_batches) and the time column
+    """
+    with stage('filter'):
+        df_filtered, bounds = filter_production(df_production, target_variable)
+
+    time_column = get_time_column(df_filtered)
+    columns = [col for col in dict.fromkeys([target_variable] + reco_tags) if col in df_filtered.columns]
+
+    # Stored statistics cover whole batches, which the data only holds of its closed batches
+    batches = df_filtered['BATCH'].unique().tolist()
+    closed = set(closed_batches(df_production)).intersection(batches)
+    with stage('store'):
+        stored = store.load(scope, [batch for batch in batches if batch in closed], columns, time_column, bounds)
+
+    with stage('aggregate'):
+        summary = summarize_batches(df_filtered[~df_filtered['BATCH'].isin(stored.index)], columns, time_column)
+
+    with stage('store'):
+        new_closed = summary[summary.index.isin(closed)]
+        store.save(scope, time_column, new_closed, columns,
+                   trim_ranges(df_production, target_variable, bounds, new_closed.index.tolist()))
+
+    if time_column and not stored.empty and pd.api.types.is_datetime64_any_dtype(df_filtered[time_column]):
+        # Batch starts are stored as ISO 8601 text
+        stored[('first', time_column)] = pd.to_datetime(stored[('first', time_column)]).astype(df_filtered[time_column].dtype)
+
+    summary = pd.concat([stored, summary]).reindex(batches)
+    return summary, time_column
+
+def run_process_data(df_production: pd.DataFrame, target_variable: str, reco_tags: List[str],
+                     product_batches: List[Any], store: Optional[BatchSummaryStore] = None,
+                     scope: Optional[str] = None, outliers: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Calculate the deviations of all batches against their reference batch.
+
+    Args:
+        df_production: DataFrame of production records
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        product_batches: Batches that received a recommendation
+        store: Optional store of per-batch statistics to read closed batches from
+        scope: Store scope of the data, required with store
+        outliers: Optional quantiles, method and per_batch options of
+            filter_production; the store is only used without them
+
+    Returns:
+        Processed data with deviation information, or an error
+    """
+    try:
+        if store is not None and scope is not None and not outliers:
+            summary, time_column = summarize_stored_production(df_production, target_variable, reco_tags, store, scope)
+        else:
+            summary, _, _, time_column = summarize_production(df_production, target_variable, reco_tags,
+                                                              outliers=outliers)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    print(reco_tags)
+
+    # Aggregate every batch in a single grouped pass, then walk the
+    # (small) summary table to compare batches against their reference
+    with stage('deviations'):
+        processed_data = calculate_batch_deviations(summary, target_variable, reco_tags, product_batches, time_column)
+
+    return {
+        "processed_data": processed_data
+    }
+
+def convert_datetime(df_production: pd.DataFrame):
+    """Convert the DateTime column of production data in place."""
+    # Convert DateTime column with error handling
+    try:
+        if 'DateTime' in df_production.columns:
+            df_production['DateTime'] = pd.to_datetime(df_production['DateTime'])
+    except Exception as e:
+        raise TransformationError(
+            status_code=400,
+            detail={
+                "message": "Error converting DateTime column",
+                "error": str(e)
+            }
+        )
+
+def convert_reco_tags(df_production: pd.DataFrame, reco_tags: List[str]) -> List[Dict[str, str]]:
+    """
+    Convert the recommendation tag columns of production data to numbers in place.
+
+    Args:
+        df_production: DataFrame of production records
+        reco_tags: Recommendation tags
+
+    Returns:
+        List of numeric conversion errors
+    """
+    # Convert numeric columns (only for recommendation tags)
+    numeric_conversion_errors = []
+    for tag in reco_tags:
+        if tag in df_production.columns:
+            try:
+                df_production[tag] = pd.to_numeric(df_production[tag], errors='coerce')
+            except Exception as e:
+                numeric_conversion_errors.append({"tag": tag, "error": str(e)})
+
+    if numeric_conversion_errors:
+        print("Warning - Numeric conversion errors:", numeric_conversion_errors)
+
+    return numeric_conversion_errors
+
+def filter_uptime(df_production: pd.DataFrame, target_variable: str, reco_tags: List[str]) -> pd.DataFrame:
+    """Get the Uptime rows of the recommendation tags, target and necessary columns."""
+    cols_to_keep = ['DateTime', 'BATCH', 'run_state'] + reco_tags + [target_variable]
+    cols_available = [col for col in cols_to_keep if col in df_production.columns]
+    return df_production.loc[df_production['run_state'] == 'Uptime', cols_available]
+
+def calculate_batch_statistics(uptime_data: pd.DataFrame, batch_data: pd.DataFrame, batch_id: Any,
+                               target_variable: str, reco_tags: List[str], max_points: Optional[int] = None,
+                               downsampling: str = 'lttb',
+                               correlation_window: Optional[Union[int, str]] = None) -> Tuple[Dict, Dict, List]:
+    """
+    Calculate the variable statistics and point correlations of a batch.
+
+    Args:
+        uptime_data: Uptime rows, see filter_uptime (may hold other batches)
+        batch_data: All rows of the batch
+        batch_id: Batch ID to analyze
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        max_points: Optional number of points to downsample each correlation series to
+        downsampling: Downsampling method, 'lttb' or 'minmax'
+        correlation_window: Optional window of rolling correlations (see
+            calculate_rolling_correlations) instead of point correlations
+
+    Returns:
+        Tuple of the variable statistics, the correlations data and the correlation errors
+    """
+    # Calculate variable statistics (only for recommendation tags)
+    try:
+        with stage('variable_stats'):
+            variable_stats = calculate_variable_stats(uptime_data, batch_id, target_variable)
+    except Exception as e:
+        raise TransformationError(
+            status_code=500,
+            detail={
+                "message": "Error calculating statistics",
+                "error": str(e)
+            }
+        )
+
+    # Calculate rolling correlations for all variables with target at once
+    correlations_data = {}
+    correlation_errors = []
+    variables = [variable for variable in reco_tags if variable != target_variable]
+    try:
+        with stage('correlations'):
+            if correlation_window:
+                point_correlations = calculate_rolling_correlations(batch_data, variables, target_variable,
+                                                                    correlation_window)
+            else:
+                point_correlations = calculate_point_correlations(batch_data, variables, target_variable)
+        correlations_data = {
+            variable: downsample_points(corr_data, max_points, downsampling) if max_points else corr_data
+            for variable, corr_data in point_correlations.items()
+            if corr_data  # Only include if we have correlation data
+        }
+    except Exception as e:
+        correlation_errors = [{"variable": variable, "error": str(e)} for variable in variables]
+
+    if correlation_errors:
+        print("Warning - Correlation calculation errors:", correlation_errors)
+
+    return variable_stats, correlations_data, correlation_errors
+
+def downsample_rows(df: pd.DataFrame, columns: List[str], max_points: int, downsampling: str = 'lttb') -> pd.DataFrame:
+    """
+    Keep the rows of a batch that chart each numeric column over DateTime.
+
+    Each column gets an equal share of max_points, and the rows selected
+    for any column are kept, in their original order, so at most
+    max_points rows are kept.
+
+    Args:
+        df: Rows of a batch with a DateTime column
+        columns: Columns charted over time
+        max_points: Maximum number of rows to reduce the batch to, at least
+            MIN_POINTS[downsampling] per column
+        downsampling: Downsampling method, 'lttb' or 'minmax'
+
+    Returns:
+        Kept rows
+    """
+    if len(df) <= max_points or 'DateTime' not in df.columns or not columns:
+        return df
+
+    share = max_points // len(columns)
+    if share < MIN_POINTS[downsampling]:
+        raise ValueError(f"max_points must be at least {MIN_POINTS[downsampling]} per column, "
+                         f"got {max_points} for {len(columns)} columns")
+
+    times = pd.to_datetime(df['DateTime'])
+    values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    order = np.argsort(times.to_numpy(), kind='stable')
+    order = order[times.notna().to_numpy()[order]]
+    x = to_epoch_milliseconds(times.iloc[order]).astype(float)
+
+    keep = np.zeros(len(df), dtype=bool)
+    for i in range(len(columns)):
+        y = values[order, i]
+        valid = ~np.isnan(y)
+        positions = order[valid]
+        keep[positions[downsample_indices(x[valid], y[valid], share, downsampling)]] = True
+
+    return df[keep]
+
+def run_batch_details(df_production: pd.DataFrame, batch_id: Any, target_variable: str,
+                      reco_tags: List[str], stream: bool = False, max_points: Optional[int] = None,
+                      downsampling: str = 'lttb',
+                      correlation_window: Optional[Union[int, str]] = None) -> Dict[str, Any]:
+    """
+    Calculate detailed statistics for a specific batch.
+
+    Args:
+        df_production: DataFrame of production records
+        batch_id: Batch ID to analyze
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        stream: Give processed_data as chunks of NDJSON lines, one per row
+            (see analysis.serialization.iter_ndjson), instead of records
+        max_points: Optional number of points to downsample processed_data
+            and each correlation series to, see downsample_rows
+        downsampling: Downsampling method, 'lttb' or 'minmax'
+        correlation_window: Optional window of rolling correlations, see
+            calculate_rolling_correlations
+
+    Returns:
+        Detailed statistics for the batch
+    """
+    with stage('convert'):
+        convert_datetime(df_production)
+
+    # Filter for the specific batch
+    batch_data = df_production[df_production['BATCH'] == batch_id]
+
+    if batch_data.empty:
+        raise TransformationError(
+            status_code=404,
+            detail={
+                "message": f"No data found for batch {batch_id}",
+                "batch_id": batch_id
+            }
+        )
+
+    with stage('convert'):
+        numeric_conversion_errors = convert_reco_tags(df_production, reco_tags)
+
+    variable_stats, correlations_data, correlation_errors = calculate_batch_statistics(
+        filter_uptime(df_production, target_variable, reco_tags), batch_data, batch_id, target_variable, reco_tags,
+        max_points, downsampling, correlation_window
+    )
+
+    # Get batch data for visualization
+    try:
+        # Include only recommendation tags in the processed data
+        viz_cols = ['DateTime', 'BATCH', 'run_state'] + reco_tags + [target_variable]
+        available_cols = [col for col in viz_cols if col in batch_data.columns]
+        batch_data_filtered = batch_data[available_cols]
+
+        if max_points:
+            series = [col for col in dict.fromkeys(reco_tags + [target_variable]) if col in available_cols]
+            with stage('downsample'):
+                batch_data_filtered = downsample_rows(batch_data_filtered, series, max_points, downsampling)
+
+        # Make the row data JSON serializable column by column
+        try:
+            with stage('records'):
+                if stream:
+                    # Encoded in the job, so only text comes back from worker processes
+                    processed_data = list(iter_ndjson(serializable_frame(batch_data_filtered)))
+                else:
+                    processed_data = frame_records(batch_data_filtered)
+        except Exception as e:
+            raise TransformationError(
+                status_code=500,
+                detail={
+                    "message": "Error converting data to JSON",
+                    "error": str(e)
+                }
+            )
+
+        result = {
+            "processed_data": processed_data,
+            "variable_stats": variable_stats,
+            "correlations_data": correlations_data,
+            "warnings": {
+                "numeric_conversion_errors": numeric_conversion_errors if numeric_conversion_errors else None,
+                "correlation_errors": correlation_errors if correlation_errors else None
+            }
+        }
+        return result
+
+    except Exception as e:
+        raise TransformationError(
+            status_code=500,
+            detail={
+                "message": "Error processing batch data",
+                "error": str(e)
+            }
+        )
+
+
+def run_multi_batch_details(df_production: pd.DataFrame, batch_ids: Optional[List[Any]], target_variable: str,
+                            reco_tags: List[str], max_points: Optional[int] = None,
+                            downsampling: str = 'lttb',
+                            correlation_window: Optional[Union[int, str]] = None) -> Dict[str, Any]:
+    """
+    Calculate the statistics of several batches from one pass over the dataset.
+
+    The dataset is converted and split by batch once, instead of once per
+    batch as with repeated run_batch_details calls. Row data is not returned.
+
+    Args:
+        df_production: DataFrame of production records
+        batch_ids: Batch IDs to analyze, or None for all batches in order of appearance
+        target_variable: Name of the target variable
+        reco_tags: Recommendation tags
+        max_points: Optional number of points to downsample each correlation series to
+        downsampling: Downsampling method, 'lttb' or 'minmax'
+        correlation_window: Optional window of rolling correlations, see
+            calculate_rolling_correlations
+
+    Returns:
+        Variable statistics and correlations data of each batch
+    """
+    with stage('convert'):
+        convert_datetime(df_production)
+        numeric_conversion_errors = convert_reco_tags(df_production, reco_tags)
+
+    df_filtered = filter_uptime(df_production, target_variable, reco_tags)
+    batch_rows = df_production.groupby('BATCH', sort=False, observed=True).indices
+    uptime_rows = df_filtered.groupby('BATCH', sort=False, observed=True).indices
+
+    if batch_ids is None:
+        batch_ids = list(batch_rows)
+
+    missing_batches = [batch_id for batch_id in batch_ids if batch_id not in batch_rows]
+    if len(missing_batches) == len(batch_ids):
+        raise TransformationError(
+            status_code=404,
+            detail={
+                "message": "No data found for the requested batches",
+                "batch_ids": batch_ids
+            }
+        )
+
+    batches = []
+    correlation_errors = []
+    for batch_id in batch_ids:
+        if batch_id not in batch_rows:
+            continue
+
+        variable_stats, correlations_data, errors = calculate_batch_statistics(
+            df_filtered.iloc[uptime_rows.get(batch_id, [])],
+            df_production.iloc[batch_rows[batch_id]],
+            batch_id, target_variable, reco_tags, max_points, downsampling, correlation_window
+        )
+        batches.append({
+            "batch_id": batch_id,
+            "variable_stats": variable_stats,
+            "correlations_data": correlations_data
+        })
+        correlation_errors.extend({"batch_id": batch_id, **error} for error in errors)
+
+    return {
+        "batches": batches,
+        "missing_batches": missing_batches if missing_batches else None,
+        "warnings": {
+            "numeric_conversion_errors": numeric_conversion_errors if numeric_conversion_errors else None,
+            "correlation_errors": correlation_errors if correlation_errors else None
+        }
+    }
+
+def run_correlation_matrix(df_production: pd.DataFrame, variables: List[str], batch_ids: Optional[List[Any]] = None,
+                           start: Optional[str] = None, end: Optional[str] = None,
+                           method: str = 'pearson') -> Dict[str, Any]:
+    """
+    Calculate the correlation matrix of variables over the Uptime rows of some batches or a time range.
+
+    Args:
+        df_production: DataFrame of production records
+        variables: Variables to correlate (recommendation tags and target)
+        batch_ids: Optional batches to restrict the rows to
+        start: Optional first DateTime of the rows
+        end: Optional last DateTime of the rows
+        method: 'pearson' or 'spearman'
+
+    Returns:
+        Variables, their correlation matrix (null where undefined) and the number of rows used
+    """
+    if 'run_state' not in df_production.columns:
+        raise TransformationError(
+            status_code=400,
+            detail={
+                "message": "Missing required column",
+                "required_columns": ["run_state"]
+            }
+        )
+
+    df = df_production[df_production['run_state'] == 'Uptime']
+
+    if batch_ids is not None:
+        if 'BATCH' not in df.columns:
+            raise TransformationError(
+                status_code=400,
+                detail={
+                    "message": "Missing required column",
+                    "required_columns": ["BATCH"]
+                }
+            )
+        df = df[df['BATCH'].isin(batch_ids)]
+
+    if start is not None or end is not None:
+        try:
+            times = pd.to_datetime(df['DateTime'])
+            in_range = pd.Series(True, index=df.index)
+            if start is not None:
+                in_range &= times >= pd.Timestamp(start)
+            if end is not None:
+                in_range &= times <= pd.Timestamp(end)
+            df = df[in_range]
+        except (KeyError, ValueError, TypeError) as e:
+            raise TransformationError(
+                status_code=400,
+                detail={
+                    "message": "Error filtering DateTime range",
+                    "error": str(e)
+                }
+            )
+
+    variables = [variable for variable in dict.fromkeys(variables) if variable in df.columns]
+    values = df[variables].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    matrix = calculate_correlation_matrix(values, method)
+
+    return {
+        "method": method,
+        "variables": variables,
+        "matrix": [[None if np.isnan(value) else float(value) for value in row] for row in matrix],
+        "rows": len(df)
+    }
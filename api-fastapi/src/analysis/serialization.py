@@ -0,0 +1,78 @@
+import json
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Iterator, List
+
+# Rows encoded per chunk of a streamed response
+NDJSON_CHUNK_ROWS = 1000
+
+# Significant digits float32 values are written with
+FLOAT32_DIGITS = 7
+
+def isoformat_column(values: pd.Series) -> pd.Series:
+    """Format a datetime column like Timestamp.isoformat, missing values stay NaN."""
+    if values.dt.tz is None and not ((values.dt.microsecond != 0) | (values.dt.nanosecond != 0)).any():
+        return values.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    # Fractional seconds and time zones vary per value, format them one by one
+    return values.map(lambda value: value.isoformat(), na_action='ignore')
+
+def float32_column(values: pd.Series) -> np.ndarray:
+    """Round float32 values to FLOAT32_DIGITS significant digits as float64, e.g. 304.4681 rather than 304.4681396484375."""
+    values = values.to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        exponent = FLOAT32_DIGITS - 1 - np.floor(np.log10(np.abs(values)))
+        # Powers of ten are exact, unlike their inverses
+        scale = 10.0 ** np.abs(exponent)
+        rounded = np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    # Zeros, missing values and values beyond the exact powers of ten are kept as they are
+    return np.where(np.isfinite(rounded) & (np.abs(exponent) <= 22), rounded, values)
+
+def serializable_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make a DataFrame JSON serializable column by column.
+
+    Datetime columns become ISO 8601 strings and infinite values become NaN,
+    which the encoders write as null. float32 columns (see compact_frame)
+    are rounded to the digits they hold, see float32_column.
+
+    Args:
+        df: DataFrame to convert
+
+    Returns:
+        Converted copy of the DataFrame
+    """
+    df = df.replace([np.inf, -np.inf], np.nan)
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = isoformat_column(df[col])
+        elif df[col].dtype == np.float32:
+            df[col] = float32_column(df[col])
+    return df
+
+def frame_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a DataFrame to JSON serializable records, with None for missing values."""
+    df = serializable_frame(df)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def iter_ndjson(df: pd.DataFrame, chunk_rows: int = NDJSON_CHUNK_ROWS) -> Iterator[str]:
+    """
+    Encode the rows of a serializable DataFrame as newline-delimited JSON.
+
+    Rows are encoded chunk by chunk with the pandas JSON encoder, so only
+    one chunk is held as text at a time.
+
+    Args:
+        df: DataFrame as returned by serializable_frame
+        chunk_rows: Number of rows per chunk
+
+    Returns:
+        Iterator of chunks of NDJSON lines
+    """
+    for start in range(0, len(df), chunk_rows):
+        lines = df.iloc[start:start + chunk_rows].to_json(orient='records', lines=True, double_precision=15)
+        # Older pandas versions leave out the newline after the last line
+        yield lines if lines.endswith('\n') else lines + '\n'
+
+def ndjson_line(value: Any) -> str:
+    """Encode a JSON serializable value as a single NDJSON line."""
+    return json.dumps(value, allow_nan=False, separators=(',', ':')) + '\n'
@@ -0,0 +1,145 @@
+import uuid
+import threading
+import numpy as np
+import pandas as pd
+from typing import Any, List, Optional, Tuple
+from cachetools import TTLCache
+
+class BatchStatistics:
+    """
+    Running per-batch count, mean and sum of squared deviations (M2) of a set of columns.
+
+    Chunks are merged with the parallel form of Welford's algorithm, so
+    updating costs time proportional to the chunk, not to the history.
+    """
+
+    def __init__(self, columns: List[str], time_column: Optional[str] = None):
+        self.columns = list(columns)
+        self.time_column = time_column
+        self.count = pd.DataFrame(columns=self.columns, dtype=float)
+        self.mean = pd.DataFrame(columns=self.columns, dtype=float)
+        self.m2 = pd.DataFrame(columns=self.columns, dtype=float)
+        self.first = pd.Series(dtype=object)
+
+    def update(self, chunk: pd.DataFrame) -> List[Any]:
+        """
+        Merge the statistics of a chunk of rows.
+
+        Args:
+            chunk: Per-batch statistics of the new rows, as returned by
+                analysis.pipeline.summarize_batches for the same columns
+
+        Returns:
+            List of the batches the chunk touched
+        """
+        if chunk.empty:
+            return []
+
+        # Existing batches keep their position, new ones are appended in order
+        index = self.count.index.append(chunk.index.difference(self.count.index, sort=False))
+
+        count_a = self.count.reindex(index, fill_value=0)
+        mean_a = self.mean.reindex(index).fillna(0)
+        m2_a = self.m2.reindex(index, fill_value=0)
+
+        count_b = chunk['count'][self.columns].reindex(index, fill_value=0)
+        mean_b = chunk['mean'][self.columns].reindex(index).fillna(0)
+        # Sample variance of the chunk back to M2; single values have no spread
+        m2_b = (chunk['std'][self.columns] ** 2 * (chunk['count'][self.columns] - 1)).reindex(index).fillna(0)
+
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = (mean_a + delta * count_b / count).where(count > 0)
+            self.m2 = (m2_a + m2_b + delta ** 2 * count_a * count_b / count).where(count > 0, 0)
+        self.count = count
+
+        if self.time_column:
+            first = chunk[('first', self.time_column)]
+            if not self.first.empty:
+                first = pd.concat([self.first, first])
+            self.first = first.groupby(level=0, sort=False).min().reindex(index)
+
+        return chunk.index.tolist()
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Get the statistics in the format of analysis.pipeline.summarize_batches.
+        """
+        with np.errstate(invalid='ignore'):
+            std = np.sqrt(self.m2 / (self.count - 1)).where(self.count > 1)
+
+        summary = pd.concat({
+            'count': self.count,
+            'mean': self.mean,
+            'std': std,
+        }, axis=1)
+
+        if self.time_column:
+            summary[('first', self.time_column)] = self.first
+
+        return summary
+
+def affected_batches(batches: List[Any], touched: List[Any], product_batches: List[Any]) -> List[Any]:
+    """
+    Get the batches whose deviation information changes when some batches change.
+
+    A touched recommendation batch also changes every following batch that
+    uses it as reference, up to the next recommendation batch.
+
+    Args:
+        batches: All batches in order
+        touched: Batches whose statistics changed
+        product_batches: Batches that received a recommendation
+
+    Returns:
+        List of affected batches in order
+    """
+    touched = set(touched)
+    product_batches = set(product_batches)
+
+    affected = []
+    reference_touched = False
+    for batch in batches:
+        if batch in product_batches:
+            reference_touched = batch in touched
+        if batch in touched or reference_touched:
+            affected.append(batch)
+
+    return affected
+
+class ProcessDataSession:
+    """Server-side state of an incremental process-data analysis."""
+
+    def __init__(self, target_variable: str, reco_tags: List[str], product_batches: List[Any],
+                 bounds: Tuple[float, float], statistics: BatchStatistics):
+        self.id = uuid.uuid4().hex
+        self.target_variable = target_variable
+        self.reco_tags = reco_tags
+        self.product_batches = product_batches
+        self.bounds = bounds
+        self.statistics = statistics
+
+class SessionStore:
+    """Bounded store of sessions that expire after ttl seconds without access."""
+
+    def __init__(self, maxsize: int = 64, ttl: float = 3600):
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def add(self, session: ProcessDataSession) -> ProcessDataSession:
+        with self.lock:
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[ProcessDataSession]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                # Refresh the expiry on access
+                self.sessions[session_id] = session
+            return session
+
+    def remove(self, session_id: str) -> Optional[ProcessDataSession]:
+        with self.lock:
+            return self.sessions.pop(session_id, None)
@@ -0,0 +1,93 @@
+import numpy as np
+from typing import Iterable
+
+# Rows added to a digest at a time when building it from a column
+DIGEST_CHUNK_ROWS = 100_000
+
+class TDigest:
+    """
+    Mergeable sketch of a distribution for approximate quantiles (t-digest).
+
+    Values are summarized by centroids (mean, weight) whose size is bounded
+    by the k1 scale function, so centroids are small near the tails and the
+    extreme quantiles used for outlier bounds stay accurate. Digests built
+    from separate chunks, or in separate workers, are combined with merge.
+    """
+
+    def __init__(self, compression: float = 200):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], compression: float = 200,
+                    chunk_rows: int = DIGEST_CHUNK_ROWS) -> 'TDigest':
+        """Build a digest from values, chunk by chunk."""
+        digest = cls(compression)
+        values = np.asarray(values, dtype=float)
+        for start in range(0, len(values), chunk_rows):
+            digest.update(values[start:start + chunk_rows])
+        return digest
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self, values: np.ndarray) -> 'TDigest':
+        """Add a chunk of values, NaN values are ignored."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self.compress(np.concatenate([self.means, values]),
+                          np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other: 'TDigest') -> 'TDigest':
+        """Add the values summarized by another digest."""
+        if len(other.weights):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.compress(np.concatenate([self.means, other.means]),
+                          np.concatenate([self.weights, other.weights]))
+        return self
+
+    def compress(self, means: np.ndarray, weights: np.ndarray):
+        """Merge sorted neighbouring centroids that fall within the same unit of the k1 scale."""
+        order = np.argsort(means, kind='stable')
+        means = means[order]
+        weights = weights[order]
+
+        total = weights.sum()
+        # Quantile at the left edge of each centroid, mapped to the k1 scale
+        left = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * left - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile, interpolating between centroid centers.
+
+        Returns:
+            Approximate q-quantile, NaN for an empty digest
+        """
+        if not len(self.weights):
+            return np.nan
+        if q <= 0:
+            return float(self.min)
+        if q >= 1:
+            return float(self.max)
+
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        # Anchor the ends at the exact extremes
+        positions = np.r_[0, centers, total]
+        values = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q * total, positions, values))
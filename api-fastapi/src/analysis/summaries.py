@@ -0,0 +1,186 @@
+import sqlite3
+import pandas as pd
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+STATISTICS = ('count', 'mean', 'std')
+
+# Bounds of the target a batch summary stays valid for, see analysis.pipeline.trim_ranges
+TRIM_RANGES = ('low_from', 'low_to', 'high_from', 'high_to')
+
+# Stores of an older layout only hold summaries that can be computed again, they are cleared
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+DROP TABLE IF EXISTS scopes;
+DROP TABLE IF EXISTS totals;
+DROP TABLE IF EXISTS batches;
+DROP TABLE IF EXISTS statistics;
+CREATE TABLE batches (
+    scope TEXT,
+    batch TEXT,
+    time_column TEXT,
+    first,
+    low_from REAL,
+    low_to REAL,
+    high_from REAL,
+    high_to REAL,
+    PRIMARY KEY (scope, batch)
+);
+CREATE TABLE statistics (
+    scope TEXT,
+    batch TEXT,
+    variable TEXT,
+    count REAL,
+    mean REAL,
+    std REAL,
+    PRIMARY KEY (scope, batch, variable)
+);
+"""
+
+def summary_scope(params: Dict[str, Any], target_variable: str) -> str:
+    """Build the store scope of a site/line/partFamily dataset and target variable."""
+    # Query parameters are plain identifiers, so they cannot contain the separator
+    return '/'.join([params['site'], params['line'], params['partFamily'], target_variable])
+
+def stored_value(value: Any) -> Any:
+    """Convert a batch start to a value SQLite can store."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    # numpy scalars to Python ones
+    return value.item() if hasattr(value, 'item') else value
+
+class BatchSummaryStore:
+    """
+    Persistent per-batch statistics of closed batches, in a SQLite file.
+
+    Statistics (count, mean and std of each variable, and the batch start)
+    are stored per scope, see summary_scope, as computed over the rows the
+    outlier bounds of the target kept. Along with them, each batch stores
+    the range of bounds that keep the same rows (see
+    analysis.pipeline.trim_ranges), so they are only reused by analyses
+    whose bounds fall within it, and computed again otherwise.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Open the store in a transaction, committed on success."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.create_schema(connection)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def create_schema(connection: sqlite3.Connection):
+        """Create the tables of a new store, or of a store of another layout."""
+        # Another worker may be creating them as well
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for statement in SCHEMA.split(';'):
+                    if statement.strip():
+                        connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def load(self, scope: str, batches: List[Any], columns: List[str], time_column: Optional[str],
+             bounds: Tuple[float, float]) -> pd.DataFrame:
+        """
+        Load the stored statistics of some batches.
+
+        Args:
+            scope: Store scope
+            batches: Batch IDs to look up, stored batches come back with these values
+            columns: Variables to load; batches missing any of them are left out
+            time_column: Column the batch start was taken from
+            bounds: Outlier bounds of the target; batches whose stored
+                statistics were computed over other rows are left out
+
+        Returns:
+            DataFrame indexed by BATCH in the format of
+            analysis.pipeline.summarize_batches
+        """
+        # Batch IDs are stored as text, map them back to the IDs of the data
+        ids = {str(batch): batch for batch in batches}
+        low, high = float(bounds[0]), float(bounds[1])
+
+        with self.connect() as connection:
+            connection.execute("CREATE TEMP TABLE requested (batch TEXT PRIMARY KEY)")
+            connection.executemany("INSERT INTO requested (batch) VALUES (?)", [(batch,) for batch in ids])
+            rows = pd.read_sql_query(
+                "SELECT s.batch, s.variable, s.count, s.mean, s.std, b.first "
+                "FROM requested r "
+                "JOIN batches b ON b.scope = ? AND b.batch = r.batch "
+                "JOIN statistics s ON s.scope = b.scope AND s.batch = b.batch "
+                "WHERE b.time_column IS ? AND b.low_from < ? AND ? <= b.low_to AND b.high_from <= ? AND ? < b.high_to "
+                f"AND s.variable IN ({', '.join('?' * len(columns))})",
+                connection, params=(scope, time_column, low, low, high, high, *columns)
+            )
+
+        summary = rows.pivot(index='batch', columns='variable', values=list(STATISTICS))
+        summary = summary.reindex(columns=pd.MultiIndex.from_product([STATISTICS, columns]))
+        summary = summary.dropna(subset=[('count', col) for col in columns])
+        if time_column:
+            summary[('first', time_column)] = rows.groupby('batch')['first'].first().reindex(summary.index)
+        summary.index = summary.index.map(ids)
+
+        return summary
+
+    def save(self, scope: str, time_column: Optional[str], summary: pd.DataFrame, columns: List[str],
+             ranges: pd.DataFrame):
+        """
+        Store the statistics of closed batches, replacing those stored before.
+
+        Args:
+            scope: Store scope
+            time_column: Column the batch start was taken from
+            summary: Statistics as returned by analysis.pipeline.summarize_batches
+            columns: Variables of the statistics
+            ranges: Bounds of the target the statistics stay valid for, per
+                batch of the summary, see analysis.pipeline.trim_ranges
+        """
+        if summary.empty:
+            return
+
+        batches = [str(batch) for batch in summary.index]
+        if time_column:
+            firsts = [stored_value(value) for value in summary[('first', time_column)]]
+        else:
+            firsts = [None] * len(batches)
+        limits = ranges.reindex(summary.index)[list(TRIM_RANGES)].to_numpy(dtype=float).tolist()
+        values = {statistic: summary[statistic][columns].to_numpy(dtype=float) for statistic in STATISTICS}
+
+        with self.connect() as connection:
+            # Statistics of variables this analysis did not compute may use other bounds
+            connection.executemany(
+                "DELETE FROM statistics WHERE scope = ? AND batch = ?",
+                [(scope, batch) for batch in batches]
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO batches (scope, batch, time_column, first, low_from, low_to, high_from, high_to) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(scope, batch, time_column, first, *limit) for batch, first, limit in zip(batches, firsts, limits)]
+            )
+            connection.executemany(
+                "INSERT INTO statistics (scope, batch, variable, count, mean, std) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (scope, batch, col) + tuple(
+                        None if pd.isna(values[statistic][i, j]) else float(values[statistic][i, j])
+                        for statistic in STATISTICS
+                    )
+                    for i, batch in enumerate(batches)
+                    for j, col in enumerate(columns)
+                ]
+            )
@@ -0,0 +1,137 @@
+import os
+import time
+import bisect
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the stage duration histogram buckets
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+class StageTimer:
+    """Durations in seconds of the stages of a request, in the order they first ran."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def merge(self, stages: Dict[str, float]):
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    def server_timing(self) -> str:
+        """Format the stages as a Server-Timing header value."""
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items())
+
+current_timer: ContextVar[Optional[StageTimer]] = ContextVar('current_timer', default=None)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as a stage of the current request, if it is timed."""
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+def timed_call(fn: Callable[..., Any], args: Tuple[Any, ...], submitted: float,
+               profile_threshold: Optional[float] = None,
+               profile_dir: Optional[str] = None) -> Tuple[Any, Dict[str, float]]:
+    """
+    Run fn(*args) in a worker with its own stage timer.
+
+    Args:
+        fn: Function to run
+        args: Arguments of the function
+        submitted: Wall-clock time the job was submitted at, to time its queueing
+        profile_threshold: If set, the job runs under cProfile and its
+            profile is saved when it takes at least this many seconds
+        profile_dir: Directory to save profiles to
+
+    Returns:
+        Tuple of the result of the function and its stage durations
+    """
+    timer = StageTimer()
+    timer.add('queue', max(time.time() - submitted, 0))
+    token = current_timer.set(timer)
+
+    profiler = cProfile.Profile() if profile_threshold is not None else None
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = fn(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        current_timer.reset(token)
+
+    elapsed = time.perf_counter() - start
+    if profiler is not None and elapsed >= profile_threshold:
+        os.makedirs(profile_dir or '.', exist_ok=True)
+        path = os.path.join(profile_dir or '.', f'{fn.__name__}-{int(time.time() * 1000)}-{os.getpid()}.prof')
+        profiler.dump_stats(path)
+        logger.warning("Slow transformation job %s took %.2fs, profile saved to %s", fn.__name__, elapsed, path)
+
+    return result, timer.stages
+
+class StageHistograms:
+    """Per-route histograms of stage durations."""
+
+    def __init__(self, buckets: Tuple[float, ...] = HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.histograms: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route: str, stages: Dict[str, float]):
+        with self.lock:
+            histograms = self.histograms.setdefault(route, {})
+            for name, seconds in stages.items():
+                milliseconds = seconds * 1000
+                histogram = histograms.setdefault(name, {
+                    'count': 0,
+                    'sum_ms': 0.0,
+                    'max_ms': 0.0,
+                    'counts': [0] * (len(self.buckets) + 1),
+                })
+                histogram['count'] += 1
+                histogram['sum_ms'] += milliseconds
+                histogram['max_ms'] = max(histogram['max_ms'], milliseconds)
+                histogram['counts'][bisect.bisect_left(self.buckets, milliseconds)] += 1
+
+    def stats(self) -> dict:
+        """Get the histograms with cumulative bucket counts, keyed by their upper bound in milliseconds."""
+        with self.lock:
+            stats = {}
+            for route, histograms in self.histograms.items():
+                stats[route] = {}
+                for name, histogram in histograms.items():
+                    cumulative = 0
+                    buckets = {}
+                    for bound, count in zip(self.buckets + ('+Inf',), histogram['counts']):
+                        cumulative += count
+                        buckets[str(bound)] = cumulative
+                    stats[route][name] = {
+                        'count': histogram['count'],
+                        'sum_ms': histogram['sum_ms'],
+                        'mean_ms': histogram['sum_ms'] / histogram['count'],
+                        'max_ms': histogram['max_ms'],
+                        'buckets': buckets,
+                    }
+            return stats
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
@@ -1,225 +1,121 @@
+import time
+import functools
+from typing import Any, Callable, Dict, Iterator
 from fastapi import APIRouter, Request, HTTPException
-import pandas as pd
-from typing import List, Dict, Any, Optional
-import statistics
-import numpy as np
-import json
+from fastapi.responses import Response, StreamingResponse
+from fastapi.routing import APIRoute
 
-router = APIRouter()
+from config import settings
+from analysis.cache import ResultCache
+from analysis.executor import PipelineExecutor
+from analysis.serialization import ndjson_line
+from analysis.timing import StageHistograms, StageTimer, current_timer, stage
+from analysis.summaries import BatchSummaryStore
+from analysis.sessions import BatchStatistics, ProcessDataSession, SessionStore, affected_batches
+from analysis.pipeline import calculate_batch_deviations
+from analysis.jobs import (
+    append_session_job,
+    batch_details_job,
+    correlation_matrix_job,
+    create_session_job,
+    process_data_job,
+    run_request,
+)
 
-def calculate_std(values: List[float]) -> float:
-    """
-    Calculate standard deviation of a list of values.
-    
-    Args:
-        values: List of numeric values
-        
-    Returns:
-        Standard deviation
-    """
-    if not values:
-        return 0
-    
-    try:
-        return statistics.stdev(values)
-    except statistics.StatisticsError:
-        # Handle case with only one value
-        return 0
+stage_histograms = StageHistograms()
 
-def calculate_correlations(df: pd.DataFrame, target_variable: str) -> Dict[str, float]:
+class TimedRoute(APIRoute):
     """
-    Calculate correlations between target variable and all other numeric variables.
-    
-    Args:
-        df: DataFrame containing variables
-        target_variable: Name of the target variable
-        
-    Returns:
-        Dictionary of variable names and their correlation with target
+    Route that times the stages of its requests (see analysis.timing).
+
+    The stages are sent in a Server-Timing header, along with the response
+    serialization and the total, and added to stage_histograms.
     """
-    if df.empty or target_variable not in df.columns:
-        return {}
-        
-    correlations = {}
-    numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns
-    
-    for col in numeric_cols:
-        if col != target_variable:
-            try:
-                # Calculate Pearson correlation
-                correlation = df[target_variable].corr(df[col])
-                if not pd.isna(correlation):
-                    correlations[col] = correlation
-            except:
-                continue
-                
-    return correlations
-
-def calculate_variable_stats(df, batch_id=None, target_variable=None):
-    """Calculate advanced statistics for variables, focusing on recommendation tags."""
-    if df.empty:
-        return {}
-
-    # Convert DateTime column to datetime if it's not already
-    if 'DateTime' in df.columns:
-        df['DateTime'] = pd.to_datetime(df['DateTime'])
-
-    # Filter for uptime data only
-    df = df[df['run_state'] == 'Uptime'].copy()
-    
-    if batch_id:
-        df = df[df['BATCH'] == batch_id]
-
-    # Get numeric columns excluding specific ones
-    numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns
-    exclude_cols = ['DateTime', 'BATCH']
-    numeric_cols = [col for col in numeric_cols if col not in exclude_cols]
-
-    # Calculate correlations if target variable is provided
-    correlations = {}
-    if target_variable and target_variable in df.columns:
-        correlations = calculate_correlations(df, target_variable)
-
-    # For columns that should be numeric but aren't, try to convert them
-    for col in df.columns:
-        if col not in numeric_cols and col not in exclude_cols:
-            try:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                if not df[col].isna().all():  # If conversion produced some valid numbers
-                    numeric_cols = numeric_cols.append(pd.Index([col]))
-            except:
-                continue
-
-    stats = {}
-    for col in numeric_cols:
-        # Skip if column is all NaN
-        if df[col].isna().all():
-            continue
-
-        values = df[col].dropna()
-        if len(values) < 2:  # Need at least 2 points for statistics
-            continue
-
-        try:
-            # Calculate basic statistics
-            mean = float(values.mean())
-            std = float(values.std())
-            
-            # Handle infinite or NaN values
-            if pd.isna(mean) or np.isinf(mean):
-                mean = 0
-            if pd.isna(std) or np.isinf(std):
-                std = 0
-            
-            # Calculate trend (normalized slope)
-            time_values = (df['DateTime'] - df['DateTime'].min()).dt.total_seconds()
-            trend = 0
-            if len(time_values) > 1:
-                try:
-                    slope = np.polyfit(time_values, values.astype(float), 1)[0]
-                    # Normalize slope to represent relative change per hour
-                    if mean != 0:
-                        trend = (slope * 3600) / mean
-                except:
-                    trend = 0
-
-            # Calculate volatility (coefficient of variation)
-            volatility = (std / mean * 100) if mean != 0 else 0
-
-            # Handle infinite or NaN values in calculated stats
-            if pd.isna(trend) or np.isinf(trend):
-                trend = 0
-            if pd.isna(volatility) or np.isinf(volatility):
-                volatility = 0
-
-            # Get min/max values safely
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        # Including the router in the app creates the routes again from their endpoints
+        if not getattr(endpoint, 'timed', False):
+            original = endpoint
+
+            @functools.wraps(original)
+            async def endpoint(*args: Any, **kwargs: Any) -> Any:
+                with stage('endpoint'):
+                    return await original(*args, **kwargs)
+
+            endpoint.timed = True
+
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], Any]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            timer = StageTimer()
+            token = current_timer.set(timer)
+            start = time.perf_counter()
             try:
-                min_val = float(values.min())
-                max_val = float(values.max())
-                if pd.isna(min_val) or np.isinf(min_val):
-                    min_val = 0
-                if pd.isna(max_val) or np.isinf(max_val):
-                    max_val = 0
-                range_val = max_val - min_val
-            except:
-                min_val = max_val = range_val = 0
-
-            # Get correlation safely
-            correlation = correlations.get(col, 0)
-            if pd.isna(correlation) or np.isinf(correlation):
-                correlation = 0
-
-            # Store statistics with safe values
-            stats[col] = {
-                'mean': mean,
-                'std': std,
-                'trend': float(trend),
-                'volatility': float(volatility),
-                'min': min_val,
-                'max': max_val,
-                'range': range_val,
-                'correlation': float(correlation)
-            }
-        except Exception as e:
-            print(f"Error calculating stats for column {col}: {str(e)}")
-            continue
+                response = await handler(request)
+            finally:
+                current_timer.reset(token)
+            total = time.perf_counter() - start
 
-    return stats
+            # What the endpoint did not spend went to validation and serialization
+            timer.add('serialize', max(total - timer.stages.pop('endpoint', total), 0))
+            timer.add('total', total)
 
-def calculate_point_correlation(data, variable1, variable2):
-    """Calculate simple point-by-point correlations between two variables.
-    
-    Args:
-        data: DataFrame containing the variables
-        variable1: Name of first variable
-        variable2: Name of second variable
-        
-    Returns:
-        List of [timestamp, correlation, run_state] triplets
+            response.headers['Server-Timing'] = timer.server_timing()
+            stage_histograms.observe(self.path, timer.stages)
+            return response
+
+        return timed_handler
+
+router = APIRouter(route_class=TimedRoute)
+
+result_cache = ResultCache(
+    maxsize=settings.transformations_cache_size,
+    ttl=settings.transformations_cache_ttl,
+    max_bytes=int(settings.transformations_cache_max_mb * 1024 ** 2) if settings.transformations_cache_max_mb else None
+)
+summary_store = BatchSummaryStore(settings.transformations_summary_store) if settings.transformations_summary_store else None
+sessions = SessionStore(maxsize=settings.transformations_max_sessions, ttl=settings.transformations_session_ttl)
+executor = PipelineExecutor(
+    kind=settings.transformations_executor,
+    workers=settings.transformations_workers,
+    max_pending=settings.transformations_max_pending,
+    timeout=settings.transformations_timeout,
+    profile_rate=settings.transformations_profile_rate,
+    profile_threshold=settings.transformations_profile_threshold,
+    profile_dir=settings.transformations_profile_dir,
+)
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+def accepts_ndjson(request: Request) -> bool:
+    """Check whether a request asks for a newline-delimited JSON response."""
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+def iter_batch_details(result: Dict[str, Any]) -> Iterator[str]:
+    """Encode a streamed batch-details result: a first line without processed_data, then its chunks of row lines."""
+    yield ndjson_line({key: value for key, value in result.items() if key != "processed_data"})
+    yield from result["processed_data"]
+
+@router.get("/transformations/cache")
+async def cache_stats():
     """
-    if not all(col in data.columns for col in [variable1, variable2, 'DateTime', 'run_state']):
-        return []
-        
-    try:
-        # Convert to numeric, handling NaN and inf values
-        data.loc[:, variable1] = pd.to_numeric(data.loc[:, variable1], errors='coerce')
-        data.loc[:, variable2] = pd.to_numeric(data.loc[:, variable2], errors='coerce')
-        
-        # Replace infinite values with 0
-        data.loc[:, variable1] = data.loc[:, variable1].replace([np.inf, -np.inf], 0)
-        data.loc[:, variable2] = data.loc[:, variable2].replace([np.inf, -np.inf], 0)
-        
-        # Replace NaN with 0
-        data.loc[:, variable1] = data.loc[:, variable1].fillna(0)
-        data.loc[:, variable2] = data.loc[:, variable2].fillna(0)
-        
-        # Calculate means and standard deviations
-        mean1 = data[variable1].mean()
-        mean2 = data[variable2].mean()
-        std1 = data[variable1].std() or 1  # Use 1 if std is 0
-        std2 = data[variable2].std() or 1  # Use 1 if std is 0
-            
-        # Calculate point-by-point correlations
-        result = []
-        for _, row in data.iterrows():
-            ts = int(pd.Timestamp(row['DateTime']).timestamp() * 1000)  # Convert to milliseconds
-            
-            # Calculate z-scores
-            z1 = (row[variable1] - mean1) / std1
-            z2 = (row[variable2] - mean2) / std2
-            
-            # Calculate correlation as product of z-scores, normalized to [-1, 1]
-            corr = (z1 * z2) / max(abs(z1 * z2), 1) if abs(z1 * z2) > 0 else 0
-            
-            # Ensure correlation is finite and in [-1, 1] range
-            corr = max(min(float(corr), 1), -1)
-            result.append([ts, corr, row['run_state']])
+    Get size and hit/miss counters of the transformation result cache.
+    """
+    return result_cache.stats()
 
-        return sorted(result, key=lambda x: x[0])  # Sort by timestamp
-        
-    except Exception as e:
-        print(f"Error calculating correlation: {str(e)}")
-        return []
+@router.get("/transformations/metrics")
+async def metrics():
+    """
+    Get histograms of the stage durations of each transformation route,
+    along with the state of the job executor.
+    """
+    return {
+        "stages": stage_histograms.stats(),
+        "executor": executor.stats()
+    }
 
 @router.post("/transformations/process-data")
 async def process_data(request: Request):
@@ -227,419 +123,191 @@ async def process_data(request: Request):
     Process production and alertman data to calculate deviations.
     
     Request body should contain:
-    - production_data: List of production data records
-    - alertman_data: List of alertman data records
+    - production_data: Production data records
+    - alertman_data: Alertman data records
     - target_variable: Name of the target variable to analyze
     - batch_id: Optional batch ID for detailed statistics
+    - outliers: Optional target outlier filter, {"method": "exact" or
+      "tdigest", "quantiles": [low, high], "per_batch": false}; defaults to
+      the exact 3% and 97% quantiles over all rows
+
+    Datasets are given as {"items": [records]} or {"columns": {name: [values]}},
+    or the body is an Arrow IPC stream (see analysis.payload.read_body).
+
+    When the body gives site/line/partFamily and a summary store is
+    configured, closed batches are read from the store instead of being
+    aggregated again (see analysis.summaries), unless outliers is given.
     
     Returns:
         Processed data with deviation information
     """
     try:
-        data = await request.json()
-        production_data = data.get("production_data", [])
-        alertman_data = data.get("alertman_data", [])
-        target_variable = data.get("target_variable")
-        
-        if not production_data:
-            return {"error": "No production data available"}
-            
-        if not target_variable:
-            return {"error": "Target variable not specified"}
+        # Decoding, validation, fingerprinting and the deviations run as one job off the event loop
+        outcome = await run_request(request, executor, result_cache, process_data_job, summary_store)
+        return outcome.result
         
-        # Convert to pandas DataFrames
-        df_production = pd.DataFrame.from_dict(production_data["items"])
-        df_alertman = pd.DataFrame(alertman_data["items"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing data: {str(e)}")
 
-        # remove downtime data
-        df_production = df_production[df_production['run_state'] == 'Uptime']
-        
-        # Check if target variable exists in the data
-        if target_variable not in df_production.columns:
-            return {"error": f"Target variable '{target_variable}' not found in production data"}
-        
-        # Remove rows with missing or non-numeric target values
-        df_production = df_production[pd.to_numeric(df_production[target_variable], errors='coerce').notna()]
-        
-        if df_production.empty:
-            return {"error": f"No valid values found for target variable: {target_variable}"}
-        
-        # Remove outliers using quantiles (3% and 97%)
-        low_quantile = df_production[target_variable].quantile(0.03)
-        high_quantile = df_production[target_variable].quantile(0.97)
-        
-        df_filtered = df_production[(df_production[target_variable] >= low_quantile) & 
-                                    (df_production[target_variable] <= high_quantile)]
-        
-        # Get recommendation tags and batches from alertman data
-        if not df_alertman.empty:
-            # Check if required columns exist
-            if 'decision' in df_alertman.columns and 'tag' in df_alertman.columns:
-                reco_tags = df_alertman[df_alertman['decision'].notna() & (df_alertman['decision'] != '')]['tag'].unique().tolist()
-            else:
-                reco_tags = []
-                
-            if 'state__extra__batch_id' in df_alertman.columns:
-                product_batches = df_alertman['state__extra__batch_id'].dropna().unique().tolist()
-            else:
-                product_batches = []
-        else:
-            reco_tags = []
-            product_batches = []
-        
-        print(reco_tags)
-        # Get all batches from filtered data
-        if 'BATCH' in df_filtered.columns:
-            all_batches = df_filtered['BATCH'].dropna().unique().tolist()
-        else:
-            return {"error": "BATCH column not found in filtered data"}
-        
-        # Process batch data
-        current_product_batch = None
-        previous_product_batch = None
-        processed_data = []
-        
-        for batch in all_batches:
-            # Get rows for this batch
-            batch_df = df_filtered[df_filtered['BATCH'] == batch]
-            
-            if batch_df.empty:
-                continue
-            
-            # Calculate mean value for target variable
-            mean_value = batch_df[target_variable].mean()
-            
-            # Find the earliest timestamp for this batch
-            if 'minute_level' in batch_df.columns:
-                first_timestamp = batch_df['minute_level'].min()
-            elif 'BATCHSTART' in batch_df.columns:
-                first_timestamp = batch_df['BATCHSTART'].min()
-            else:
-                first_timestamp = None
-            
-            result = {
-                "BATCH": batch,
-                "BATCHSTART": first_timestamp,
-                target_variable: mean_value
+@router.post("/transformations/process-data/sessions")
+async def create_process_data_session(request: Request):
+    """
+    Start an incremental process-data analysis.
+
+    Takes the same body as /transformations/process-data. Per-batch running
+    statistics are kept server-side, so new rows can then be appended with
+    /transformations/process-data/sessions/{session_id}/append. The outlier
+    bounds of the target are fixed from this initial data.
+
+    Returns:
+        Session ID and processed data with deviation information
+    """
+    try:
+        outcome = await run_request(request, executor, None, create_session_job)
+        result = outcome.result
+        if "error" in result:
+            return result
+
+        statistics = BatchStatistics(result["columns"], result["time_column"])
+        statistics.update(result["summary"])
+
+        session = sessions.add(ProcessDataSession(result["target_variable"], result["reco_tags"],
+                                                  result["product_batches"], result["bounds"], statistics))
+        processed_data = calculate_batch_deviations(statistics.summary(), session.target_variable, session.reco_tags,
+                                                    session.product_batches, statistics.time_column)
+
+        return {
+            "session_id": session.id,
+            "processed_data": processed_data
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing data: {str(e)}")
+
+@router.post("/transformations/process-data/sessions/{session_id}/append")
+async def append_process_data_session(session_id: str, request: Request):
+    """
+    Append new rows to an incremental process-data analysis.
+
+    Request body should contain:
+    - production_data: New production data records
+    - alertman_data: Optional alertman records; their recommendation batches
+      are added to the session's ones
+
+    Returns:
+        Processed data with deviation information, only for the batches
+        whose deviation information changed
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"Session {session_id} not found",
+                "session_id": session_id
             }
-            
-            if batch not in product_batches:
-                if not current_product_batch:
-                    # No reference batch yet
-                    result["deviation_info"] = {
-                        "total_deviation": -1,
-                        "deviation_percent": 0,
-                        "deviations": []
-                    }
-                else:
-                    # Get reference batch data
-                    ref_batch_df = df_filtered[df_filtered['BATCH'] == current_product_batch]
-                    
-                    if not ref_batch_df.empty:
-                        current_batch_means = {}
-                        ref_batch_means = {}
-                        deviations = {}
-                        deviation_percents = {}
-                        
-                        # Calculate means for all tags
-                        for tag in reco_tags:
-                            if tag in batch_df.columns:
-                                # Calculate mean for current batch
-                                current_batch_means[tag] = batch_df[tag].mean()
-                                
-                                # Calculate mean for reference batch
-                                if tag in ref_batch_df.columns:
-                                    ref_batch_means[tag] = ref_batch_df[tag].mean()
-                                    
-                                    # Calculate standard deviation for normalization
-                                    ref_values = ref_batch_df[tag].dropna().tolist()
-                                    ref_std = max(calculate_std(ref_values) or 1, 1)
-                                    ref_mean = ref_batch_means[tag]
-                                    
-                                    # Calculate normalized deviation
-                                    deviations[tag] = abs(current_batch_means[tag] - ref_batch_means[tag]) / ref_std
-                                    
-                                    # Calculate percentage deviation
-                                    if ref_mean != 0:
-                                        deviation_percents[tag] = (abs(current_batch_means[tag] - ref_mean) / abs(ref_mean)) * 100
-                                    else:
-                                        deviation_percents[tag] = 0
-                        
-                        # Calculate total deviation percentage as the sum
-                        total_deviation_percent = sum(deviation_percents.values()) if deviation_percents else 0
-                        
-                        # Create list of deviations
-                        all_deviations = [
-                            {
-                                "variable": variable,
-                                "deviation": deviations[variable],
-                                "percent": percent,
-                                "contribution": (percent / total_deviation_percent) * 100 if total_deviation_percent > 0 else 0
-                            }
-                            for variable, percent in deviation_percents.items()
-                        ]
-                        
-                        # Sort by percentage deviation (descending) and take top 5
-                        all_deviations.sort(key=lambda x: x["percent"], reverse=True)
-                        top_deviations = all_deviations[:5]
-                        
-                        result["deviation_info"] = {
-                            "total_deviation": total_deviation_percent,
-                            "deviation_percent": total_deviation_percent,
-                            "deviations": top_deviations
-                        }
-                    else:
-                        result["deviation_info"] = {
-                            "total_deviation": 0,
-                            "deviation_percent": 0,
-                            "deviations": []
-                        }
-            else:
-                # This is a recommendation batch
-                previous_product_batch = current_product_batch
-                current_product_batch = batch
-                result["deviation_info"] = {
-                    "total_deviation": 0,
-                    "deviation_percent": 0,
-                    "deviations": []
-                }
-            
-            processed_data.append(result)
-        
+        )
+
+    try:
+        statistics = session.statistics
+
+        # Aggregate the new rows off the event loop, the merge itself is cheap
+        outcome = await run_request(request, executor, None, append_session_job, session.target_variable,
+                                    session.reco_tags, session.bounds, statistics.columns, statistics.time_column)
+        result = outcome.result
+        if "error" in result:
+            return result
+        chunk = result["summary"]
+
+        touched = statistics.update(chunk) if chunk is not None else []
+
+        product_batches = list(dict.fromkeys(session.product_batches + result["product_batches"]))
+        products_changed = len(product_batches) != len(session.product_batches)
+        session.product_batches = product_batches
+
+        summary = statistics.summary()
+        processed_data = calculate_batch_deviations(summary, session.target_variable, session.reco_tags,
+                                                    product_batches, statistics.time_column)
+
+        # New recommendation batches change the reference of any later batch
+        if not products_changed:
+            affected = set(affected_batches(summary.index.tolist(), touched, product_batches))
+            processed_data = [record for record in processed_data if record["BATCH"] in affected]
+
         return {
+            "session_id": session.id,
             "processed_data": processed_data
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing data: {str(e)}")
 
+@router.delete("/transformations/process-data/sessions/{session_id}")
+async def delete_process_data_session(session_id: str):
+    """
+    End an incremental process-data analysis.
+    """
+    if sessions.remove(session_id) is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"Session {session_id} not found",
+                "session_id": session_id
+            }
+        )
+    return {"session_id": session_id}
+
 @router.post("/transformations/batch-details")
 async def get_batch_details(request: Request):
     """
     Get detailed statistics for a specific batch.
     
     Request body should contain:
-    - production_data: List of production data records
-    - alertman_data: List of alertman data records
+    - production_data: Production data records
+    - alertman_data: Alertman data records
     - batch_id: Batch ID to analyze
+    - batch_ids: Instead of batch_id, a list of batch IDs or "all" to analyze
+      several batches from a single upload
     - target_variable: Name of the target variable to analyze
+    - max_points: Optional number of points to downsample processed_data and
+      each correlation series to for charting. processed_data is shared
+      equally between the target and the recommendation tags, so with
+      batch_id it must be at least 3 (lttb) or 2 (minmax) points per series
+    - downsampling: "lttb" (default, Largest-Triangle-Three-Buckets) or
+      "minmax" (minimum and maximum of each bucket)
+    - correlation_window: Optional rolling window, a number of rows or a
+      duration such as "30min", to get rolling Pearson correlations of each
+      tag with the target instead of point correlations. Windows without
+      spread have a null correlation
+
+    Datasets are given as {"items": [records]} or {"columns": {name: [values]}},
+    or the body is an Arrow IPC stream (see analysis.payload.read_body).
     
+    With an "Accept: application/x-ndjson" header and batch_id, the response
+    is streamed as newline-delimited JSON: a first line with variable_stats,
+    correlations_data and warnings, then one line per processed_data row.
+
     Returns:
-        Detailed statistics for the batch
+        Detailed statistics for the batch; with batch_ids, the variable_stats
+        and correlations_data of each batch under "batches", without row data
     """
     try:
-        # Parse request body
-        try:
-            data = await request.json()
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=400, 
-                detail={
-                    "message": "Invalid JSON in request body",
-                    "error": str(e)
-                }
-            )
-
-        # Extract and validate required fields
-        production_data = data.get("production_data", {})
-        alertman_data = data.get("alertman_data", {})
-        batch_id = data.get("batch_id")
-        target_variable = data.get("target_variable")
-
-        # Validate request data
-        if not isinstance(production_data, dict) or not production_data.get("items"):
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "Invalid production data format",
-                    "expected": {
-                        "production_data": {
-                            "items": "[array of records]"
-                        }
-                    }
-                }
-            )
-            
-        if not batch_id:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "Batch ID not specified",
-                    "field": "batch_id"
-                }
-            )
-        
-        if not target_variable:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "Target variable not specified",
-                    "field": "target_variable"
-                }
-            )
-        
-        # Convert to pandas DataFrame with error handling
-        try:
-            df_production = pd.DataFrame.from_dict(production_data.get("items", []))
-            df_alertman = pd.DataFrame.from_dict(alertman_data.get("items", []))
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "Error converting data to DataFrame",
-                    "error": str(e)
-                }
-            )
-        
-        if df_production.empty:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "No data found in production data",
-                    "error": "Empty DataFrame"
-                }
-            )
-            
-        # Get recommendation tags from alertman data
-        reco_tags = []
-        if not df_alertman.empty and 'decision' in df_alertman.columns and 'tag' in df_alertman.columns:
-            reco_tags = df_alertman[df_alertman['decision'].notna() & (df_alertman['decision'] != '')]['tag'].unique().tolist()
-        
-        if not reco_tags:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "No recommendation tags found in alertman data",
-                    "required_columns": ["decision", "tag"]
-                }
-            )
-            
-        # Convert DateTime column with error handling
-        try:
-            if 'DateTime' in df_production.columns:
-                df_production['DateTime'] = pd.to_datetime(df_production['DateTime'])
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "message": "Error converting DateTime column",
-                    "error": str(e)
-                }
-            )
-        
-        # Filter for the specific batch
-        batch_data = df_production[df_production['BATCH'] == batch_id]
-        
-        if batch_data.empty:
-            raise HTTPException(
-                status_code=404,
-                detail={
-                    "message": f"No data found for batch {batch_id}",
-                    "batch_id": batch_id
-                }
-            )
-        
-        # Convert numeric columns (only for recommendation tags)
-        numeric_conversion_errors = []
-        for tag in reco_tags:
-            if tag in df_production.columns:
-                try:
-                    df_production[tag] = pd.to_numeric(df_production[tag], errors='coerce')
-                except Exception as e:
-                    numeric_conversion_errors.append({"tag": tag, "error": str(e)})
-        
-        if numeric_conversion_errors:
-            print("Warning - Numeric conversion errors:", numeric_conversion_errors)
-        
-        # Calculate variable statistics (only for recommendation tags)
-        try:
-            # Filter DataFrame to only include recommendation tags and necessary columns
-            cols_to_keep = ['DateTime', 'BATCH', 'run_state'] + reco_tags + [target_variable]
-            cols_available = [col for col in cols_to_keep if col in df_production.columns]
-            df_filtered = df_production.loc[df_production['run_state'] == 'Uptime', cols_available]
-            variable_stats = calculate_variable_stats(df_filtered, batch_id, target_variable)
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "message": "Error calculating statistics",
-                    "error": str(e)
-                }
-            )
-        
-        # Calculate rolling correlations for each variable with target
-        correlations_data = {}
-        correlation_errors = []
-        for variable in reco_tags:
-            if variable != target_variable:
-                try:
-                    corr_data = calculate_point_correlation(
-                        batch_data,
-                        variable,
-                        target_variable
-                    )
-                    if corr_data:  # Only include if we have correlation data
-                        correlations_data[variable] = corr_data
-                except Exception as e:
-                    correlation_errors.append({"variable": variable, "error": str(e)})
-        
-        if correlation_errors:
-            print("Warning - Correlation calculation errors:", correlation_errors)
-        
-        # Get batch data for visualization
-        try:
-            # Include only recommendation tags in the processed data
-            viz_cols = ['DateTime', 'BATCH', 'run_state'] + reco_tags + [target_variable]
-            available_cols = [col for col in viz_cols if col in batch_data.columns]
-            batch_data_filtered = batch_data[available_cols]
-            
-            # Convert to records with error handling for JSON serialization
-            try:
-                processed_data = batch_data_filtered.to_dict('records')
-                # Ensure all values are JSON serializable
-                for record in processed_data:
-                    for key, value in record.items():
-                        if pd.isna(value) or (isinstance(value, float) and np.isinf(value)):
-                            record[key] = None
-                        elif isinstance(value, pd.Timestamp):
-                            record[key] = value.isoformat()
-                        elif isinstance(value, (np.int64, np.float64)):
-                            # Convert numpy types to Python types and handle inf values
-                            try:
-                                float_val = float(value)
-                                if np.isinf(float_val) or np.isnan(float_val):
-                                    record[key] = None
-                                else:
-                                    record[key] = float_val
-                            except:
-                                record[key] = None
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500,
-                    detail={
-                        "message": "Error converting data to JSON",
-                        "error": str(e)
-                    }
-                )
-                
-            return {
-                "processed_data": processed_data,
-                "variable_stats": variable_stats,
-                "correlations_data": correlations_data,
-                "warnings": {
-                    "numeric_conversion_errors": numeric_conversion_errors if numeric_conversion_errors else None,
-                    "correlation_errors": correlation_errors if correlation_errors else None
-                }
-            }
-            
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "message": "Error processing batch data",
-                    "error": str(e)
-                }
-            )
+        # Decoding, validation, fingerprinting and the statistics run as one job off the event loop
+        ndjson = accepts_ndjson(request)
+        outcome = await run_request(request, executor, result_cache, batch_details_job, ndjson)
+        result = outcome.result
+
+        # Only single batches have row data to stream
+        if ndjson and "batches" not in result:
+            # The job encoded the rows; the first line still waits for it to finish
+            return StreamingResponse(iter_batch_details(result), media_type=NDJSON_MEDIA_TYPE)
+        return result
             
     except HTTPException:
         raise
@@ -651,4 +319,39 @@ async def get_batch_details(request: Request):
                 "message": "Unexpected error in batch details",
                 "error": str(e)
             }
-        ) 
\ No newline at end of file
+        )
+
+@router.post("/transformations/correlation-matrix")
+async def get_correlation_matrix(request: Request):
+    """
+    Get the correlation matrix of the recommendation tags and the target.
+
+    Request body should contain:
+    - production_data: Production data records
+    - alertman_data: Alertman data records
+    - target_variable: Optional target variable to include in the matrix
+    - method: "pearson" (default) or "spearman"
+    - batch_id or batch_ids: Optional batch(es) to restrict the rows to, or "all"
+    - start, end: Optional DateTime range to restrict the rows to
+
+    Only Uptime rows are used, and each pair of variables uses the rows
+    where both have a value.
+
+    Returns:
+        Variables and their correlation matrix
+    """
+    try:
+        outcome = await run_request(request, executor, result_cache, correlation_matrix_job)
+        return outcome.result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Unexpected error in correlation matrix: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": "Unexpected error in correlation matrix",
+                "error": str(e)
+            }
+        )
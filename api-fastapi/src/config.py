@@ -1,5 +1,6 @@
 import os
 import tomllib
+from typing import Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -27,6 +28,37 @@ class Settings(BaseSettings):
     url_frontend: str
 
     url_tfnexus: str
+    tfnexus_datasource_id: int = 2
+
+    # Query templates used to resolve transformation datasets server-side
+    datasources_file: str = '../dashboard/datasources.json'
+
+    # Transformation result cache, entries expire after ttl seconds if set;
+    # the estimated memory of the entries is bounded by max_mb if set
+    transformations_cache_size: int = 128
+    transformations_cache_ttl: Optional[float] = None
+    transformations_cache_max_mb: Optional[float] = 256
+
+    # Incremental process-data sessions, dropped after ttl seconds without access
+    transformations_max_sessions: int = 64
+    transformations_session_ttl: float = 3600
+
+    # SQLite file storing per-batch statistics of closed batches for process-data
+    # requests given by site/line/partFamily, disabled if not set
+    transformations_summary_store: Optional[str] = None
+
+    # Transformation jobs run in a 'process' or 'thread' pool; beyond max_pending
+    # queued or running jobs requests get a 429, and jobs time out after timeout seconds
+    transformations_executor: str = 'process'
+    transformations_workers: int = 2
+    transformations_max_pending: int = 8
+    transformations_timeout: Optional[float] = 300
+
+    # Share of transformation jobs run under cProfile; profiles of the jobs
+    # taking at least threshold seconds are saved to profile_dir
+    transformations_profile_rate: float = 0
+    transformations_profile_threshold: float = 1
+    transformations_profile_dir: str = 'profiles'
 
     class Config:
         env_file=('.env', f'{mode}.env') # if 'dev' in sys.argv else 'production.env' )
@@ -12,6 +12,7 @@ from starlette.middleware.sessions import SessionMiddleware
 from config import settings
 from auth import routers as routers_auth
 from api import routers as routers_api
+from api.transformations import executor as transformations_executor
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -21,6 +22,8 @@ async def lifespan(app: FastAPI):
     app.state.configurations = resp.json()
     yield
 
+    transformations_executor.shutdown()
+
 app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The API is imported from src, the synthetic datasets from benchmarks
+sys.path[:0] = [os.path.join(API_DIR, 'src'), os.path.join(API_DIR, 'benchmarks')]
+
+# config reads pyproject.toml from the working directory and requires these settings
+os.chdir(API_DIR)
+for name in ('UVICORN_HOST', 'KEYCLOAK_OPENID_HOST', 'KEYCLOAK_OPENID_REALM', 'KEYCLOAK_OPENID_SCOPE',
+             'KEYCLOAK_CLIENT_ID', 'KEYCLOAK_CLIENT_SECRET', 'URL_BACKEND', 'URL_FRONTEND'):
+    os.environ.setdefault(name, 'test')
+os.environ.setdefault('UVICORN_PORT', '8000')
+os.environ.setdefault('URL_TFNEXUS', 'http://tfnexus')
+os.environ.setdefault('TRANSFORMATIONS_EXECUTOR', 'thread')
+
+FIXTURES_DIR = os.path.join(API_DIR, 'tests', 'fixtures')
+
+# The rewrite compacts columns to float32 (see analysis.payload.FLOAT32_TOLERANCE),
+# so its outputs differ from those of the original module by rounding errors
+BASELINE_TOLERANCE = {'rel': 1e-4, 'abs': 1e-4}
+
+
+def nested_approx(value):
+    """Compare the floats of a JSON value approximately, other values exactly"""
+    if isinstance(value, dict):
+        return {key: nested_approx(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [nested_approx(item) for item in value]
+    if isinstance(value, float):
+        return pytest.approx(value, **BASELINE_TOLERANCE)
+    return value
+
+
+@pytest.fixture(scope='session')
+def baseline():
+    """Request and responses of the original transformations module, see fixtures/make_baseline.py"""
+    with open(os.path.join(FIXTURES_DIR, 'baseline.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def transformations():
+    import api.transformations
+
+    api.transformations.result_cache.clear()
+    yield api.transformations
+    api.transformations.result_cache.clear()
+
+
+@pytest.fixture
+def client(transformations):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.include_router(transformations.router)
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope='session')
+def expected(baseline):
+    """Responses of baseline, compared with the tolerance of BASELINE_TOLERANCE"""
+    return nested_approx({key: value for key, value in baseline.items() if key != 'request'})
@@ -0,0 +1,81 @@
+"""
+Record the responses of the original transformations module to a synthetic
+request, as the expected outputs of the behaviour tests (baseline.json).
+
+The module is read from the commit before the transformations were
+rewritten. Run from api-fastapi: python tests/fixtures/make_baseline.py
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import types
+
+from fastapi.encoders import jsonable_encoder
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(FIXTURES_DIR, '..', '..', 'benchmarks'))
+
+from synthetic import TARGET_VARIABLE, alertman_frame, production_frame  # noqa: E402
+
+BASELINE_COMMIT = '0f66901'
+
+
+class BaselineRequest:
+    """The part of a Request the original endpoints read"""
+
+    def __init__(self, body):
+        self.body = body
+
+    async def json(self):
+        return json.loads(json.dumps(self.body))
+
+
+def baseline_module():
+    source = subprocess.run(
+        ['git', 'show', f'{BASELINE_COMMIT}:api-fastapi/src/api/transformations.py'],
+        capture_output=True, text=True, check=True
+    ).stdout
+    module = types.ModuleType('baseline_transformations')
+    exec(compile(source, 'baseline_transformations.py', 'exec'), module.__dict__)
+    return module
+
+
+def baseline_request():
+    """A small request without missing values, whose behaviour the rewrite keeps (see test_process_data)"""
+    df = production_frame(400, 5, 3, nan_ratio=0, seed=11).round(6)
+    alertman = alertman_frame(df, 2, seed=11)
+    return {
+        'production_data': {'columns': df.to_dict('list')},
+        'alertman_data': {'items': json.loads(alertman.to_json(orient='records'))},
+        'target_variable': TARGET_VARIABLE,
+    }
+
+
+def main():
+    baseline = baseline_module()
+    request = baseline_request()
+    # A recommendation batch and one compared with it
+    product_batches = [record['state__extra__batch_id'] for record in request['alertman_data']['items']]
+    batches = list(dict.fromkeys(request['production_data']['columns']['BATCH']))
+    batches = [product_batches[0], next(batch for batch in batches if batch not in product_batches)]
+
+    # The original endpoints only read row-oriented datasets
+    columns = request['production_data']['columns']
+    items = {**request, 'production_data': {'items': [dict(zip(columns, row)) for row in zip(*columns.values())]}}
+
+    def respond(endpoint, body):
+        return jsonable_encoder(asyncio.run(endpoint(BaselineRequest({**items, **body}))))
+
+    fixture = {
+        'request': request,
+        'process_data': respond(baseline.process_data, {}),
+        'batch_details': {batch: respond(baseline.get_batch_details, {'batch_id': batch}) for batch in batches},
+    }
+    with open(os.path.join(FIXTURES_DIR, 'baseline.json'), 'w') as f:
+        json.dump(fixture, f, allow_nan=False, separators=(',', ':'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic import TARGET_VARIABLE, production_frame
+from analysis.pipeline import calculate_point_correlations, calculate_rolling_correlations, calculate_variable_stats
+from analysis.serialization import frame_records, iter_ndjson, serializable_frame
+
+
+def looped_point_correlation(data, variable, target_variable):
+    """Point correlations computed row by row, as the original module did"""
+    x = pd.to_numeric(data[variable], errors='coerce').replace([np.inf, -np.inf], 0).fillna(0)
+    y = pd.to_numeric(data[target_variable], errors='coerce').replace([np.inf, -np.inf], 0).fillna(0)
+    std_x, std_y = x.std() or 1, y.std() or 1
+
+    points = []
+    for (_, row), value_x, value_y in zip(data.iterrows(), x, y):
+        product = (value_x - x.mean()) / std_x * (value_y - y.mean()) / std_y
+        correlation = product / max(abs(product), 1) if abs(product) > 0 else 0
+        timestamp = int(pd.Timestamp(row['DateTime']).tz_localize('UTC').timestamp() * 1000)
+        points.append([timestamp, max(min(float(correlation), 1), -1), row['run_state']])
+    return sorted(points, key=lambda point: point[0])
+
+
+@pytest.mark.parametrize('batch_id', ['B100000', 'B100001'])
+def test_batch_details_match_the_original_module(client, baseline, expected, batch_id):
+    response = client.post('/transformations/batch-details', json={**baseline['request'], 'batch_id': batch_id})
+
+    assert response.status_code == 200
+    assert response.json() == expected['batch_details'][batch_id]
+
+
+def test_point_correlations_match_the_row_by_row_computation():
+    df = production_frame(300, 1, 3, nan_ratio=0.1, seed=5)
+    df.loc[7, 'TAG_001'] = np.inf
+    df['TAG_002'] = 4.0
+    # Rows out of time order are sorted
+    df = df.sample(frac=1, random_state=5)
+    variables = ['TAG_000', 'TAG_001', 'TAG_002']
+
+    correlations = calculate_point_correlations(df, variables, TARGET_VARIABLE)
+
+    assert list(correlations) == variables
+    for variable in variables:
+        expected = looped_point_correlation(df, variable, TARGET_VARIABLE)
+        points = correlations[variable]
+        assert [point[0] for point in points] == [point[0] for point in expected]
+        assert [point[2] for point in points] == [point[2] for point in expected]
+        np.testing.assert_allclose([point[1] for point in points], [point[1] for point in expected], atol=1e-12)
+
+
+def test_point_correlations_skip_missing_columns():
+    df = production_frame(20, 1, 1, seed=5)
+
+    assert calculate_point_correlations(df, ['TAG_000', 'unknown'], TARGET_VARIABLE).keys() == {'TAG_000'}
+    assert calculate_point_correlations(df.drop(columns='run_state'), ['TAG_000'], TARGET_VARIABLE) == {}
+
+
+def test_multiple_batches_match_their_single_batch_details(client, baseline):
+    batch_ids = ['B100001', 'B100000', 'unknown']
+
+    response = client.post('/transformations/batch-details', json={**baseline['request'], 'batch_ids': batch_ids})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert [batch['batch_id'] for batch in result['batches']] == batch_ids[:2]
+    assert result['missing_batches'] == ['unknown']
+    for batch in result['batches']:
+        single = client.post('/transformations/batch-details',
+                             json={**baseline['request'], 'batch_id': batch['batch_id']}).json()
+        assert batch['variable_stats'] == single['variable_stats']
+        assert batch['correlations_data'] == single['correlations_data']
+
+
+def test_all_batches_come_in_order_of_appearance(client, baseline):
+    result = client.post('/transformations/batch-details', json={**baseline['request'], 'batch_ids': 'all'}).json()
+
+    batches = list(dict.fromkeys(baseline['request']['production_data']['columns']['BATCH']))
+    assert [batch['batch_id'] for batch in result['batches']] == batches
+    assert result['missing_batches'] is None
+
+
+def test_unknown_batches_are_not_found(client, baseline):
+    response = client.post('/transformations/batch-details', json={**baseline['request'], 'batch_ids': ['unknown']})
+
+    assert response.status_code == 404
+    assert response.json()['detail']['batch_ids'] == ['unknown']
+
+
+def test_variable_stats_match_a_computation_per_column():
+    df = production_frame(600, 3, 3, nan_ratio=0.2, seed=8)
+    df.loc[df['BATCH'] == 'B100001', 'TAG_002'] = [7.0] + [np.nan] * ((df['BATCH'] == 'B100001').sum() - 1)
+
+    stats = calculate_variable_stats(df, 'B100001', TARGET_VARIABLE)
+
+    rows = df[(df['run_state'] == 'Uptime') & (df['BATCH'] == 'B100001')]
+    seconds = (pd.to_datetime(rows['DateTime']) - pd.to_datetime(rows['DateTime']).min()).dt.total_seconds()
+    # Columns without two numeric values are left out
+    assert list(stats) == ['TAG_000', 'TAG_001', TARGET_VARIABLE]
+    for col, col_stats in stats.items():
+        values = rows[col].dropna()
+        slope = np.polyfit(seconds[values.index], values, 1)[0]
+        correlation = 0 if col == TARGET_VARIABLE else rows[col].corr(rows[TARGET_VARIABLE])
+        assert col_stats == pytest.approx({
+            'mean': values.mean(),
+            'std': values.std(),
+            'trend': slope * 3600 / values.mean(),
+            'volatility': values.std() / values.mean() * 100,
+            'min': values.min(),
+            'max': values.max(),
+            'range': values.max() - values.min(),
+            'correlation': correlation,
+        }, rel=1e-9, abs=1e-12)
+
+
+def test_ndjson_responses_hold_the_json_response(client, baseline):
+    body = {**baseline['request'], 'batch_id': 'B100001'}
+    result = client.post('/transformations/batch-details', json=body).json()
+
+    response = client.post('/transformations/batch-details', json=body, headers={'Accept': 'application/x-ndjson'})
+
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    first, *rows = [json.loads(line) for line in response.text.splitlines()]
+    assert first == {key: value for key, value in result.items() if key != 'processed_data'}
+    assert rows == result['processed_data']
+
+
+def test_ndjson_chunks_encode_the_records_of_the_rows():
+    df = pd.DataFrame({
+        'DateTime': pd.date_range('2024-01-01', periods=5, freq='min'),
+        'BATCH': pd.Categorical(['A', 'A', 'B', 'B', 'B']),
+        'TAG_000': np.array([1.1, np.nan, np.inf, 304.4681, -2.5], dtype=np.float32),
+        TARGET_VARIABLE: [0.1, 0.2, None, 0.4, 0.5],
+    })
+
+    chunks = list(iter_ndjson(serializable_frame(df), chunk_rows=2))
+
+    assert len(chunks) == 3
+    assert [json.loads(line) for chunk in chunks for line in chunk.splitlines()] == frame_records(df)
+
+
+def test_multiple_batches_are_not_streamed(client, baseline):
+    response = client.post('/transformations/batch-details', json={**baseline['request'], 'batch_ids': 'all'},
+                           headers={'Accept': 'application/x-ndjson'})
+
+    assert response.headers['content-type'] == 'application/json'
+    assert 'batches' in response.json()
+
+
+def looped_rolling_correlations(df, variable, target_variable, window):
+    """Pearson correlation over the window ending at each row, computed window by window"""
+    df = df.assign(DateTime=pd.to_datetime(df['DateTime'])).sort_values('DateTime', kind='stable')
+    correlations = []
+    for end in range(len(df)):
+        if isinstance(window, str):
+            start = int(np.searchsorted(df['DateTime'], df['DateTime'].iloc[end] - pd.Timedelta(window), side='right'))
+        else:
+            start = max(end + 1 - window, 0)
+        rows = df.iloc[start:end + 1][[variable, target_variable]].dropna()
+        spread = len(rows) >= 2 and rows[variable].std() > 0 and rows[target_variable].std() > 0
+        correlations.append(np.corrcoef(rows[variable], rows[target_variable])[0, 1] if spread else None)
+    return correlations
+
+
+@pytest.mark.parametrize('window', [2, 25, '30min'])
+def test_rolling_correlations_match_the_correlation_of_each_window(window):
+    df = production_frame(400, 1, 2, nan_ratio=0.1, seed=10).sample(frac=1, random_state=10)
+    # A stretch without spread has no correlation
+    df.loc[df['DateTime'] < '2024-01-01T00:40:00', 'TAG_001'] = 5.0
+
+    correlations = calculate_rolling_correlations(df, ['TAG_000', 'TAG_001'], TARGET_VARIABLE, window)
+
+    for variable in ('TAG_000', 'TAG_001'):
+        expected = looped_rolling_correlations(df, variable, TARGET_VARIABLE, window)
+        values = [point[1] for point in correlations[variable]]
+        assert [value is None for value in values] == [value is None for value in expected]
+        # Window sums are differences of running sums, which costs some precision
+        np.testing.assert_allclose([value for value in values if value is not None],
+                                   [value for value in expected if value is not None], atol=1e-6)
+
+
+def test_batch_details_give_rolling_correlations_with_a_window(client, baseline):
+    body = {**baseline['request'], 'batch_id': 'B100001', 'correlation_window': '15min'}
+
+    result = client.post('/transformations/batch-details', json=body).json()
+
+    df = pd.DataFrame(baseline['request']['production_data']['columns'])
+    batch = df[df['BATCH'] == 'B100001']
+    for variable in ('TAG_000', 'TAG_001', 'TAG_002'):
+        expected = looped_rolling_correlations(batch, variable, TARGET_VARIABLE, '15min')
+        assert [point[1] for point in result['correlations_data'][variable]] == pytest.approx(expected, abs=1e-4)
+
+
+@pytest.mark.parametrize('window', [1, 0, '-5min', 'soon', True])
+def test_invalid_correlation_windows_are_rejected(client, baseline, window):
+    response = client.post('/transformations/batch-details',
+                           json={**baseline['request'], 'batch_id': 'B100001', 'correlation_window': window})
+
+    assert response.status_code == 400
+    assert response.json()['detail']['field'] == 'correlation_window'
+
+
+@pytest.mark.parametrize('window', [None, '15min'])
+def test_batch_details_are_cached_with_or_without_a_window(client, baseline, window):
+    body = {**baseline['request'], 'batch_id': 'B100001', 'correlation_window': window}
+
+    client.post('/transformations/batch-details', json=body)
+    client.post('/transformations/batch-details', json=body)
+
+    assert client.get('/transformations/cache').json()['hits'] == 1
@@ -0,0 +1,31 @@
+import json
+
+import run
+from synthetic import TARGET_VARIABLE, alertman_frame, dataset, production_frame
+
+
+def test_synthetic_datasets_are_reproducible():
+    df = production_frame(500, 10, 4, seed=3)
+
+    assert df.equals(production_frame(500, 10, 4, seed=3))
+    assert df['BATCH'].nunique() == 10 and df['BATCH'].is_monotonic_increasing
+    assert df[['TAG_000', 'TAG_001', 'TAG_002', 'TAG_003']].isna().mean().mean() > 0
+    alertman = alertman_frame(df, 3, tags=2, seed=3)
+    assert len(alertman) == 6 and alertman['state__extra__batch_id'].iloc[0] == df['BATCH'].iloc[0]
+    assert dataset(df.head(2), 'columns')['columns'][TARGET_VARIABLE] == df[TARGET_VARIABLE].head(2).tolist()
+
+
+def test_benchmarks_run_and_compare_with_a_previous_run(tmp_path, capsys):
+    output = str(tmp_path / 'results.json')
+    arguments = ['--rows', '2000', '--batches', '10', '--tags', '3', '--iterations', '2', '--warmup', '0',
+                 '--mode', 'all', '--output', output]
+
+    assert run.main(arguments) == 0
+    with open(output) as f:
+        results = json.load(f)
+    names = [result['name'] for result in results['results']]
+    assert 'inprocess.process_data' in names and 'asgi.process-data' in names
+
+    # A run compared with itself has no regression
+    assert run.main(arguments[:-2] + ['--cases', 'process_data', '--compare', output, '--threshold', '100']) == 0
+    assert 'process_data' in capsys.readouterr().out
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from synthetic import production_frame
+from analysis.cache import ResultCache, dataset_fingerprint
+
+
+def test_fingerprints_follow_the_columns_a_result_reads():
+    df = production_frame(200, 4, 2, seed=12)
+    columns = ['BATCH', 'TAG_000']
+    fingerprint = dataset_fingerprint(df, columns)
+
+    assert dataset_fingerprint(df[df.columns[::-1]], columns) == fingerprint
+    assert dataset_fingerprint(df.assign(TAG_001=0.0), columns) == fingerprint
+    assert dataset_fingerprint(df.assign(TAG_000=df['TAG_000'] + 1e-9), columns) != fingerprint
+    # Row order decides the batch order
+    assert dataset_fingerprint(df.iloc[::-1], columns) != fingerprint
+    assert dataset_fingerprint(pd.DataFrame({'BATCH': [['A']]}), ['BATCH']) is None
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = ResultCache(maxsize=100, max_bytes=20_000)
+    for i in range(10):
+        cache.set(i, {'processed_data': list(range(500))})
+
+    stats = cache.stats()
+    assert 0 < stats['size'] < 10
+    assert stats['bytes'] <= 20_000
+    assert cache.get(9) is not None and cache.get(0) is None
+
+
+def test_repeated_requests_are_answered_from_the_cache(client, baseline):
+    request = {**baseline['request'], 'batch_id': 'B100001'}
+
+    first = client.post('/transformations/batch-details', json=request).json()
+    second = client.post('/transformations/batch-details', json=request).json()
+    # Other parameters are another result
+    client.post('/transformations/batch-details', json={**request, 'max_points': 12})
+
+    assert second == first
+    stats = client.get('/transformations/cache').json()
+    assert (stats['size'], stats['hits'], stats['misses']) == (2, 1, 2)
+
+
+def test_results_evicted_while_the_job_ran_are_computed_again(client, transformations, baseline, monkeypatch):
+    expected = client.post('/transformations/process-data', json=baseline['request']).json()
+    # The job sees the result in the cache, which no longer holds it when the job is done
+    monkeypatch.setattr(transformations.result_cache.cache, 'get', lambda key, default=None: default)
+
+    assert client.post('/transformations/process-data', json=baseline['request']).json() == expected
+    stats = client.get('/transformations/cache').json()
+    assert (stats['hits'], stats['misses']) == (0, 2)
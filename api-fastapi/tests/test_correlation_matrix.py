@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic import TARGET_VARIABLE, production_frame
+from analysis.pipeline import calculate_correlation_matrix
+
+
+def pandas_matrix(values, method):
+    matrix = pd.DataFrame(values).corr(method=method, min_periods=2).to_numpy()
+    return np.where(np.isfinite(matrix), matrix, np.nan)
+
+
+@pytest.mark.parametrize('method', ['pearson', 'spearman'])
+@pytest.mark.parametrize('nan_ratio', [0, 0.2])
+def test_correlation_matrix_matches_pandas(method, nan_ratio):
+    df = production_frame(500, 4, 5, nan_ratio=nan_ratio, seed=9)
+    values = df[['TAG_000', 'TAG_001', 'TAG_002', 'TAG_003', 'TAG_004', TARGET_VARIABLE]].to_numpy(dtype=float)
+    # Ties for Spearman, and a column without spread
+    values[:, 1] = np.round(values[:, 1], -1)
+    values[:, 4] = 3.0
+
+    matrix = calculate_correlation_matrix(values, method)
+
+    np.testing.assert_allclose(matrix, pandas_matrix(values, method), rtol=1e-9, atol=1e-12)
+    assert np.isnan(matrix[4]).all()
+
+
+def test_correlation_matrix_leaves_out_pairs_with_too_few_rows():
+    values = np.array([[1.0, np.nan], [2.0, 1.0], [3.0, np.nan], [4.0, np.nan]])
+
+    matrix = calculate_correlation_matrix(values)
+
+    assert matrix[0, 0] == 1
+    assert np.isnan(matrix[0, 1]) and np.isnan(matrix[1, 1])
+
+
+def test_correlation_matrix_endpoint(client, baseline):
+    request = baseline['request']
+    df = pd.DataFrame(request['production_data']['columns'])
+    uptime = df[(df['run_state'] == 'Uptime') & (df['BATCH'] == 'B100001')]
+
+    response = client.post('/transformations/correlation-matrix',
+                           json={**request, 'method': 'spearman', 'batch_id': 'B100001'})
+
+    assert response.status_code == 200
+    result = response.json()
+    variables = ['TAG_000', 'TAG_001', 'TAG_002', TARGET_VARIABLE]
+    assert result['variables'] == variables
+    assert result['rows'] == len(uptime)
+    np.testing.assert_allclose(result['matrix'], uptime[variables].corr(method='spearman'), rtol=1e-4)
+
+
+def test_correlation_matrix_rejects_unknown_methods(client, baseline):
+    response = client.post('/transformations/correlation-matrix', json={**baseline['request'], 'method': 'kendall'})
+
+    assert response.status_code == 400
+    assert response.json()['detail']['field'] == 'method'
+
+
+@pytest.mark.parametrize('filters', [{}, {'batch_ids': ['B100001'], 'start': '2024-01-01T01:30:00'}])
+def test_correlation_matrices_are_cached(client, baseline, filters):
+    body = {**baseline['request'], **filters}
+
+    first = client.post('/transformations/correlation-matrix', json=body).json()
+    # Another time range is another result
+    other = client.post('/transformations/correlation-matrix', json={**body, 'end': '2024-01-01T02:00:00'}).json()
+    second = client.post('/transformations/correlation-matrix', json=body).json()
+
+    assert second == first != other
+    assert client.get('/transformations/cache').json()['hits'] == 1
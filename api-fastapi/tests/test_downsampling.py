@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from analysis.downsampling import downsample_points, lttb_indices, minmax_indices
+
+
+def looped_lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets as described by Steinarsson, one point at a time"""
+    every = (len(x) - 2) / (n - 2)
+    selected = [0]
+    a = 0
+    for i in range(n - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(x))
+        mean_x, mean_y = np.mean(x[end:next_end]), np.mean(y[end:next_end])
+
+        areas = [abs((x[a] - mean_x) * (y[j] - y[a]) - (x[a] - x[j]) * (mean_y - y[a])) for j in range(start, end)]
+        a = start + int(np.argmax(areas))
+        selected.append(a)
+    return selected + [len(x) - 1]
+
+
+@pytest.mark.parametrize('size, n', [(1000, 50), (101, 3), (57, 56)])
+def test_lttb_matches_the_reference_algorithm(size, n):
+    rng = np.random.default_rng(size)
+    x = 1.7e12 + np.cumsum(rng.integers(1, 60_000, size)).astype(float)
+    y = np.cumsum(rng.normal(0, 1, size))
+
+    indices = lttb_indices(x, y, n)
+
+    assert indices.tolist() == looped_lttb(x - x[0], y, n)
+
+
+def test_minmax_keeps_the_extremes_of_each_bucket():
+    rng = np.random.default_rng(1)
+    y = rng.normal(0, 1, 1000)
+    x = np.arange(1000, dtype=float)
+
+    indices = minmax_indices(x, y, 20)
+
+    assert len(indices) <= 20
+    assert np.all(np.diff(indices) > 0)
+    for bucket in np.array_split(np.arange(1000), 10):
+        kept = y[np.intersect1d(indices, bucket)]
+        assert kept.min() == y[bucket].min() and kept.max() == y[bucket].max()
+
+
+def test_short_series_are_kept():
+    x = np.arange(5, dtype=float)
+
+    assert lttb_indices(x, x, 5).tolist() == [0, 1, 2, 3, 4]
+    assert minmax_indices(x, x, 8).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_points_without_a_value_are_left_out():
+    points = [[i, None if i % 3 == 0 else float(i % 7), 'Uptime'] for i in range(30)]
+
+    kept = downsample_points(points, 10)
+
+    assert len(kept) == 10
+    assert all(point[1] is not None for point in kept)
+    assert kept[0] == points[1] and kept[-1] == points[29]
+
+
+@pytest.mark.parametrize('downsampling', ['lttb', 'minmax'])
+def test_batch_details_are_downsampled_to_max_points(client, baseline, downsampling):
+    body = {**baseline['request'], 'batch_id': 'B100001', 'max_points': 24, 'downsampling': downsampling}
+    full = client.post('/transformations/batch-details', json={**body, 'max_points': None}).json()
+
+    result = client.post('/transformations/batch-details', json=body).json()
+
+    assert 0 < len(result['processed_data']) <= 24
+    # Kept rows are rows of the batch, in order
+    times = [row['DateTime'] for row in full['processed_data']]
+    kept = [times.index(row['DateTime']) for row in result['processed_data']]
+    assert kept == sorted(kept)
+    for variable, points in result['correlations_data'].items():
+        assert 0 < len(points) <= 24
+        assert all(point in full['correlations_data'][variable] for point in points)
+    assert result['variable_stats'] == full['variable_stats']
+
+
+def test_batch_details_need_enough_points_per_series(client, baseline):
+    # Three tags and the target need 3 points each with LTTB
+    response = client.post('/transformations/batch-details',
+                           json={**baseline['request'], 'batch_id': 'B100001', 'max_points': 11})
+
+    assert response.status_code == 400
+    assert response.json()['detail']['minimum'] == 12
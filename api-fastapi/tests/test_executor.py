@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from analysis.executor import PipelineExecutor
+from analysis.timing import StageTimer, current_timer, stage
+
+
+def timed_sum(values):
+    with stage('sum'):
+        return sum(values)
+
+
+@pytest.fixture
+def executor():
+    executor = PipelineExecutor(kind='thread', workers=1, max_pending=1, timeout=0.2)
+    yield executor
+    executor.shutdown()
+
+
+def test_run_returns_the_result_and_merges_the_stage_timings(executor):
+    async def run():
+        timer = StageTimer()
+        current_timer.set(timer)
+        return await executor.run(timed_sum, [1, 2, 3]), timer.stages
+
+    result, stages = asyncio.run(run())
+
+    assert result == 6
+    assert set(stages) == {'queue', 'sum'}
+    assert executor.stats()['pending'] == 0
+
+
+def test_jobs_beyond_max_pending_are_rejected_with_429(executor):
+    release = threading.Event()
+
+    async def run():
+        running = asyncio.ensure_future(executor.run(release.wait, 5))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(HTTPException) as rejected:
+                await executor.run(timed_sum, [1])
+        finally:
+            release.set()
+        await running
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 429
+    assert rejected.headers == {'Retry-After': '1'}
+    assert rejected.detail['max_pending'] == 1
+
+
+def test_jobs_that_take_longer_than_timeout_are_answered_with_504(executor):
+    release = threading.Event()
+
+    async def run():
+        with pytest.raises(HTTPException) as timed_out:
+            await executor.run(release.wait, 5)
+        # The job keeps its worker until it finishes
+        assert executor.stats()['pending'] == 1
+        release.set()
+        return timed_out.value
+
+    assert asyncio.run(run()).status_code == 504
+    executor.pool.shutdown(wait=True)
+    assert executor.stats()['pending'] == 0
+
+
+def test_process_pools_run_module_level_jobs():
+    executor = PipelineExecutor(kind='process', workers=1, timeout=60)
+    try:
+        assert asyncio.run(executor.run(timed_sum, [1, 2, 3])) == 6
+    finally:
+        executor.shutdown()
+
+
+def test_unknown_executor_kinds_are_rejected():
+    with pytest.raises(ValueError):
+        PipelineExecutor(kind='fiber')
+
+
+def test_endpoints_answer_with_the_executor_errors(client, transformations, baseline, monkeypatch):
+    monkeypatch.setattr(transformations, 'executor', PipelineExecutor(kind='thread', max_pending=0))
+
+    response = client.post('/transformations/process-data', json=baseline['request'])
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from synthetic import TARGET_VARIABLE, production_frame
+from analysis.payload import compact_frame, fits_float32
+from analysis.serialization import frame_records
+
+
+def test_compact_frame_converts_the_columns_it_can():
+    df = production_frame(2000, 10, 2, seed=13)
+    df['sensor_id'] = np.arange(len(df)) + 1.7e12
+    df['comment'] = [f'row {i}' for i in range(len(df))]
+    memory = df.memory_usage(deep=True).sum()
+
+    compact = compact_frame(df.copy())
+
+    assert pd.api.types.is_datetime64_any_dtype(compact['DateTime'])
+    assert isinstance(compact['BATCH'].dtype, pd.CategoricalDtype)
+    assert isinstance(compact['run_state'].dtype, pd.CategoricalDtype)
+    assert compact['TAG_000'].dtype == np.float32 and compact[TARGET_VARIABLE].dtype == np.float32
+    # Epoch-like values lose their precision as float32, distinct strings gain nothing as categoricals
+    assert compact['sensor_id'].dtype == np.float64
+    assert not isinstance(compact['comment'].dtype, pd.CategoricalDtype)
+    assert compact.memory_usage(deep=True).sum() < memory / 2
+
+
+def test_float32_columns_stay_within_the_tolerance_of_their_range():
+    values = np.array([100.0, 100.5, 101.0, np.nan])
+
+    assert fits_float32(values, values.astype(np.float32))
+    assert not fits_float32(values + 1e9, (values + 1e9).astype(np.float32))
+    with np.errstate(over='ignore'):
+        assert not fits_float32(np.array([1e300]), np.array([1e300]).astype(np.float32))
+
+
+def test_compacted_records_keep_the_values_that_were_sent():
+    df = pd.DataFrame({
+        'DateTime': ['2024-01-01T00:00:00', '2024-01-01T00:01:00', None],
+        'BATCH': ['A', 'A', 'A'],
+        'TAG_000': [304.4681, 0.1, np.nan],
+    })
+
+    assert frame_records(compact_frame(df.copy())) == [
+        {'DateTime': '2024-01-01T00:00:00', 'BATCH': 'A', 'TAG_000': 304.4681},
+        {'DateTime': '2024-01-01T00:01:00', 'BATCH': 'A', 'TAG_000': 0.1},
+        {'DateTime': None, 'BATCH': 'A', 'TAG_000': None},
+    ]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic import TARGET_VARIABLE, dataset, production_frame
+from analysis.pipeline import summarize_batches
+
+
+def test_process_data_matches_the_original_module(client, baseline, expected):
+    response = client.post('/transformations/process-data', json=baseline['request'])
+
+    assert response.status_code == 200
+    assert response.json() == expected['process_data']
+
+
+def test_process_data_reads_row_and_column_datasets_alike(client, baseline):
+    columns = baseline['request']['production_data']['columns']
+    df = pd.DataFrame(columns)
+    items = {**baseline['request'], 'production_data': dataset(df, 'items')}
+
+    by_columns = client.post('/transformations/process-data', json=baseline['request']).json()
+    by_items = client.post('/transformations/process-data', json=items).json()
+
+    assert by_items == by_columns
+
+
+def test_summarize_batches_matches_a_groupby_per_column():
+    df = production_frame(3000, 12, 4, nan_ratio=0.1, seed=3)
+    columns = [TARGET_VARIABLE, 'TAG_000', 'TAG_001', 'TAG_002', 'TAG_003']
+
+    summary = summarize_batches(df, columns, 'minute_level')
+
+    assert summary.index.tolist() == df['BATCH'].unique().tolist()
+    for col in columns:
+        grouped = df.groupby('BATCH', sort=False)[col]
+        np.testing.assert_array_equal(summary[('count', col)], grouped.count())
+        np.testing.assert_allclose(summary[('mean', col)], grouped.mean(), rtol=1e-12)
+        np.testing.assert_allclose(summary[('std', col)], grouped.std(), rtol=1e-9)
+    assert summary[('first', 'minute_level')].tolist() == df.groupby('BATCH', sort=False)['minute_level'].min().tolist()
+
+
+def test_process_data_leaves_missing_values_out_of_the_batch_means(client):
+    rows = pd.DataFrame({
+        'DateTime': [f'2024-01-01T00:0{i}:00' for i in range(8)],
+        'BATCH': ['A'] * 4 + ['B'] * 4,
+        'run_state': ['Uptime'] * 8,
+        'TAG_000': [10.0, 10.0, 10.0, 10.0, 12.0, None, 12.0, None],
+        TARGET_VARIABLE: [1.0] * 8,
+    })
+    body = {
+        'production_data': dataset(rows, 'columns'),
+        'alertman_data': {'items': [{'state__extra__batch_id': 'A', 'tag': 'TAG_000', 'decision': 'accepted'}]},
+        'target_variable': TARGET_VARIABLE,
+    }
+
+    processed_data = client.post('/transformations/process-data', json=body).json()['processed_data']
+
+    assert [record['BATCH'] for record in processed_data] == ['A', 'B']
+    deviation, = processed_data[1]['deviation_info']['deviations']
+    assert deviation['variable'] == 'TAG_000'
+    assert deviation['percent'] == pytest.approx(20)
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'production_data': {'items': []}, 'target_variable': TARGET_VARIABLE}, 'No production data available'),
+    ({'production_data': {'columns': {'BATCH': ['A']}}}, 'Target variable not specified'),
+])
+def test_process_data_reports_missing_inputs(client, body, error):
+    assert client.post('/transformations/process-data', json=body).json() == {'error': error}
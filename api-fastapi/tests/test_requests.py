@@ -0,0 +1,120 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import analysis.datasources
+from analysis.payload import ARROW_REQUEST_METADATA
+
+QUERY = {'site': 'CCM-X', 'line': 'L1', 'partFamily': 'PF1', 'timeRange': 3}
+
+
+def arrow_body(request):
+    """Arrow IPC stream of the production data, with the other fields in the schema metadata"""
+    table = pa.Table.from_pandas(pd.DataFrame(request['production_data']['columns']), preserve_index=False)
+    fields = {key: value for key, value in request.items() if key != 'production_data'}
+    table = table.replace_schema_metadata({ARROW_REQUEST_METADATA: json.dumps(fields)})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def test_arrow_requests_match_json_requests(client, baseline):
+    request = {**baseline['request'], 'batch_id': 'B100001'}
+    headers = {'Content-Type': 'application/vnd.apache.arrow.stream'}
+
+    for path in ('/transformations/process-data', '/transformations/batch-details'):
+        by_json = client.post(path, json=request).json()
+        by_arrow = client.post(path, content=arrow_body(request), headers=headers)
+
+        assert by_arrow.status_code == 200
+        assert by_arrow.json() == by_json
+
+
+def test_invalid_bodies_are_rejected(client):
+    response = client.post('/transformations/process-data', content=b'not arrow',
+                           headers={'Content-Type': 'application/vnd.apache.arrow.stream'})
+    assert response.status_code == 400
+
+    response = client.post('/transformations/process-data', content=b'{}', headers={'Content-Type': 'text/csv'})
+    assert response.status_code == 415
+
+    response = client.post('/transformations/process-data', json={'production_data': {'rows': []},
+                                                                   'target_variable': 'target'})
+    assert response.status_code == 400
+    assert response.json()['detail']['message'] == 'Invalid dataset format'
+
+
+@pytest.fixture
+def fetches(baseline, monkeypatch):
+    """Serve the datasets of the baseline request to datasource queries, recording the fetched datasets"""
+    columns = baseline['request']['production_data']['columns']
+    results = {
+        'production_data': {'items': [dict(zip(columns, row)) for row in zip(*columns.values())]},
+        'alertman_data': baseline['request']['alertman_data'],
+    }
+    fetches = []
+
+    async def fetch_dataset(name, params, headers):
+        fetches.append((name, params, headers.get('authorization')))
+        return json.dumps(results[name]).encode()
+
+    monkeypatch.setattr(analysis.datasources, 'fetch_dataset', fetch_dataset)
+    return fetches
+
+
+def test_datasets_are_fetched_from_query_parameters(client, baseline, fetches):
+    expected = client.post('/transformations/process-data', json=baseline['request']).json()
+
+    response = client.post('/transformations/process-data', json={**QUERY, 'target_variable': 'target'},
+                           headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 200
+    assert response.json() == expected
+    params = {name: str(value) for name, value in QUERY.items()}
+    assert sorted(fetches) == [('alertman_data', params, 'Bearer token'), ('production_data', params, 'Bearer token')]
+
+
+def test_only_the_datasets_that_are_not_sent_are_fetched(client, baseline, fetches):
+    request = {**baseline['request'], 'batch_id': 'B100001'}
+    expected = client.post('/transformations/batch-details', json=request).json()
+
+    response = client.post('/transformations/batch-details', json={**QUERY, **request, 'alertman_data': None})
+
+    assert response.json() == expected
+    assert [name for name, _, _ in fetches] == ['alertman_data']
+
+
+@pytest.mark.parametrize('query', [{'site': 'CCM-X'}, {**QUERY, 'line': 'L1; DROP TABLE'}, {**QUERY, 'timeRange': '3d'}])
+def test_invalid_query_parameters_are_rejected(client, fetches, query):
+    response = client.post('/transformations/process-data', json={**query, 'target_variable': 'target'})
+
+    assert response.status_code == 400
+    assert fetches == []
+
+
+def test_datasource_errors_are_answered_with_502(client, monkeypatch):
+    async def fetch_dataset(name, params, headers):
+        return b'{"error": "query failed"}'
+
+    monkeypatch.setattr(analysis.datasources, 'fetch_dataset', fetch_dataset)
+
+    response = client.post('/transformations/process-data', json={**QUERY, 'target_variable': 'target'})
+
+    assert response.status_code == 502
+    assert response.json()['detail']['error'] == 'query failed'
+
+
+def test_responses_carry_the_stage_timings(client, baseline):
+    response = client.post('/transformations/process-data', json=baseline['request'])
+
+    stages = dict(entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', '))
+    assert {'receive', 'parse', 'frame', 'filter', 'aggregate', 'deviations', 'serialize', 'total'} <= set(stages)
+    assert all(float(duration) >= 0 for duration in stages.values())
+
+    metrics = client.get('/transformations/metrics').json()
+    assert metrics['stages']['/transformations/process-data']['total']['count'] >= 1
+    assert metrics['executor']['pending'] == 0
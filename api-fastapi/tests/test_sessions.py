@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from synthetic import TARGET_VARIABLE, alertman_frame, dataset, production_frame
+from analysis.payload import compact_frame
+from analysis.pipeline import (
+    calculate_batch_deviations,
+    get_product_batches,
+    get_reco_tags,
+    summarize_batches,
+    summarize_production,
+)
+from analysis.sessions import BatchStatistics, affected_batches
+
+
+def test_merged_statistics_match_those_of_all_rows():
+    df = production_frame(2000, 15, 3, nan_ratio=0.1, seed=4)
+    # A batch with a single value, whose std is undefined until it gets a second one
+    df.loc[df['BATCH'] == 'B100003', 'TAG_000'] = [1.5] + [np.nan] * ((df['BATCH'] == 'B100003').sum() - 1)
+    columns = [TARGET_VARIABLE, 'TAG_000', 'TAG_001', 'TAG_002']
+
+    statistics = BatchStatistics(columns, 'minute_level')
+    # Chunks split batches, and rows come out of order
+    shuffled = df.sample(frac=1, random_state=4)
+    for rows in np.array_split(np.arange(len(df)), 3):
+        statistics.update(summarize_batches(shuffled.iloc[rows], columns, 'minute_level'))
+
+    full = summarize_batches(df, columns, 'minute_level')
+    summary = statistics.summary().loc[full.index]
+
+    pd.testing.assert_frame_equal(summary['count'], full['count'], check_dtype=False)
+    pd.testing.assert_frame_equal(summary['mean'], full['mean'], rtol=1e-10)
+    pd.testing.assert_frame_equal(summary['std'], full['std'], rtol=1e-8)
+    assert summary[('first', 'minute_level')].tolist() == full[('first', 'minute_level')].tolist()
+
+
+def test_affected_batches_follow_touched_recommendation_batches():
+    batches = ['A', 'B', 'C', 'D', 'E']
+
+    assert affected_batches(batches, ['D'], ['B', 'D']) == ['D', 'E']
+    assert affected_batches(batches, ['B'], ['B', 'D']) == ['B', 'C']
+    assert affected_batches(batches, ['A', 'C'], ['B', 'D']) == ['A', 'C']
+
+
+def test_appending_rows_matches_a_full_analysis_with_the_session_bounds(client, transformations):
+    df = production_frame(3000, 12, 3, seed=6)
+    alertman = alertman_frame(df, 3, seed=6)
+    first, second, third = df.iloc[:1500], df.iloc[1500:2200], df.iloc[2200:]
+
+    response = client.post('/transformations/process-data/sessions', json={
+        'production_data': dataset(first, 'columns'),
+        'alertman_data': dataset(alertman),
+        'target_variable': TARGET_VARIABLE,
+    })
+    assert response.status_code == 200
+    session_id = response.json()['session_id']
+    processed_data = {record['BATCH']: record for record in response.json()['processed_data']}
+
+    for rows in (second, third):
+        response = client.post(f'/transformations/process-data/sessions/{session_id}/append',
+                               json={'production_data': dataset(rows, 'columns')})
+        assert response.status_code == 200
+        updated = response.json()['processed_data']
+        # Only the batches the rows changed come back, not the first one
+        assert df['BATCH'].iloc[0] not in [record['BATCH'] for record in updated]
+        processed_data.update((record['BATCH'], record) for record in updated)
+
+    bounds = transformations.sessions.get(session_id).bounds
+    reco_tags, product_batches = get_reco_tags(alertman), get_product_batches(alertman)
+    summary, _, _, time_column = summarize_production(compact_frame(df.copy()), TARGET_VARIABLE, reco_tags, bounds)
+    expected = jsonable_encoder(calculate_batch_deviations(summary, TARGET_VARIABLE, reco_tags, product_batches,
+                                                           time_column))
+
+    assert list(processed_data) == [record['BATCH'] for record in expected]
+    for record, expected_record in zip(processed_data.values(), expected):
+        assert record['BATCHSTART'] == expected_record['BATCHSTART']
+        assert record[TARGET_VARIABLE] == pytest.approx(expected_record[TARGET_VARIABLE], rel=1e-9)
+        assert record['deviation_info']['total_deviation'] == pytest.approx(
+            expected_record['deviation_info']['total_deviation'], rel=1e-6)
+        assert record['deviation_info']['deviations'] == [
+            {**deviation, 'deviation': pytest.approx(deviation['deviation'], rel=1e-6),
+             'percent': pytest.approx(deviation['percent'], rel=1e-6),
+             'contribution': pytest.approx(deviation['contribution'], rel=1e-6)}
+            for deviation in expected_record['deviation_info']['deviations']
+        ]
+
+    assert client.delete(f'/transformations/process-data/sessions/{session_id}').status_code == 200
+    assert client.post(f'/transformations/process-data/sessions/{session_id}/append',
+                       json={'production_data': dataset(third, 'columns')}).status_code == 404
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic import TARGET_VARIABLE, alertman_frame, dataset, production_frame
+from analysis.sketches import TDigest
+
+QUANTILES = [0.001, 0.03, 0.25, 0.5, 0.75, 0.97, 0.999]
+
+
+def rank_error(values, estimate, q):
+    """Distance between q and the share of values below the estimate"""
+    return abs(np.searchsorted(np.sort(values), estimate) / len(values) - q)
+
+
+@pytest.mark.parametrize('distribution', ['normal', 'lognormal', 'uniform'])
+def test_quantiles_are_close_to_the_exact_ones(distribution):
+    values = getattr(np.random.default_rng(0), distribution)(size=200_000)
+
+    digest = TDigest.from_values(values, chunk_rows=10_000)
+
+    assert digest.count == len(values)
+    for q in QUANTILES:
+        assert rank_error(values, digest.quantile(q), q) <= 0.001
+    assert digest.quantile(0) == values.min() and digest.quantile(1) == values.max()
+
+
+def test_merged_digests_match_a_digest_of_all_values():
+    rng = np.random.default_rng(1)
+    chunks = [rng.normal(loc, 1, 20_000) for loc in (0, 0.5, 3)]
+    values = np.concatenate(chunks)
+
+    merged = TDigest()
+    for chunk in chunks:
+        merged.merge(TDigest.from_values(chunk))
+
+    assert merged.count == len(values)
+    # A digest stays bounded by its compression whatever the number of values
+    assert len(merged.means) < 200
+    for q in QUANTILES:
+        assert rank_error(values, merged.quantile(q), q) <= 0.003
+
+
+def test_missing_values_are_ignored():
+    digest = TDigest.from_values([np.nan, 1.0, 2.0, np.nan, 3.0])
+
+    assert digest.count == 3
+    assert digest.quantile(0.5) == 2.0
+    assert np.isnan(TDigest().quantile(0.5))
+
+
+@pytest.mark.parametrize('per_batch', [False, True])
+def test_tdigest_outliers_are_close_to_the_exact_ones(client, per_batch):
+    df = production_frame(20_000, 10, 3, seed=2)
+    body = {
+        'production_data': dataset(df, 'columns'),
+        'alertman_data': dataset(alertman_frame(df, 2, seed=2)),
+        'target_variable': TARGET_VARIABLE,
+    }
+
+    exact = client.post('/transformations/process-data',
+                        json={**body, 'outliers': {'method': 'exact', 'per_batch': per_batch}}).json()
+    approximate = client.post('/transformations/process-data',
+                              json={**body, 'outliers': {'method': 'tdigest', 'per_batch': per_batch}}).json()
+
+    exact = pd.DataFrame(exact['processed_data']).set_index('BATCH')[TARGET_VARIABLE]
+    approximate = pd.DataFrame(approximate['processed_data']).set_index('BATCH')[TARGET_VARIABLE]
+    pd.testing.assert_series_equal(approximate, exact, rtol=1e-3)
+
+
+def test_invalid_outlier_options_are_rejected(client, baseline):
+    response = client.post('/transformations/process-data',
+                           json={**baseline['request'], 'outliers': {'method': 'tdigest', 'quantiles': [0.9, 0.1]}})
+
+    assert response.status_code == 400
+    assert response.json()['detail']['field'] == 'outliers'
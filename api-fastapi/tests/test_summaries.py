@@ -0,0 +1,145 @@
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis.datasources
+from synthetic import TARGET_VARIABLE, alertman_frame, dataset, production_frame
+from analysis.payload import compact_frame
+from analysis.pipeline import closed_batches, get_product_batches, get_reco_tags, run_process_data, trim_ranges
+from analysis.summaries import BatchSummaryStore
+
+SCOPE = 'CCM-X/L1/PF1/' + TARGET_VARIABLE
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BatchSummaryStore(str(tmp_path / 'summaries.db'))
+
+
+def windows(df, size, step):
+    """Sliding time windows over production data, as successive site/line/partFamily queries return them"""
+    for start in range(0, len(df) - size + 1, step):
+        yield compact_frame(df.iloc[start:start + size].reset_index(drop=True))
+
+
+def test_stored_summaries_match_the_full_analysis_of_sliding_windows(store):
+    df = production_frame(20000, 80, 6, seed=7)
+    alertman = alertman_frame(df, 6, seed=7)
+    reco_tags, product_batches = get_reco_tags(alertman), get_product_batches(alertman)
+
+    loads = []
+    load = store.load
+    store.load = lambda *args: loads.append(load(*args)) or loads[-1]
+
+    for window in windows(df, 10000, 997):
+        full = run_process_data(window.copy(), TARGET_VARIABLE, reco_tags, product_batches)
+        stored = run_process_data(window.copy(), TARGET_VARIABLE, reco_tags, product_batches, store, SCOPE)
+        assert stored == full
+
+    # Later windows read part of their batches from the store
+    assert len(loads[0]) == 0
+    assert all(len(loaded) > 0 for loaded in loads[1:])
+
+
+def test_stored_summaries_are_computed_again_when_the_bounds_trim_other_rows(store):
+    df = compact_frame(production_frame(4000, 20, 3, seed=1))
+    reco_tags = ['TAG_000', 'TAG_001']
+    run_process_data(df.copy(), TARGET_VARIABLE, reco_tags, [], store, SCOPE)
+
+    # Outliers added to the last batch move the bounds of the whole dataset
+    outliers = df[df['BATCH'] == df['BATCH'].iloc[-1]].copy()
+    outliers[TARGET_VARIABLE] = 1e6
+    shifted = pd.concat([df, outliers], ignore_index=True)
+
+    full = run_process_data(shifted.copy(), TARGET_VARIABLE, reco_tags, [])
+    assert run_process_data(shifted.copy(), TARGET_VARIABLE, reco_tags, [], store, SCOPE) == full
+
+
+def test_closed_batches_are_decided_from_timestamps():
+    df = pd.DataFrame({
+        'minute_level': pd.to_datetime(['2024-01-01 00:00', '2024-01-01 00:01', '2024-01-01 00:02',
+                                        '2024-01-01 00:03', '2024-01-01 00:04', '2024-01-01 00:05']),
+        'BATCH': ['A', 'B', 'B', 'C', 'C', 'D'],
+    })
+    assert closed_batches(df) == ['B', 'C']
+
+    # Rows out of order do not change which batches are closed
+    assert sorted(closed_batches(df.iloc[::-1])) == ['B', 'C']
+
+    assert closed_batches(df.drop(columns='minute_level')) == []
+
+
+def test_trim_ranges_bound_the_bounds_that_keep_the_same_rows():
+    df = pd.DataFrame({
+        'BATCH': ['A'] * 5 + ['B'] * 2,
+        'run_state': ['Uptime'] * 4 + ['Downtime'] + ['Uptime'] * 2,
+        TARGET_VARIABLE: [1.0, 2.0, 3.0, 4.0, 2.5, 10.0, 11.0],
+    })
+    ranges = trim_ranges(df, TARGET_VARIABLE, (1.5, 3.5), ['A', 'B'])
+
+    assert ranges.loc['A'].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert ranges.loc['B'].tolist() == [-np.inf, 10.0, -np.inf, 10.0]
+
+
+def test_load_filters_batches_and_variables_in_the_store(store):
+    df = compact_frame(production_frame(3000, 10, 3, seed=2))
+    run_process_data(df.copy(), TARGET_VARIABLE, ['TAG_000'], [], store, SCOPE)
+
+    with sqlite3.connect(store.path) as connection:
+        batch, = connection.execute("SELECT batch FROM batches LIMIT 1").fetchone()
+        bounds = connection.execute(
+            "SELECT low_to, high_from FROM batches WHERE batch = ?", (batch,)
+        ).fetchone()
+
+    loaded = store.load(SCOPE, [batch, 'unknown'], [TARGET_VARIABLE, 'TAG_000'], 'minute_level', bounds)
+    assert loaded.index.tolist() == [batch]
+
+    # Variables that were not stored leave the batch out
+    assert store.load(SCOPE, [batch], [TARGET_VARIABLE, 'TAG_001'], 'minute_level', bounds).empty
+
+
+def test_stores_of_an_older_layout_are_cleared(tmp_path):
+    path = str(tmp_path / 'summaries.db')
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE scopes (scope TEXT PRIMARY KEY, low REAL, high REAL, time_column TEXT)")
+        connection.execute("CREATE TABLE batches (scope TEXT, batch TEXT, first, PRIMARY KEY (scope, batch))")
+        connection.execute("INSERT INTO batches VALUES ('scope', 'B1', NULL)")
+
+    store = BatchSummaryStore(path)
+    assert store.load('scope', ['B1'], [TARGET_VARIABLE], None, (0, 1)).empty
+
+
+def test_process_data_reads_site_line_part_family_datasets_through_the_store(client, transformations, store,
+                                                                            monkeypatch):
+    df = production_frame(4000, 16, 3, seed=14)
+    alertman = alertman_frame(df, 3, seed=14)
+    results = {'production_data': dataset(df), 'alertman_data': dataset(alertman)}
+
+    async def fetch_dataset(name, params, headers):
+        return json.dumps(results[name]).encode()
+
+    monkeypatch.setattr(analysis.datasources, 'fetch_dataset', fetch_dataset)
+    monkeypatch.setattr(transformations, 'summary_store', store)
+    query = {'site': 'CCM-X', 'line': 'L1', 'partFamily': 'PF1', 'timeRange': 3, 'target_variable': TARGET_VARIABLE}
+    expected = client.post('/transformations/process-data', json={
+        'production_data': dataset(df, 'columns'), 'alertman_data': dataset(alertman), 'target_variable': TARGET_VARIABLE
+    }).json()
+
+    assert client.post('/transformations/process-data', json=query).json() == expected
+
+    # Mark the stored statistics to tell them from statistics computed again
+    with sqlite3.connect(store.path) as connection:
+        connection.execute("UPDATE statistics SET mean = mean + 1000 WHERE variable = ?", (TARGET_VARIABLE,))
+        stored = [batch for batch, in connection.execute("SELECT batch FROM batches")]
+    transformations.result_cache.clear()
+    second = client.post('/transformations/process-data', json=query).json()
+
+    # The closed batches, all but the first and the last one, are read from the store
+    assert sorted(stored) == sorted(df['BATCH'].unique()[1:-1])
+    assert len(second['processed_data']) == len(expected['processed_data'])
+    for record, expected_record in zip(second['processed_data'], expected['processed_data']):
+        offset = 1000 if record['BATCH'] in stored else 0
+        assert record[TARGET_VARIABLE] == pytest.approx(expected_record[TARGET_VARIABLE] + offset)
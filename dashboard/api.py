@@ -1,9 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+import io
+import os
+import re
 import json
+import time
+import atexit
+import itertools
+import threading
+import concurrent.futures
 import clickhouse_connect
+from clickhouse_connect import common
+from clickhouse_connect.driver.httputil import get_pool_manager
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from cachetools import TTLCache
 
 app = Flask(__name__)
 # Configure CORS properly with all necessary settings
@@ -16,21 +29,241 @@ CORS(app,
      }}
 )
 
+# Response formats of /api/data: a list of records, {"columns": {name: [values]}}
+# or an Arrow IPC stream per dataset
+RESPONSE_FORMATS = ('records', 'columns', 'arrow')
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Dataset sent as the Arrow stream of an Arrow response, the others go as
+# columns JSON in the 'request' schema metadata, the Arrow request layout
+# of the transformations API. Streamed responses stream this dataset too
+ROWS_DATASET = 'production_data'
+ARROW_METADATA = b'request'
+# Arrow types of ClickHouse column types, other types are sent as strings
+ARROW_TYPES = {
+    'Bool': pa.bool_(),
+    'Int8': pa.int8(), 'Int16': pa.int16(), 'Int32': pa.int32(), 'Int64': pa.int64(),
+    'UInt8': pa.uint8(), 'UInt16': pa.uint16(), 'UInt32': pa.uint32(), 'UInt64': pa.uint64(),
+    'Float32': pa.float32(), 'Float64': pa.float64(),
+    'Date': pa.date32(), 'Date32': pa.date32(),
+    'String': pa.string(),
+}
+TYPE_WRAPPER_PATTERN = re.compile(r'^(?:Nullable|LowCardinality)\((.*)\)$')
+DECIMAL_TYPE_PATTERN = re.compile(r'^Decimal\((\d+), (\d+)\)$')
+DATETIME_TYPE_PATTERN = re.compile(r"^DateTime(?:64\((\d)(?:, '([^']+)')?\)|\('([^']+)'\))?$")
+TIMESTAMP_UNITS = {0: 's', 3: 'ms', 6: 'us', 9: 'ns'}
+
+# Aggregates of the aggregated production_data mode, by column name suffix
+AGGREGATES = {'count': 'count', 'avg': 'avg', 'std': 'stddevSamp', 'min': 'min', 'max': 'max'}
+# Quantiles of the target outside which rows are outliers, as in process_data
+TARGET_QUANTILES = (0.03, 0.97)
+NUMERIC_TYPE_PATTERN = re.compile(r'^(Nullable\()?(U?Int|Float|Decimal)')
+# Columns of production_data the transformations read besides the target and recommendation tags
+PRODUCTION_COLUMNS = ('DateTime', 'minute_level', 'BATCH', 'BATCHSTART', 'run_state')
+SELECT_ALL_PATTERN = re.compile(r'^\s*SELECT\s+\*', re.IGNORECASE)
+
 # Load datasources configuration
 with open('datasources.json', 'r') as f:
     datasources = json.load(f)
 
+# ClickHouse connection settings, overridable through the environment
+CLICKHOUSE_HOST = os.environ.get('CLICKHOUSE_HOST', 'localhost')
+CLICKHOUSE_PORT = int(os.environ.get('CLICKHOUSE_PORT', 18123))
+CLICKHOUSE_DATABASE = os.environ.get('CLICKHOUSE_DATABASE', 'ccm')
+CLICKHOUSE_USER = os.environ.get('CLICKHOUSE_USER', 'default')
+CLICKHOUSE_PASSWORD = os.environ.get('CLICKHOUSE_PASSWORD', '')
+# Maximum number of open HTTP connections, requests wait for a free one beyond that
+CLICKHOUSE_POOL_SIZE = int(os.environ.get('CLICKHOUSE_POOL_SIZE', 8))
+# Idle seconds before TCP keep-alive probes are sent on pooled connections
+CLICKHOUSE_KEEP_ALIVE = int(os.environ.get('CLICKHOUSE_KEEP_ALIVE', 30))
+# Seconds between pings of the shared client, it is reconnected when a ping fails
+CLICKHOUSE_HEALTH_CHECK_INTERVAL = float(os.environ.get('CLICKHOUSE_HEALTH_CHECK_INTERVAL', 30))
+# Default seconds a datasource query may take, a datasource can set its own "timeout"
+CLICKHOUSE_QUERY_TIMEOUT = float(os.environ.get('CLICKHOUSE_QUERY_TIMEOUT', 300))
+# Rows per block of streamed query results, which bounds the memory a stream takes
+CLICKHOUSE_STREAM_BLOCK_ROWS = int(os.environ.get('CLICKHOUSE_STREAM_BLOCK_ROWS', 65536))
+
+# Seconds query results are reused for, 0 disables the cache
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))
+# Memory the cached query results may take up, least recently used ones are evicted first
+QUERY_CACHE_MAX_MB = int(os.environ.get('QUERY_CACHE_MAX_MB', 512))
+
+# Requests run concurrently on the shared client, so queries must not share a server session
+common.set_setting('autogenerate_session_id', False)
+
+class ClickHousePool:
+    """Process-wide ClickHouse client reusing a pool of keep-alive HTTP connections"""
+
+    def __init__(self, host, port, database, username, password,
+                 pool_size=8, keep_alive=30, health_check_interval=30):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self.client = None
+        self.pool_mgr = None
+        self.checked = 0.0
+
+    def get_client(self):
+        """Get the shared client, connecting on first use or after a failed health check"""
+        with self.lock:
+            now = time.monotonic()
+            if self.client is not None and now - self.checked >= self.health_check_interval:
+                if self.client.ping():
+                    self.checked = now
+                else:
+                    print(f"ClickHouse at {self.host}:{self.port} failed health check, reconnecting")
+                    self._close()
+
+            if self.client is None:
+                print(f"Connecting to ClickHouse at {self.host}:{self.port}")
+                self.pool_mgr = get_pool_manager(
+                    keep_idle=self.keep_alive,
+                    num_pools=1,
+                    maxsize=self.pool_size,
+                    block=True
+                )
+                self.client = clickhouse_connect.get_client(
+                    host=self.host,
+                    port=self.port,
+                    database=self.database,
+                    username=self.username,
+                    password=self.password,
+                    pool_mgr=self.pool_mgr
+                )
+                self.checked = now
+
+            return self.client
+
+    def _close(self):
+        if self.client is not None:
+            self.client.close()
+            self.pool_mgr.clear()
+        self.client = None
+        self.pool_mgr = None
+
+    def close(self):
+        """Close the shared client and its pooled connections"""
+        with self.lock:
+            self._close()
+
+clickhouse_pool = ClickHousePool(
+    CLICKHOUSE_HOST,
+    CLICKHOUSE_PORT,
+    CLICKHOUSE_DATABASE,
+    CLICKHOUSE_USER,
+    CLICKHOUSE_PASSWORD,
+    pool_size=CLICKHOUSE_POOL_SIZE,
+    keep_alive=CLICKHOUSE_KEEP_ALIVE,
+    health_check_interval=CLICKHOUSE_HEALTH_CHECK_INTERVAL
+)
+atexit.register(clickhouse_pool.close)
+
 def get_clickhouse_client():
-    """Get a connection to ClickHouse using clickhouse-connect"""
-    host = 'localhost'
-    port = 18123
-    
-    print(f"Connecting to ClickHouse at {host}:{port}")
-    return clickhouse_connect.get_client(
-        host=host,
-        port=port,
-        database='ccm'
-    )
+    """Get the shared ClickHouse client, see ClickHousePool"""
+    return clickhouse_pool.get_client()
+
+# Datasource queries of a request run concurrently on these threads
+query_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CLICKHOUSE_POOL_SIZE,
+    thread_name_prefix='clickhouse-query'
+)
+atexit.register(query_executor.shutdown, wait=False)
+
+class QueryTimeoutError(Exception):
+    """A datasource query took longer than its timeout"""
+
+def result_size(result):
+    """Estimate the memory used by a query result DataFrame or Arrow table"""
+    if isinstance(result, pa.Table):
+        return max(result.nbytes, 1)
+    return max(int(result.memory_usage(deep=True).sum()), 1)
+
+class QueryCache:
+    """
+    Cache of query results keyed by the rendered query and result type.
+
+    Entries expire after a TTL and are evicted least recently used first once
+    their total memory usage exceeds max_bytes. Concurrent loads of the same
+    query are coalesced: the first caller runs the query and the others wait
+    for its result instead of sending the same query to ClickHouse.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = max_bytes > 0 and ttl > 0
+        self.cache = TTLCache(
+            maxsize=max(max_bytes, 1),
+            ttl=ttl if self.enabled else 1,
+            getsizeof=result_size
+        )
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, load):
+        """Get the cached result of a query, or load it once for all concurrent callers"""
+        with self.lock:
+            result = self.cache.get(key) if self.enabled else None
+            if result is not None:
+                self.hits += 1
+                return result
+
+            future = self.in_flight.get(key)
+            loading = future is None
+            if loading:
+                self.misses += 1
+                future = self.in_flight[key] = concurrent.futures.Future()
+            else:
+                self.coalesced += 1
+
+        if not loading:
+            return future.result()
+
+        try:
+            result = load()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            # Results larger than the whole cache are not kept
+            if self.enabled and self.cache.getsizeof(result) <= self.max_bytes:
+                self.cache[key] = result
+            del self.in_flight[key]
+        future.set_result(result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.cache),
+                'bytes': self.cache.currsize,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+query_cache = QueryCache(QUERY_CACHE_MAX_MB * 1024 ** 2, QUERY_CACHE_TTL)
 
 def format_query(query_template, **kwargs):
     """Format query template with proper string replacements"""
@@ -60,8 +293,465 @@ def clean_dataframe(df):
     
     return df
 
+def frame_columns(df):
+    """
+    Convert a DataFrame to {name: [values]} column by column.
+
+    Same values as clean_dataframe, without building a dict per row: NaN,
+    inf and -inf become None and datetimes become strings.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_float_dtype(values):
+            array = values.to_numpy(dtype=float)
+            cleaned = array.astype(object)
+            cleaned[~np.isfinite(array)] = None
+            columns[col] = cleaned.tolist()
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            strings = values.astype(str).to_numpy(dtype=object)
+            strings[values.isna().to_numpy()] = None
+            columns[col] = strings.tolist()
+        else:
+            columns[col] = values.astype(object).where(values.notna(), None).tolist()
+    return columns
+
+def encode_json(value):
+    """Encode a value as JSON like jsonify does, e.g. for dates, decimals and UUIDs"""
+    return app.json.dumps(value)
+
+def json_value(value):
+    """Convert a value that JSON can't encode natively the way encode_json does"""
+    if value is None or isinstance(value, (str, bool, int, float, list, dict)):
+        return value
+    return app.json.default(value)
+
+def clean_table(table):
+    """Replace NaN, inf and -inf values of an Arrow table with nulls, column by column"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            column = table.column(i)
+            table = table.set_column(i, field, pc.if_else(pc.is_finite(column), column, pa.scalar(None, field.type)))
+    return table
+
+def arrow_response(table, datasets):
+    """
+    Encode an Arrow table as an IPC stream response.
+
+    Args:
+        table: Arrow table of the ROWS_DATASET
+        datasets: Other datasets as {"columns": {name: [values]}}, passed as
+            JSON in the ARROW_METADATA key of the schema metadata
+
+    Returns:
+        Flask response
+    """
+    metadata = dict(table.schema.metadata or {})
+    metadata[ARROW_METADATA] = encode_json(datasets).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), mimetype=ARROW_MEDIA_TYPE)
+
+def ndjson_block(df):
+    """Encode a DataFrame block as NDJSON lines, with the values of clean_dataframe"""
+    if df.empty:
+        return ''
+
+    block = df.copy()
+    for col in block.columns:
+        values = block[col]
+        if pd.api.types.is_float_dtype(values):
+            # NaN is written as null
+            block[col] = values.where(np.isfinite(values))
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            block[col] = values.astype(str).where(values.notna(), None)
+        elif values.dtype == object:
+            # Dates, decimals and UUIDs are written as in the other datasets
+            block[col] = values.map(json_value)
+
+    lines = block.to_json(orient='records', lines=True, double_precision=15)
+    return lines if lines.endswith('\n') else lines + '\n'
+
+def query_timeout(name):
+    """Get the timeout in seconds of a datasource query"""
+    return float(datasources[name].get('timeout', CLICKHOUSE_QUERY_TIMEOUT))
+
+def fetch_query(client, name, query, arrow=False):
+    """Run a datasource query, or get its result from the cache, as a DataFrame or an Arrow table"""
+    def load():
+        print(f"{name} query: {query}")
+        start = time.perf_counter()
+        # ClickHouse stops the query itself once it runs out of time
+        settings = {'max_execution_time': query_timeout(name)}
+        if arrow:
+            result = client.query_arrow(query, settings=settings, use_strings=True)
+        else:
+            result = client.query_df(query, settings=settings)
+        print(f"{name} query returned {len(result)} rows in {time.perf_counter() - start:.2f}s")
+        return result
+
+    # Identical queries of concurrent requests share one ClickHouse query
+    return query_cache.get(('arrow' if arrow else 'df', query), load)
+
+def query_columns(client, name, query):
+    """Get the column names and ClickHouse types of a query result, without fetching its rows"""
+    def load():
+        result = client.query(f"SELECT * FROM ({query}) LIMIT 0",
+                              settings={'max_execution_time': query_timeout(name)})
+        return pd.DataFrame({'name': result.column_names, 'type': [t.name for t in result.column_types]})
+
+    return query_cache.get(('columns', query), load)
+
+def run_query(client, name, query, response_format='records'):
+    """
+    Run a datasource query and convert its result.
+
+    Args:
+        client: ClickHouse client
+        name: Datasource name
+        query: Formatted query
+        response_format: 'records' for a list of records, 'columns' for
+            {"columns": {name: [values]}} or 'arrow' for an Arrow table
+
+    Returns:
+        Converted query result
+    """
+    return convert_result(fetch_query(client, name, query, response_format == 'arrow'), response_format)
+
+def convert_result(result, response_format='records'):
+    """Convert a query result of fetch_query to a response format (see run_query)"""
+    if response_format == 'arrow':
+        return clean_table(result)
+    if response_format == 'columns':
+        return {'columns': frame_columns(result)}
+    result = clean_dataframe(result)
+    return result.to_dict(orient='records') if not result.empty else []
+
+def stream_query(client, name, query):
+    """
+    Stream the result of a datasource query block by block, bypassing the result cache.
+
+    Args:
+        client: ClickHouse client
+        name: Datasource name
+        query: Formatted query
+
+    Returns:
+        Iterator of DataFrame blocks of at most CLICKHOUSE_STREAM_BLOCK_ROWS rows
+    """
+    print(f"{name} query (streamed): {query}")
+    start = time.perf_counter()
+    rows = 0
+    settings = {'max_execution_time': query_timeout(name), 'max_block_size': CLICKHOUSE_STREAM_BLOCK_ROWS}
+    with client.query_df_stream(query, settings=settings) as stream:
+        for block in stream:
+            rows += len(block)
+            yield block
+    print(f"{name} query streamed {rows} rows in {time.perf_counter() - start:.2f}s")
+
+def iter_ndjson(blocks, datasets):
+    """
+    Encode a streamed dataset as NDJSON: a first line with the other
+    datasets, then one line per row of the blocks.
+    """
+    yield encode_json(datasets) + '\n'
+    for block in blocks:
+        yield ndjson_block(block)
+
+def arrow_type(column_type):
+    """Get the Arrow type of a ClickHouse column type, None for types sent as strings"""
+    match = TYPE_WRAPPER_PATTERN.match(column_type)
+    while match:
+        column_type = match.group(1)
+        match = TYPE_WRAPPER_PATTERN.match(column_type)
+
+    match = DECIMAL_TYPE_PATTERN.match(column_type)
+    if match:
+        precision, scale = int(match.group(1)), int(match.group(2))
+        return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+    match = DATETIME_TYPE_PATTERN.match(column_type)
+    if match:
+        precision, timezone = int(match.group(1) or 0), match.group(2) or match.group(3)
+        # Sub-second precisions without an Arrow unit are rounded up to the next one
+        unit = next(TIMESTAMP_UNITS[digits] for digits in sorted(TIMESTAMP_UNITS) if digits >= precision)
+        return pa.timestamp(unit, tz=timezone)
+    return ARROW_TYPES.get(column_type)
+
+def arrow_schema(columns):
+    """
+    Get the Arrow schema of a query result from its ClickHouse column types.
+
+    Args:
+        columns: Column names and ClickHouse types, see query_columns
+
+    Returns:
+        Arrow schema of nullable fields, columns without a matching Arrow type are strings
+    """
+    return pa.schema([
+        pa.field(name, arrow_type(column_type) or pa.string())
+        for name, column_type in zip(columns['name'], columns['type'])
+    ])
+
+def arrow_string(value):
+    """Convert a value of a column without a matching Arrow type to a string"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    return str(value)
+
+def iter_arrow(blocks, datasets, columns):
+    """
+    Encode a streamed dataset as an Arrow IPC stream, one record batch per
+    block, with the other datasets in the schema metadata as in arrow_response.
+
+    The schema comes from the ClickHouse column types rather than the first
+    block, where a column holding only nulls has no type, so every block
+    gets the same one.
+
+    Args:
+        blocks: DataFrame blocks of the streamed query
+        datasets: Converted results of the other datasources
+        columns: Column names and ClickHouse types of the streamed query, see query_columns
+    """
+    schema = arrow_schema(columns).with_metadata({ARROW_METADATA: encode_json(datasets).encode()})
+    as_strings = [
+        name for name, column_type in zip(columns['name'], columns['type'])
+        if arrow_type(column_type) is None
+    ]
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    # Empty results still send the schema
+    yield flush()
+    for block in blocks:
+        if as_strings:
+            block = block.assign(**{name: block[name].map(arrow_string) for name in as_strings})
+        table = clean_table(pa.Table.from_pandas(block, schema=schema, preserve_index=False))
+        writer.write_table(table)
+        yield flush()
+
+    writer.close()
+    yield flush()
+
+def run_queries(client, queries, formats=None, fetched=None):
+    """
+    Run independent datasource queries concurrently.
+
+    Each query is waited for until its own timeout since submission, so the
+    total latency is that of the slowest query rather than their sum.
+
+    Args:
+        client: ClickHouse client shared by the queries
+        queries: Dictionary of datasource names and formatted queries
+        formats: Optional dictionary of datasource names and their response
+            format (see run_query), records by default
+        fetched: Optional dictionary of datasource names and DataFrames
+            already fetched for this request, converted instead of queried again
+
+    Returns:
+        Dictionary of datasource names and their converted results
+    """
+    formats = formats or {}
+    fetched = fetched or {}
+    submitted = time.monotonic()
+    futures = {
+        name: query_executor.submit(run_query, client, name, query, formats.get(name, 'records'))
+        for name, query in queries.items()
+        if name not in fetched
+    }
+
+    results = wait_queries(futures, submitted)
+    for name in queries:
+        if name in fetched:
+            results[name] = convert_result(fetched[name], formats.get(name, 'records'))
+    return {name: results[name] for name in queries}
+
+def wait_queries(futures, submitted):
+    """
+    Wait for the results of datasource queries submitted to the query executor.
+
+    Args:
+        futures: Dictionary of datasource names and futures of their queries
+        submitted: time.monotonic() of their submission
+
+    Returns:
+        Dictionary of datasource names and the results of their futures
+    """
+    results = {}
+    try:
+        for name, future in futures.items():
+            remaining = submitted + query_timeout(name) - time.monotonic()
+            try:
+                results[name] = future.result(timeout=max(remaining, 0))
+            except concurrent.futures.TimeoutError:
+                raise QueryTimeoutError(f"{name} query timed out after {query_timeout(name):g}s")
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    return results
+
+def get_reco_tags(df_alertman):
+    """Get the recommendation tags, i.e. tags with a decision, from alertman data"""
+    if df_alertman.empty or 'decision' not in df_alertman.columns or 'tag' not in df_alertman.columns:
+        return []
+    return df_alertman[df_alertman['decision'].notna() & (df_alertman['decision'] != '')]['tag'].unique().tolist()
+
+def quote_identifier(name):
+    """Quote a column name for ClickHouse SQL"""
+    return '`' + str(name).replace('\\', '\\\\').replace('`', '\\`') + '`'
+
+def aggregate_query(query, columns, target_variable=None):
+    """
+    Generate a query aggregating the rows of a production query per BATCH.
+
+    Like process_data, rows without a BATCH and rows whose target value is
+    missing or outside the TARGET_QUANTILES of the target over all rows are
+    left out first, so the aggregates are those of the rows process_data
+    keeps. NaN and infinite target values count as missing.
+
+    Args:
+        query: Formatted production_data query
+        columns: Dictionary of numeric column names and ClickHouse types to aggregate
+        target_variable: Optional name of the target variable, rows are not
+            trimmed when it is not one of the columns
+
+    Returns:
+        Query with one row per BATCH, ordered by batch start: BATCH,
+        first_minute_level, row_count and a <column>__<aggregate> column for
+        each column and aggregate in AGGREGATES
+    """
+    values = {}
+    for column, column_type in columns.items():
+        value = quote_identifier(column)
+        if 'Float' in column_type:
+            # NaN and infinite values are left out like nulls
+            value = f"if(isFinite({value}), {value}, NULL)"
+        values[column] = value
+
+    selects = ['BATCH', 'min(minute_level) AS first_minute_level', 'count() AS row_count']
+    for column, value in values.items():
+        for suffix, function in AGGREGATES.items():
+            selects.append(f"{function}({value}) AS {quote_identifier(f'{column}__{suffix}')}")
+
+    # Rows without a batch are not grouped, as in process_data
+    aggregated = f"SELECT {', '.join(selects)} FROM ({query}) WHERE BATCH IS NOT NULL"
+    if target_variable in values:
+        # Decimals are compared as floats, like process_data does; the
+        # bounds are those of all rows, with or without a batch
+        target = f"toFloat64({values[target_variable]})"
+        low, high = TARGET_QUANTILES
+        aggregated = (
+            f"WITH (SELECT quantilesExactInclusive({low}, {high})({target}) FROM ({query})) AS _target_bounds "
+            f"{aggregated} AND {target} BETWEEN _target_bounds[1] AND _target_bounds[2]"
+        )
+    return f"{aggregated} GROUP BY BATCH ORDER BY first_minute_level"
+
+def fetch_analysis_inputs(client, queries):
+    """
+    Fetch the alertman data and the production_data schema concurrently,
+    once per request.
+
+    Args:
+        client: ClickHouse client
+        queries: Dictionary of datasource names and formatted queries
+
+    Returns:
+        Tuple of the alertman DataFrame, to pass on to run_queries as
+        fetched, and the production_data schema (see query_columns)
+    """
+    submitted = time.monotonic()
+    futures = {
+        'alertman_data': query_executor.submit(fetch_query, client, 'alertman_data', queries['alertman_data']),
+        'production_data': query_executor.submit(query_columns, client, 'production_data', queries['production_data']),
+    }
+    results = wait_queries(futures, submitted)
+    return results['alertman_data'], results['production_data']
+
+def analysis_columns(schema, reco_tags, target_variable):
+    """
+    Resolve the production_data columns of the target and of the
+    recommendation tags, in that order.
+
+    Args:
+        schema: production_data schema, see query_columns
+        reco_tags: Recommendation tags of the alertman data
+        target_variable: Name of the target variable
+
+    Returns:
+        Dictionary of the columns present in the production table and their ClickHouse types
+    """
+    types = dict(zip(schema['name'], schema['type']))
+    return {column: types[column] for column in dict.fromkeys([target_variable] + reco_tags) if column in types}
+
+def aggregated_production_query(query, schema, reco_tags, target_variable):
+    """
+    Generate the aggregated production_data query of the target and the
+    recommendation tags, see aggregate_query.
+
+    Tags missing from the production table or not numeric are left out.
+    """
+    columns = {
+        column: column_type
+        for column, column_type in analysis_columns(schema, reco_tags, target_variable).items()
+        if NUMERIC_TYPE_PATTERN.match(column_type)
+    }
+    return aggregate_query(query, columns, target_variable)
+
+def projected_production_query(query, schema, reco_tags, target_variable):
+    """
+    Generate a production_data query selecting only the PRODUCTION_COLUMNS,
+    the target and the recommendation tags.
+
+    The SELECT * of the template is replaced with the columns; other
+    templates are wrapped in a SELECT of the columns.
+    """
+    columns = [column for column in PRODUCTION_COLUMNS if column in set(schema['name'])]
+    columns = list(dict.fromkeys(columns + list(analysis_columns(schema, reco_tags, target_variable))))
+    selects = ', '.join(quote_identifier(column) for column in columns)
+
+    if SELECT_ALL_PATTERN.match(query):
+        return SELECT_ALL_PATTERN.sub(lambda match: f"SELECT {selects}", query, count=1)
+    return f"SELECT {selects} FROM ({query})"
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """Get size and hit/miss/coalesced counters of the query result cache"""
+    return jsonify(query_cache.stats())
+
 @app.route('/api/data', methods=['POST', 'OPTIONS'])
 def get_data():
+    """
+    Query the production and alertman data of a site, line and part family.
+
+    The response format is the "format" request field, "records" (default),
+    "columns" or "arrow", or "arrow" when the Accept header asks for an
+    Arrow stream. Arrow responses hold production_data as the stream and
+    the other datasets as columns JSON in its 'request' schema metadata.
+
+    With "stream": true, or an "Accept: application/x-ndjson" header,
+    production_data is streamed from ClickHouse block by block: as NDJSON,
+    a first line with the other datasets then one line per row, or for
+    the arrow format as one Arrow record batch per block.
+
+    With "aggregate": true and a "target_variable", production_data holds
+    per-BATCH statistics of the target and recommendation tags computed by
+    ClickHouse instead of the minute-level rows, see aggregate_query.
+    Otherwise, with a "target_variable", production_data only holds the
+    columns the transformations read, see projected_production_query.
+    """
     try:
         if request.method == 'OPTIONS':
             return '', 204
@@ -73,43 +763,71 @@ def get_data():
         time_range = params.get('timeRange')
 
         print(f"Received request with params: {params}")
+
+        response_format = params.get('format')
+        if response_format is None:
+            response_format = 'arrow' if ARROW_MEDIA_TYPE in request.headers.get('Accept', '') else 'records'
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({'error': f"Unknown format '{response_format}', supported: {', '.join(RESPONSE_FORMATS)}"}), 400
         
         client = get_clickhouse_client()
-        print("Successfully connected to ClickHouse")
-        
-        # Execute production data query
-        prod_query = format_query(
-            datasources['production_data']['query'],
-            site=site,
-            line=line,
-            partFamily=part_family,
-            timeRange=time_range
-        )
-        
-        print(f"Production query: {prod_query}")
-        prod_result = client.query_df(prod_query)
-        prod_result = clean_dataframe(prod_result)
-        production_data = prod_result.to_dict(orient='records') if not prod_result.empty else []
-        
-        # Execute alertman data query
-        alert_query = format_query(
-            datasources['alertman_data']['query'],
-            site=site,
-            partFamily=part_family
-        )
         
-        print(f"Alertman query: {alert_query}")
-        alert_result = client.query_df(alert_query)
-        alert_result = clean_dataframe(alert_result)
-        alertman_data = alert_result.to_dict(orient='records') if not alert_result.empty else []
-
-        response_data = {
-            'production_data': production_data,
-            'alertman_data': alertman_data
+        # Execute the production and alertman data queries concurrently
+        queries = {
+            name: format_query(
+                source['query'],
+                site=site,
+                line=line,
+                partFamily=part_family,
+                timeRange=time_range
+            )
+            for name, source in datasources.items()
         }
+
+        target_variable = params.get('target_variable')
+        if params.get('aggregate') and not target_variable:
+            return jsonify({'error': "target_variable is required to aggregate production data"}), 400
+
+        # Datasets already fetched to build the production_data query, reused in the response
+        fetched = {}
+        if target_variable:
+            fetched['alertman_data'], schema = fetch_analysis_inputs(client, queries)
+            reco_tags = get_reco_tags(fetched['alertman_data'])
+            build_query = aggregated_production_query if params.get('aggregate') else projected_production_query
+            queries['production_data'] = build_query(queries['production_data'], schema, reco_tags, target_variable)
+
+        if params.get('stream') or NDJSON_MEDIA_TYPE in request.headers.get('Accept', ''):
+            arrow = response_format == 'arrow'
+            others = {name: query for name, query in queries.items() if name != ROWS_DATASET}
+            submitted = time.monotonic()
+            if arrow:
+                # The Arrow schema comes from the column types, probed along with the other datasets
+                columns = query_executor.submit(query_columns, client, ROWS_DATASET, queries[ROWS_DATASET])
+            datasets = run_queries(client, others, {name: 'columns' if arrow else response_format for name in others}, fetched)
+            if arrow:
+                columns = wait_queries({ROWS_DATASET: columns}, submitted)[ROWS_DATASET]
+            blocks = stream_query(client, ROWS_DATASET, queries[ROWS_DATASET])
+            # Start the query before responding, so its errors still get an error response
+            first = next(blocks, None)
+            blocks = itertools.chain([] if first is None else [first], blocks)
+            if arrow:
+                return Response(iter_arrow(blocks, datasets, columns), mimetype=ARROW_MEDIA_TYPE)
+            return Response(iter_ndjson(blocks, datasets), mimetype=NDJSON_MEDIA_TYPE)
+
+        if response_format == 'arrow':
+            formats = {name: 'arrow' if name == ROWS_DATASET else 'columns' for name in queries}
+            response_data = run_queries(client, queries, formats, fetched)
+            return arrow_response(response_data.pop(ROWS_DATASET), response_data)
+
+        formats = {name: response_format for name in queries}
+        response_data = run_queries(client, queries, formats, fetched)
         
         return jsonify(response_data)
 
+    except QueryTimeoutError as e:
+        print(f"Error processing request: {e}")
+        return jsonify({'error': str(e)}), 504
+
     except Exception as e:
         error_msg = str(e) if str(e) != 'None' else "Unknown error occurred"
         print(f"Error processing request: {error_msg}")
@@ -0,0 +1,83 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+chdb = pytest.importorskip('chdb')
+
+DASHBOARD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_SRC_DIR = os.path.join(os.path.dirname(DASHBOARD_DIR), 'api-fastapi', 'src')
+
+COLUMNS = {'target': 'Nullable(Float64)', 'TAG_A': 'Float64', 'TAG_B': 'Nullable(Float64)'}
+
+
+@pytest.fixture(scope='module')
+def api():
+    # The API loads datasources.json from the working directory
+    cwd = os.getcwd()
+    os.chdir(DASHBOARD_DIR)
+    sys.path.insert(0, DASHBOARD_DIR)
+    try:
+        return importlib.import_module('api')
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    # process_data of the transformations API; appended so the dashboard api module keeps precedence
+    sys.path.append(API_SRC_DIR)
+    return importlib.import_module('analysis.pipeline')
+
+
+def production_rows(rows=3000, batches=12, seed=0):
+    """Uptime production rows with missing, non-finite and unbatched values"""
+    rng = np.random.default_rng(seed)
+    batch = np.array([f'B{i:03d}' for i in np.sort(rng.integers(0, batches, rows))], dtype=object)
+    # Unbatched rows hold extreme targets, which still move the outlier bounds
+    unbatched = rng.random(rows) < 0.05
+    batch[unbatched] = None
+    target = rng.normal(100, 5, rows)
+    target[unbatched] = rng.normal(130, 5, unbatched.sum())
+    target[rng.random(rows) < 0.02] = np.nan
+    target[:3] = [np.inf, -np.inf, np.nan]
+    tag_b = rng.normal(0, 1, rows)
+    tag_b[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        'minute_level': pd.date_range('2024-01-01', periods=rows, freq='min'),
+        'BATCH': batch,
+        'run_state': 'Uptime',
+        'target': target,
+        'TAG_A': rng.uniform(0, 50, rows),
+        'TAG_B': tag_b,
+    })
+
+
+def test_aggregate_query_matches_the_batch_statistics_of_process_data(api, pipeline):
+    production = production_rows()
+    query = api.aggregate_query('SELECT * FROM Python(production)', COLUMNS, 'target')
+    aggregated = chdb.query(query, 'DataFrame').set_index('BATCH')
+
+    # process_data leaves out non-finite targets along with missing ones
+    expected = production.replace([np.inf, -np.inf], np.nan)
+    summary, _, columns, _ = pipeline.summarize_production(expected, 'target', ['TAG_A', 'TAG_B'])
+
+    assert aggregated.index.tolist() == summary.index.tolist()
+    for column in columns:
+        np.testing.assert_array_equal(aggregated[f'{column}__count'], summary[('count', column)])
+        np.testing.assert_allclose(aggregated[f'{column}__avg'], summary[('mean', column)], rtol=1e-12)
+        np.testing.assert_allclose(aggregated[f'{column}__std'], summary[('std', column)], rtol=1e-9)
+    first = pd.to_datetime(aggregated['first_minute_level']).dt.tz_localize(None)
+    assert (first.to_numpy() == summary[('first', 'minute_level')].to_numpy()).all()
+
+
+def test_aggregate_query_leaves_out_rows_without_a_batch(api):
+    production = production_rows()
+    query = api.aggregate_query('SELECT * FROM Python(production)', COLUMNS)
+    aggregated = chdb.query(query, 'DataFrame')
+
+    assert aggregated['BATCH'].notna().all()
+    assert aggregated['row_count'].sum() == production['BATCH'].notna().sum()
@@ -0,0 +1,116 @@
+import importlib
+import os
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+DASHBOARD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUEST = {'site': 'CCM-X', 'line': 'L1', 'partFamily': 'PF1', 'timeRange': 3}
+
+
+@pytest.fixture(scope='module')
+def api():
+    # The API loads datasources.json from the working directory
+    cwd = os.getcwd()
+    os.chdir(DASHBOARD_DIR)
+    sys.path.insert(0, DASHBOARD_DIR)
+    try:
+        return importlib.import_module('api')
+    finally:
+        os.chdir(cwd)
+
+
+class ColumnType:
+    def __init__(self, name):
+        self.name = name
+
+
+class QueryResult:
+    def __init__(self, columns):
+        self.column_names = list(columns)
+        self.column_types = [ColumnType(column_type) for column_type in columns.values()]
+
+
+class FakeClient:
+    """ClickHouse client streaming production blocks whose first block has an all-null column"""
+
+    columns = {
+        'minute_level': 'DateTime',
+        'BATCH': 'String',
+        'target': 'Float64',
+        'comment': 'Nullable(String)',
+        'count': 'Nullable(Int32)',
+    }
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def query(self, query, settings=None):
+        return QueryResult(self.columns)
+
+    def query_df(self, query, settings=None):
+        return pd.DataFrame({'tag': ['TAG_1'], 'decision': ['accepted']})
+
+    @contextmanager
+    def query_df_stream(self, query, settings=None):
+        yield iter(self.blocks)
+
+
+def production_block(start, size, sparse):
+    rows = range(start, start + size)
+    return pd.DataFrame({
+        'minute_level': pd.date_range('2024-01-01', periods=size, freq='min') + pd.Timedelta(minutes=start),
+        'BATCH': [f'B{row // 4}' for row in rows],
+        'target': np.arange(start, start + size, dtype=float),
+        'comment': [None] * size if sparse else [f'row {row}' for row in rows],
+        'count': [np.nan] * size if sparse else [float(row) for row in rows],
+    })
+
+
+def test_stream_arrow_keeps_the_column_types_of_sparse_columns(api, monkeypatch):
+    blocks = [production_block(0, 4, sparse=True), production_block(4, 4, sparse=False)]
+    monkeypatch.setattr(api, 'get_clickhouse_client', lambda: FakeClient(blocks))
+    monkeypatch.setattr(api.query_cache, 'enabled', False)
+
+    response = api.app.test_client().post('/api/data', json={**REQUEST, 'format': 'arrow', 'stream': True})
+
+    assert response.status_code == 200
+    reader = pa.ipc.open_stream(response.data)
+    assert reader.schema.field('comment').type == pa.string()
+    assert reader.schema.field('count').type == pa.int32()
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [4, 4]
+    table = pa.Table.from_batches(batches)
+    assert table.column('comment').to_pylist() == [None] * 4 + [f'row {row}' for row in range(4, 8)]
+    assert table.column('count').to_pylist() == [None] * 4 + list(range(4, 8))
+
+
+def test_stream_arrow_sends_the_schema_of_empty_results(api, monkeypatch):
+    monkeypatch.setattr(api, 'get_clickhouse_client', lambda: FakeClient([]))
+    monkeypatch.setattr(api.query_cache, 'enabled', False)
+
+    response = api.app.test_client().post('/api/data', json={**REQUEST, 'format': 'arrow', 'stream': True})
+
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.data).read_all()
+    assert table.num_rows == 0
+    assert table.schema.names == list(FakeClient.columns)
+
+
+@pytest.mark.parametrize('column_type, expected', [
+    ('Nullable(Float64)', pa.float64()),
+    ('LowCardinality(Nullable(String))', pa.string()),
+    ('UInt64', pa.uint64()),
+    ('Decimal(18, 4)', pa.decimal128(18, 4)),
+    ("DateTime('Europe/Paris')", pa.timestamp('s', tz='Europe/Paris')),
+    ('DateTime64(3)', pa.timestamp('ms')),
+    ('Date32', pa.date32()),
+    ('UUID', None),
+])
+def test_arrow_type(api, column_type, expected):
+    assert api.arrow_type(column_type) == expected